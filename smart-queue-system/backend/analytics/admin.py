@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ActivityLog
+from .models import ActivityLog, ActivityRollup
 
 @admin.register(ActivityLog)
 class ActivityLogAdmin(admin.ModelAdmin):
@@ -7,3 +7,9 @@ class ActivityLogAdmin(admin.ModelAdmin):
     list_filter = ('action', 'service', 'counter')
     search_fields = ('user__username', 'service__name')
     ordering = ('-timestamp',)
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'granularity', 'service', 'counter_id', 'joins', 'calls', 'completions', 'skips', 'rejections')
+    list_filter = ('granularity', 'service')
+    ordering = ('-bucket',)
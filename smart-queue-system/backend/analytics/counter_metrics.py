@@ -0,0 +1,149 @@
+"""
+Live throughput and utilization of each counter over the current day.
+
+Every counter keeps a small dict in the cache, updated in O(1) per queue
+event by ``CounterMetricsSink``: calling an entry starts a service at its
+counter, and completing, skipping or rejecting that entry, or calling the
+next one, ends it. The state holds the number of entries served (completed),
+the mean and sum of squared deviations of service times (Welford's online
+algorithm) and the seconds spent serving and idle, from which ``metrics``
+derives entries served per hour, the service time variance and utilization,
+the share of open time spent serving. After each batch the sink pushes the
+metrics of the affected services to their staff group, so none of this runs
+in the request that called or completed the entry.
+
+States restart at local midnight and are kept by ``store``, a
+``CounterStateStore``. A service without state (cold cache, restart) is
+replayed once from today's ``ActivityLog`` by the sink or the endpoint,
+never by the queue views. Calls without a counter are left out.
+"""
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from notifications import publishing
+from notifications.sinks import COUNTER_EVENTS, CounterStateStore, QueueEventSink
+
+
+def _day(at):
+    return timezone.localdate(at).isoformat()
+
+
+class CounterMetricsStore(CounterStateStore):
+    prefix = 'counter_metrics'
+    subject = 'queue_entry_id'
+
+    def observe(self, state, event, entry_id, at):
+        # Events older than the last one applied, such as a redelivered event, are ignored.
+        config = settings.COUNTER_METRICS
+        timestamp = at.timestamp()
+        day = _day(at)
+        if not state or state['day'] != day:
+            state = {
+                'day': day, 'served': 0, 'samples': 0, 'mean': 0.0, 'm2': 0.0,
+                'busy': 0.0, 'idle': 0.0, 'entry': None, 'started': None, 'last': None,
+            }
+        elif state['last'] is not None and timestamp <= state['last']:
+            return state
+        else:
+            state = dict(state)
+
+        current = state['started'] is not None
+        if event != 'called' and not (current and state['entry'] == entry_id):
+            # Not about the entry this counter is serving.
+            return state
+
+        if current:
+            sample = timestamp - state['started']
+            if sample <= config['MAX_SERVICE_MINUTES'] * 60:
+                state['busy'] += sample
+                state['samples'] += 1
+                delta = sample - state['mean']
+                state['mean'] += delta / state['samples']
+                state['m2'] += delta * (sample - state['mean'])
+            if event == 'completed':
+                state['served'] += 1
+        elif state['last'] is not None and timestamp - state['last'] <= config['MAX_IDLE_MINUTES'] * 60:
+            state['idle'] += timestamp - state['last']
+
+        if event == 'called':
+            state.update(started=timestamp, entry=entry_id)
+        else:
+            state.update(started=None, entry=None)
+        state['last'] = timestamp
+        return state
+
+    def replay_since(self, until):
+        return timezone.make_aware(datetime.combine(timezone.localdate(until), time.min))
+
+
+store = CounterMetricsStore()
+
+
+def metrics(state, now=None):
+    """
+    Returns the metrics of a counter state as of ``now``, counting the current service or idle time so far.
+    """
+    config = settings.COUNTER_METRICS
+    now = now or timezone.now()
+    if not state or state['day'] != _day(now):
+        state = {'served': 0, 'samples': 0, 'mean': 0.0, 'm2': 0.0, 'busy': 0.0, 'idle': 0.0, 'started': None, 'last': None}
+
+    busy, idle = state['busy'], state['idle']
+    if state['started'] is not None:
+        busy += min(max(now.timestamp() - state['started'], 0), config['MAX_SERVICE_MINUTES'] * 60)
+    elif state['last'] is not None and now.timestamp() - state['last'] <= config['MAX_IDLE_MINUTES'] * 60:
+        idle += max(now.timestamp() - state['last'], 0)
+    open_seconds = busy + idle
+    return {
+        'served': state['served'],
+        'served_per_hour': round(state['served'] * 3600 / open_seconds, 2) if open_seconds else None,
+        'service_time_mean': round(state['mean'], 1) if state['samples'] else None,
+        'service_time_variance': round(state['m2'] / (state['samples'] - 1), 1) if state['samples'] > 1 else None,
+        'busy_seconds': round(busy, 1),
+        'idle_seconds': round(idle, 1),
+        'utilization': round(busy / open_seconds, 3) if open_seconds else None,
+        'serving': state['started'] is not None,
+    }
+
+
+def service_metrics(service_id, now=None):
+    """
+    Returns ``{counter_id: metrics}`` for the counters of a service that were active today.
+    """
+    store.ensure_loaded(service_id)
+    return {counter_id: metrics(state, now) for counter_id, state in (store.states(service_id) or {}).items()}
+
+
+class CounterMetricsSink(QueueEventSink):
+    """
+    Updates the metrics of the counters in a batch and pushes them to the staff of their services.
+    """
+
+    message_class = 'counter_metrics'
+
+    def handle(self, events):
+        updated = defaultdict(set)
+        for event_id, event in events:
+            counter_id = event['entry']['counter']
+            if event['event'] not in COUNTER_EVENTS or counter_id is None:
+                continue
+            service_id = event['service']['id']
+            store.record(service_id, counter_id, event['event'], event['entry']['id'], parse_datetime(event['at']))
+            updated[service_id].add(counter_id)
+
+        for service_id in updated:
+            publishing.group_send(f"service_{service_id}_staff", {
+                'type': 'send_staff_notification',
+                'message': {
+                    'type': 'counter_metrics',
+                    'service_id': service_id,
+                    'counters': [
+                        {'counter_id': counter_id, **counter_metrics}
+                        for counter_id, counter_metrics in service_metrics(service_id).items()
+                    ],
+                },
+            })
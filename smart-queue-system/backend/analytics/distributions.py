@@ -0,0 +1,179 @@
+"""
+Wait and service time distributions, computed with NumPy.
+
+The activity of a range is read as numeric columns only: ids, an action
+code and the timestamp in epoch seconds, all computed by the database. They
+are streamed in chunks into arrays and sorted by user, service and time, so
+that each activity is followed by the next one of the same user and
+service. Waits (a join followed by a call or terminal event) and service
+times (a call followed by a terminal event) then come out of a few array
+comparisons, and percentiles, histograms and heatmaps are taken per service
+and counter without a Python loop over activities.
+
+Histogram buckets are bounded by ``HISTOGRAM_EDGES`` seconds, the last one
+open-ended. Heatmaps count waits by weekday (Monday first) and hour of the
+day they ended, in the UTC offset of the start of the range.
+"""
+from itertools import chain, islice
+
+import numpy as np
+from django.db import NotSupportedError
+from django.db.models import ExpressionWrapper, F, FloatField, Func, IntegerField
+from django.db.models.functions import Coalesce
+
+from .models import ACTION_CODES, ActivityLog
+from .wait_times import LOOKBACK, WAIT_END_ACTIONS
+
+PAIRED_ACTIONS = ('user_join',) + WAIT_END_ACTIONS
+JOIN, CALLED = ACTION_CODES['user_join'], ACTION_CODES['user_called']
+WAIT_END_CODES = [ACTION_CODES[action] for action in WAIT_END_ACTIONS]
+SERVICE_END_CODES = [ACTION_CODES[action] for action in ('service_completed', 'user_skipped', 'user_rejected')]
+
+PERCENTILES = (50, 90, 99)
+HISTOGRAM_EDGES = (0, 60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200)
+CHUNK_SIZE = 50000
+
+
+class EpochSeconds(Func):
+    """
+    Seconds since the Unix epoch of a datetime column, as a float.
+    """
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f"Epoch seconds are not implemented for {connection.vendor}.")
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Julian day 2440587.5 is 1970-01-01T00:00:00Z. SQLite keeps milliseconds;
+        # rounding to them undoes the float error of the day fraction.
+        return super().as_sql(
+            compiler, connection, template='ROUND((julianday(%(expressions)s) - 2440587.5) * 86400.0, 3)'
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template='EXTRACT(EPOCH FROM %(expressions)s)::float8')
+
+
+def load_columns(start, end, service_id=None):
+    """
+    Returns the activity from a day before ``start`` to ``end`` as a ``(rows, 6)`` float array.
+
+    Columns are id, user id, service id, counter id (0 for none), action code
+    and epoch seconds.
+    """
+    logs = ActivityLog.objects.filter(timestamp__gte=start - LOOKBACK, timestamp__lt=end, action__in=PAIRED_ACTIONS)
+    if service_id is not None:
+        logs = logs.filter(service_id=service_id)
+    rows = logs.annotate(
+        # The stored code, read as a number rather than converted to the action name.
+        code=ExpressionWrapper(F('action'), output_field=IntegerField()),
+        epoch=EpochSeconds('timestamp'),
+        counter_or_zero=Coalesce('counter_id', 0),
+    ).values_list('id', 'user_id', 'service_id', 'counter_or_zero', 'code', 'epoch').order_by().iterator(chunk_size=CHUNK_SIZE)
+
+    chunks = []
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        # NULLs, e.g. the user of a deleted account, become NaN.
+        chunks.append(np.fromiter(chain.from_iterable(chunk), dtype=np.float64, count=len(chunk) * 6).reshape(-1, 6))
+    if not chunks:
+        return np.empty((0, 6))
+    return np.concatenate(chunks)
+
+
+def pairs(columns, start_epoch):
+    """
+    Returns the waits and service times that ended at or after ``start_epoch``.
+
+    Each is a dict of arrays: ``service``, ``counter``, ``ended_at`` and ``seconds``.
+    """
+    ids, users, services, counters, codes, epochs = columns.T
+    order = np.lexsort((ids, epochs, services, users))
+    users, services, counters, codes, epochs = users[order], services[order], counters[order], codes[order], epochs[order]
+
+    # Position i pairs each activity with the next one of the same user and
+    # service. Deleted users are NaN, which equals nothing, so they never pair.
+    same = (users[1:] == users[:-1]) & (services[1:] == services[:-1]) & (epochs[1:] >= start_epoch)
+    waits = same & (codes[:-1] == JOIN) & np.isin(codes[1:], WAIT_END_CODES)
+    served = same & (codes[:-1] == CALLED) & np.isin(codes[1:], SERVICE_END_CODES)
+
+    durations = epochs[1:] - epochs[:-1]
+    return (
+        # A wait belongs to the counter that called the entry.
+        {'service': services[1:][waits], 'counter': counters[1:][waits], 'ended_at': epochs[1:][waits], 'seconds': durations[waits]},
+        {'service': services[:-1][served], 'counter': counters[:-1][served], 'ended_at': epochs[1:][served], 'seconds': durations[served]},
+    )
+
+
+def summary(seconds):
+    """
+    Count, percentiles and histogram of an array of durations.
+    """
+    histogram = np.bincount(np.searchsorted(HISTOGRAM_EDGES, seconds, side='right') - 1, minlength=len(HISTOGRAM_EDGES))
+    data = {'count': int(seconds.size), 'histogram': histogram.tolist()}
+    values = np.percentile(seconds, PERCENTILES) if seconds.size else [None] * len(PERCENTILES)
+    for percentile, value in zip(PERCENTILES, values):
+        data[f'p{percentile}'] = None if value is None else round(float(value), 1)
+    return data
+
+
+def heatmap(ended_at, seconds, utc_offset):
+    """
+    Wait counts and p90 waits by weekday and hour, as two 7 x 24 grids.
+    """
+    local = ended_at + utc_offset
+    # 1970-01-01 was a Thursday.
+    cells = ((local // 86400 + 3) % 7 * 24 + local // 3600 % 24).astype(np.int64)
+    counts = np.bincount(cells, minlength=168)
+
+    p90 = [None] * 168
+    order = np.lexsort((seconds, cells))
+    boundaries = np.flatnonzero(np.diff(cells[order])) + 1
+    for group in np.split(order, boundaries):
+        if group.size:
+            p90[cells[group[0]]] = round(float(np.percentile(seconds[group], 90)), 1)
+    return {
+        'wait_count': counts.reshape(7, 24).tolist(),
+        'wait_p90': [p90[day * 24:(day + 1) * 24] for day in range(7)],
+    }
+
+
+def empty():
+    """
+    The distribution of a service without activity.
+    """
+    return {
+        'wait': summary(np.empty(0)),
+        'service_time': summary(np.empty(0)),
+        'heatmap': heatmap(np.empty(0), np.empty(0), 0),
+        'counters': [],
+    }
+
+
+def distributions(start, end, service_id=None):
+    """
+    Returns ``{service_id: {'wait', 'service_time', 'heatmap', 'counters'}}`` for activity ending in ``[start, end)``.
+    """
+    waits, served = pairs(load_columns(start, end, service_id), start.timestamp())
+    utc_offset = start.utcoffset().total_seconds()
+
+    results = {}
+    for service in np.union1d(np.unique(waits['service']), np.unique(served['service'])):
+        in_waits, in_served = waits['service'] == service, served['service'] == service
+        counters = np.union1d(np.unique(waits['counter'][in_waits]), np.unique(served['counter'][in_served]))
+        results[int(service)] = {
+            'wait': summary(waits['seconds'][in_waits]),
+            'service_time': summary(served['seconds'][in_served]),
+            'heatmap': heatmap(waits['ended_at'][in_waits], waits['seconds'][in_waits], utc_offset),
+            'counters': [
+                {
+                    'counter_id': int(counter) or None,
+                    'wait': summary(waits['seconds'][in_waits & (waits['counter'] == counter)]),
+                    'service_time': summary(served['seconds'][in_served & (served['counter'] == counter)]),
+                }
+                for counter in counters
+            ],
+        }
+    return results
@@ -0,0 +1,140 @@
+"""
+Streaming exports of the activity log and the queue entry history.
+
+Rows are read with ``.iterator(chunk_size=...)``, a server-side cursor on
+PostgreSQL, and encoded as CSV or NDJSON into chunks of about
+``CHUNK_BYTES``, optionally gzipped on the fly. Only one chunk of rows and
+one chunk of output are held at a time, so memory stays flat whatever the
+size of the export. ``ExportView`` streams the chunks as the response and
+the ``export_history`` command writes them to a file.
+
+Queue entry history covers both ``QueueEntry`` and ``ArchivedQueueEntry``,
+merged by creation time.
+"""
+import csv
+import heapq
+import io
+import json
+import zlib
+from datetime import date, datetime
+from operator import itemgetter
+
+from asgiref.sync import sync_to_async
+
+from smart_queue_app.models import ArchivedQueueEntry, QueueEntry
+from .models import ActivityLog
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+CHUNK_ROWS = 2000
+CHUNK_BYTES = 64 * 1024
+
+ACTIVITY_COLUMNS = (
+    'id', 'timestamp', 'action', 'service_id', 'service__name', 'counter_id', 'user_id', 'user__username',
+    'token_number', 'queue_entry_id', 'wait_ms', 'details'
+)
+QUEUE_ENTRY_COLUMNS = (
+    'id', 'created_at', 'updated_at', 'token_day', 'token_number', 'status',
+    'service_id', 'service__name', 'counter_id', 'user_id', 'user__username'
+)
+
+
+def activity_rows(start, end):
+    return ActivityLog.objects.filter(
+        timestamp__gte=start, timestamp__lt=end
+    ).order_by('timestamp', 'id').values_list(*ACTIVITY_COLUMNS).iterator(chunk_size=CHUNK_ROWS)
+
+
+def queue_entry_rows(start, end):
+    rows = [
+        model.objects.filter(
+            created_at__gte=start, created_at__lt=end
+        ).order_by('created_at', 'id').values_list(*QUEUE_ENTRY_COLUMNS).iterator(chunk_size=CHUNK_ROWS)
+        for model in (ArchivedQueueEntry, QueueEntry)
+    ]
+    return heapq.merge(*rows, key=itemgetter(1))
+
+
+# Columns written as JSON text in CSV exports.
+JSON_COLUMNS = ('details',)
+
+# Export name: (columns as written, row source).
+EXPORTS = {
+    'activity': ([column.replace('__', '_') for column in ACTIVITY_COLUMNS], activity_rows),
+    'queue-entries': ([column.replace('__', '_') for column in QUEUE_ENTRY_COLUMNS], queue_entry_rows),
+}
+
+
+def export(name, start, end, output='csv', compress=False):
+    """
+    Yields the ``name`` export of ``[start, end)`` as chunks of bytes.
+    """
+    columns, source = EXPORTS[name]
+    chunks = _encode(columns, source(start, end), output)
+    return _gzip(chunks) if compress else chunks
+
+
+def filename(name, first_day, last_day, output='csv', compress=False):
+    return f"{name}-{first_day}-{last_day}.{FORMATS[output][1]}{'.gz' if compress else ''}"
+
+
+def aiter_chunks(chunks):
+    """
+    Wraps a chunk iterator for ASGI responses, pulling each chunk in the thread that holds the database connection.
+
+    Handed a sync iterator, Django's ASGI handler would read it whole
+    before sending anything.
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+
+    async def wrapper():
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+
+    return wrapper()
+
+
+def _encode(columns, rows, output):
+    buffer = io.StringIO()
+    if output == 'csv':
+        # Other values are written as str(), dates and times as ISO 8601 with a space separator.
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        json_indexes = [index for index, column in enumerate(columns) if column in JSON_COLUMNS]
+    else:
+        encoder = json.JSONEncoder(separators=(',', ':'), default=_json_value)
+
+    for row in rows:
+        if output == 'csv':
+            if json_indexes:
+                row = list(row)
+                for index in json_indexes:
+                    if row[index] is not None:
+                        row[index] = json.dumps(row[index], separators=(',', ':'))
+            writer.writerow(row)
+        else:
+            buffer.write(encoder.encode(dict(zip(columns, row))))
+            buffer.write('\n')
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot export {type(value).__name__} values.")
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
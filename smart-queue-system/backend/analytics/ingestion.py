@@ -0,0 +1,45 @@
+"""
+Batched ingestion of activity events.
+
+Activities are not written one INSERT per event: queue events reach
+``ActivityLog`` through the outbox, and ``ActivityLogSink`` writes each
+dispatched batch with one ``bulk_create``. A batch that fails as a whole is
+retried row by row so one bad event cannot drop the rest. Every write
+advances the data version of the analytics result cache.
+"""
+import logging
+
+from django.db import DatabaseError, transaction
+
+from .models import ActivityLog
+from . import result_cache
+
+logger = logging.getLogger(__name__)
+
+
+def insert_activities(rows):
+    """
+    Writes ``ActivityLog`` instances in one statement, falling back to one INSERT per row.
+    """
+    if not rows:
+        return 0
+    # Savepoints keep a failed statement from aborting the caller's transaction.
+    try:
+        with transaction.atomic():
+            ActivityLog.objects.bulk_create(rows)
+        result_cache.bump_on_commit()
+        return len(rows)
+    except DatabaseError:
+        logger.exception("Bulk insert of %d activities failed; retrying one by one.", len(rows))
+
+    inserted = 0
+    for row in rows:
+        try:
+            with transaction.atomic():
+                row.save()
+            inserted += 1
+        except DatabaseError:
+            logger.exception("Dropping activity %s for service %s.", row.action, row.service_id)
+    if inserted:
+        result_cache.bump_on_commit()
+    return inserted
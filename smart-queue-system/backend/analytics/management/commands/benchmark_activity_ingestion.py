@@ -0,0 +1,47 @@
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from analytics.ingestion import insert_activities
+from analytics.models import ActivityLog
+from services.models import Service
+
+class Command(BaseCommand):
+    help = 'Compares activity inserts/sec of one INSERT per event against the batched writes of the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=5000, help='Number of activity events per run.')
+        parser.add_argument('--batch', type=int, default=500, help='Events per batch, as in NOTIFICATION_OUTBOX[\'BATCH_SIZE\'].')
+
+    def handle(self, *args, **options):
+        events = options['events']
+        service = Service.objects.create(name=f"benchmark-{uuid.uuid4().hex[:8]}")
+
+        try:
+            self.stdout.write(f"{'path':<12} {'events':>8} {'seconds':>8} {'inserts/sec':>12}")
+            for name, run in (('per_event', self.run_per_event), ('batched', self.run_batched)):
+                started = time.perf_counter()
+                run(service, events, options['batch'])
+                elapsed = time.perf_counter() - started
+
+                written = ActivityLog.objects.filter(service=service).count()
+                if written != events:
+                    self.stdout.write(self.style.ERROR(f"{name}: expected {events} rows, found {written}"))
+                ActivityLog.objects.filter(service=service).delete()
+
+                self.stdout.write(f"{name:<12} {events:>8} {elapsed:>8.2f} {events / elapsed:>12.1f}")
+        finally:
+            service.delete()
+
+    def run_per_event(self, service, events, batch):
+        # What log_activity did per task before the outbox: one INSERT per event.
+        # Broker round-trips are not included, so this understates the old cost.
+        for i in range(events):
+            ActivityLog.objects.create(service_id=service.id, action='user_join', token_number=i)
+
+    def run_batched(self, service, events, batch):
+        # What ActivityLogSink does with each batch the outbox dispatches.
+        for start in range(0, events, batch):
+            insert_activities([
+                ActivityLog(service_id=service.id, action='user_join', token_number=i)
+                for i in range(start, min(start + batch, events))
+            ])
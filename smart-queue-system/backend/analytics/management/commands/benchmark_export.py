@@ -0,0 +1,143 @@
+import gc
+import os
+import resource
+import time
+import uuid
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from analytics import exports
+from analytics.models import ACTION_CODES, ActivityLog
+from analytics.views import ExportView
+from services.models import Service, Counter
+from smart_queue_app.models import ArchivedQueueEntry, QueueEntry
+from users.models import User
+
+class Command(BaseCommand):
+    help = 'Exports millions of synthetic rows and fails if memory grows with the size of the export.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=3000000, help='Activity rows to generate.')
+        parser.add_argument('--entries', type=int, default=1000000, help='Queue entries to generate, mostly archived.')
+        parser.add_argument('--max-rss-growth', type=int, default=64, help='Allowed RSS growth during an export, in MB.')
+
+    def handle(self, *args, **options):
+        prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+        service = Service.objects.create(name=prefix)
+        counter = Counter.objects.create(name='Counter 1', service=service)
+        User.objects.bulk_create([User(username=f"{prefix}-{i}") for i in range(1000)])
+        users = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        # A day long past, so that the exports hold the generated rows only.
+        day = timezone.localdate() - timedelta(days=3650)
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        end = start + timedelta(days=1)
+
+        try:
+            started = time.perf_counter()
+            self.fill(service, counter, users, start, options['rows'], options['entries'])
+            self.stdout.write(
+                f"Generated {options['rows']} activities and {options['entries']} queue entries "
+                f"in {time.perf_counter() - started:.1f}s."
+            )
+
+            # Never saved: the requests are authenticated directly.
+            admin = User(username=prefix, role='admin')
+            runs = {
+                'activity csv (view)': lambda: self.view(admin, 'activity', day, 'csv', False),
+                'activity ndjson gzip': lambda: exports.export('activity', start, end, 'ndjson', True),
+                'queue-entries csv (view)': lambda: self.view(admin, 'queue-entries', day, 'csv', False),
+            }
+            self.stdout.write(
+                f"{'export':<26} {'seconds':>8} {'MB out':>8} {'rows/sec':>10} {'peak RSS MB':>12} {'RSS growth MB':>14}"
+            )
+            failed = []
+            for name, run in runs.items():
+                rows = options['entries'] if name.startswith('queue') else options['rows']
+                elapsed, size, peak, growth = self.measure(run)
+                self.stdout.write(
+                    f"{name:<26} {elapsed:>8.1f} {size / 2**20:>8.1f} {rows / elapsed:>10.0f} {peak:>12.1f} {growth:>14.1f}"
+                )
+                if growth > options['max_rss_growth']:
+                    failed.append(name)
+            if failed:
+                raise CommandError(f"RSS grew by more than {options['max_rss_growth']} MB during: {', '.join(failed)}.")
+        finally:
+            ActivityLog.objects.filter(service=service).delete()
+            QueueEntry.objects.filter(service=service).delete()
+            ArchivedQueueEntry.objects.filter(service=service).delete()
+            service.delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def fill(self, service, counter, users, start, rows, entries):
+        # Inserted without model instances, which would take most of the run at this size.
+        actions = [ACTION_CODES[action] for action in ('user_join', 'user_called', 'service_completed')]
+        step = timedelta(days=1) / max(rows, 1)
+        fields = [
+            ActivityLog._meta.get_field(name)
+            for name in ('user', 'service', 'counter', 'action', 'timestamp', 'token_number', 'queue_entry_id')
+        ]
+        sql = (
+            f"INSERT INTO {connection.ops.quote_name(ActivityLog._meta.db_table)} "
+            f"({', '.join(connection.ops.quote_name(field.column) for field in fields)}) VALUES ({', '.join(['%s'] * len(fields))})"
+        )
+        for offset in range(0, rows, 10000):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, [
+                    (
+                        users[i // 3 % len(users)], service.id, counter.id if i % 3 else None, actions[i % 3],
+                        connection.ops.adapt_datetimefield_value(start + step * i), i // 3 + 1, 10**12 + i // 3
+                    )
+                    for i in range(offset, min(offset + 10000, rows))
+                ])
+
+        # A tenth of the entries stay in the hot table, to go through the merge with the archive.
+        hot = entries // 10
+        step = timedelta(days=1) / max(entries, 1)
+        for offset in range(0, entries - hot, 10000):
+            ArchivedQueueEntry.objects.bulk_create([
+                ArchivedQueueEntry(
+                    id=10**12 + i, user_id=users[i % len(users)], service=service, counter=counter,
+                    token_number=i + 1, token_day=start.date(), status='completed',
+                    created_at=start + step * i, updated_at=start + step * i
+                )
+                for i in range(offset, min(offset + 10000, entries - hot))
+            ])
+        QueueEntry.objects.bulk_create([
+            QueueEntry(
+                user_id=users[i % len(users)], service=service, counter=counter,
+                token_number=entries - hot + i + 1, token_day=start.date(), status='completed'
+            )
+            for i in range(hot)
+        ], batch_size=10000)
+        # created_at is set on insert; move the entries into the exported day.
+        QueueEntry.objects.filter(service=service).update(created_at=start + timedelta(hours=12))
+
+    def view(self, user, name, day, output, compress):
+        request = APIRequestFactory().get(f'/api/analytics/exports/{name}/', {
+            'start': day, 'end': day, 'output': output, 'gzip': compress
+        })
+        force_authenticate(request, user=user)
+        streamed = ExportView.as_view()(request, name=name)
+        return streamed.streaming_content
+
+    def measure(self, run):
+        gc.collect()
+        baseline = peak = self.rss()
+        size = 0
+        started = time.perf_counter()
+        for chunk in run():
+            size += len(chunk)
+            peak = max(peak, self.rss())
+        return time.perf_counter() - started, size, peak / 2**20, (peak - baseline) / 2**20
+
+    def rss(self):
+        """
+        Current resident set size in bytes, or the peak where /proc is not available.
+        """
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
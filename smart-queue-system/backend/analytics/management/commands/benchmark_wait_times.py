@@ -0,0 +1,94 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from analytics import wait_times
+from analytics.models import ActivityLog
+from services.models import Service, Counter
+from users.models import User
+
+class Command(BaseCommand):
+    help = 'Compares wait-time computation by Python log replay, streamed pairing and window functions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Activity rows to generate for one day.')
+        parser.add_argument('--users', type=int, default=5000, help='Distinct users visiting the service.')
+
+    def handle(self, *args, **options):
+        prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+        service = Service.objects.create(name=prefix)
+        counters = [Counter.objects.create(name=f"Counter {i + 1}", service=service) for i in range(4)]
+        User.objects.bulk_create([User(username=f"{prefix}-{i}") for i in range(options['users'])])
+        users = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+        start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        end = start + timedelta(days=1)
+        try:
+            started = time.perf_counter()
+            expected = self.fill(service, counters, users, start, options['rows'])
+            self.stdout.write(
+                f"Generated {options['rows']} activities with {expected} waits in {time.perf_counter() - started:.1f}s "
+                f"({connection.vendor}, window functions: {connection.features.supports_over_clause})."
+            )
+
+            runs = {
+                'python replay': lambda: self.replay(ActivityLog.objects.filter(service=service, timestamp__gte=start, timestamp__lt=end)),
+                'streamed': lambda: self.summarize(wait_times.wait_totals(start, end, method='streamed')),
+            }
+            if connection.features.supports_over_clause and connection.vendor in wait_times.WAIT_SECONDS_SQL:
+                runs['window'] = lambda: self.summarize(wait_times.wait_totals(start, end, method='window'))
+            self.stdout.write(f"{'method':<14} {'seconds':>8} {'waits':>8} {'average s':>10}")
+            for name, run in runs.items():
+                started = time.perf_counter()
+                count, average = run()
+                self.stdout.write(f"{name:<14} {time.perf_counter() - started:>8.2f} {count:>8} {average:>10.2f}")
+        finally:
+            ActivityLog.objects.filter(service=service).delete()
+            service.delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def fill(self, service, counters, users, start, rows):
+        """
+        Writes visits spread over the day (join, call and completion, or join and skip) and returns how many waits they hold.
+        """
+        visits = rows // 3
+        slot = timedelta(days=1) / -(-visits // len(users))
+        batch, waits = [], 0
+        for visit in range(visits):
+            user_id = users[visit % len(users)]
+            joined_at = start + slot * (visit // len(users)) + timedelta(seconds=random.uniform(0, 60))
+            called_at = joined_at + timedelta(seconds=random.uniform(30, slot.total_seconds() / 3))
+            counter = random.choice(counters)
+            batch.append(ActivityLog(user_id=user_id, service=service, action='user_join', timestamp=joined_at))
+            if random.random() < 0.1:
+                # Skipped before being called.
+                batch.append(ActivityLog(user_id=user_id, service=service, action='user_skipped', timestamp=called_at))
+            else:
+                batch.append(ActivityLog(user_id=user_id, service=service, counter=counter, action='user_called', timestamp=called_at))
+                batch.append(ActivityLog(
+                    user_id=user_id, service=service, counter=counter, action='service_completed',
+                    timestamp=called_at + timedelta(seconds=random.uniform(10, 120))
+                ))
+            waits += 1
+            if len(batch) >= 10000 or visit == visits - 1:
+                ActivityLog.objects.bulk_create(batch)
+                batch = []
+        return waits
+
+    def replay(self, logs):
+        # What ServiceAnalyticsView did before the rollups: load the day and pair joins in Python.
+        total, count, joined = 0.0, 0, {}
+        for log in logs.order_by('timestamp'):
+            if log.action == 'user_join':
+                joined[log.user_id] = log.timestamp
+            elif log.action in ('service_completed', 'user_skipped', 'user_called') and log.user_id in joined:
+                total += (log.timestamp - joined.pop(log.user_id)).total_seconds()
+                count += 1
+        return count, total / count if count else 0
+
+    def summarize(self, totals):
+        count = sum(row[3] for row in totals)
+        return count, sum(row[4] for row in totals) / count if count else 0
@@ -0,0 +1,34 @@
+import sys
+from contextlib import nullcontext
+from datetime import date, datetime, time, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from analytics import exports
+
+class Command(BaseCommand):
+    help = 'Writes the activity log or the queue entry history of a range of days as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=exports.EXPORTS, help='What to export.')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to export (defaults to today).')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to export (defaults to --start).')
+        parser.add_argument('--output', choices=exports.FORMATS, default='csv', help='File format.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--file', help='File to write, standard output by default.')
+
+    def handle(self, *args, **options):
+        first = options['start'] or timezone.localdate()
+        last = options['end'] or first
+        if first > last:
+            raise CommandError('--start must not be after --end.')
+
+        start = timezone.make_aware(datetime.combine(first, time.min))
+        end = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min))
+        chunks = exports.export(options['name'], start, end, options['output'], options['gzip'])
+        written = 0
+        with open(options['file'], 'wb') if options['file'] else nullcontext(sys.stdout.buffer) as out:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        if options['file']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['file']}."))
@@ -0,0 +1,22 @@
+from datetime import date, datetime, time, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from analytics import rollups
+
+class Command(BaseCommand):
+    help = 'Recomputes the activity rollups of a range of days from the activity log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to rebuild (defaults to today).')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to rebuild (defaults to --start).')
+
+    def handle(self, *args, **options):
+        first = options['start'] or timezone.localdate()
+        last = options['end'] or first
+        if first > last:
+            raise CommandError('--start must not be after --end.')
+
+        start = timezone.make_aware(datetime.combine(first, time.min))
+        end = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min))
+        written = rollups.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup row(s) from {first} to {last}."))
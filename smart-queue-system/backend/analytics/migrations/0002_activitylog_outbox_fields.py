@@ -0,0 +1,24 @@
+# Generated by Django 5.0 on 2026-10-17 23:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activitylog',
+            name='action',
+            field=models.CharField(choices=[('user_join', 'User Join'), ('user_called', 'User Called'), ('service_completed', 'Service Completed'), ('user_skipped', 'User Skipped'), ('user_rejected', 'User Rejected'), ('custom_notification_sent', 'Custom Notification Sent')], max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='activitylog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 00:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_activity_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityrollup',
+            name='service_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='activityrollup',
+            name='wait_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.0 on 2026-10-18 00:49
+
+from datetime import timedelta, timezone as dt_timezone
+
+import analytics.models
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+# Partition naming and bounds as of this migration, so that later changes to
+# analytics.partitions cannot change what it does.
+def period_start(at, interval):
+    at = at.astimezone(dt_timezone.utc)
+    if interval == 'day':
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_period(start, interval):
+    if interval == 'day':
+        return start + timedelta(days=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table, start, interval):
+    return f"{table}_p{start:%Y%m%d}" if interval == 'day' else f"{table}_p{start:%Y%m}"
+
+
+def rebuild_activity_log(schema_editor, ActivityLog, partitioned):
+    """
+    Recreates the activity log table, partitioned by timestamp or not, and copies its rows over.
+
+    Copies everything in the migration's transaction: on a large table, run it in a maintenance window.
+    """
+    config = getattr(settings, 'ACTIVITY_LOG_PARTITIONS', {})
+    interval = config.get('INTERVAL', 'month')
+    quote = schema_editor.quote_name
+    table = ActivityLog._meta.db_table
+    old = f"{table}_unpartitioned" if partitioned else f"{table}_partitioned"
+    schema_editor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old)}")
+    schema_editor.execute(
+        f"CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS INCLUDING IDENTITY)"
+        + (' PARTITION BY RANGE ("timestamp")' if partitioned else '')
+    )
+    if partitioned:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(\"timestamp\") FROM {quote(old)}")
+            oldest = cursor.fetchone()[0]
+        start = period_start(oldest or timezone.now(), interval)
+        last = period_start(timezone.now(), interval)
+        for _ in range(config.get('PREMAKE', 3)):
+            last = next_period(last, interval)
+        while start <= last:
+            end = next_period(start, interval)
+            schema_editor.execute(
+                f"CREATE TABLE {quote(partition_name(table, start, interval))} PARTITION OF {quote(table)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [start, end]
+            )
+            start = end
+        schema_editor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(table)} DEFAULT")
+
+    schema_editor.execute(f"INSERT INTO {quote(table)} SELECT * FROM {quote(old)}")
+    schema_editor.execute(f"DROP TABLE {quote(old)} CASCADE")
+    schema_editor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {quote(table)}", [table]
+    )
+
+    # The primary key of a partitioned table has to include the partition key.
+    primary_key = 'id, "timestamp"' if partitioned else 'id'
+    schema_editor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY ({primary_key})")
+    for field in ActivityLog._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            schema_editor.execute(schema_editor._create_fk_sql(ActivityLog, field, "_fk_%(to_table)s_%(to_column)s"))
+    for sql in schema_editor._model_indexes_sql(ActivityLog):
+        schema_editor.execute(sql)
+
+
+def partition_activity_log(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild_activity_log(schema_editor, apps.get_model('analytics', 'ActivityLog'), partitioned=True)
+
+
+def unpartition_activity_log(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild_activity_log(schema_editor, apps.get_model('analytics', 'ActivityLog'), partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_rollup_sketches'),
+        ('services', '0003_service_token_reset'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Before the index, which PostgreSQL then creates on every partition.
+        migrations.RunPython(partition_activity_log, unpartition_activity_log),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=analytics.models.TimestampIndex(fields=['timestamp'], name='activity_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0 on 2026-10-18 09:12
+
+import analytics.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_activitylog_partitions'),
+    ]
+
+    operations = [
+        # Nullable until it is dropped, so that unapplying the drop can add it back before restoring its values.
+        migrations.AlterField(
+            model_name='activitylog',
+            name='action',
+            field=models.CharField(choices=[('user_join', 'User Join'), ('user_called', 'User Called'), ('service_completed', 'Service Completed'), ('user_skipped', 'User Skipped'), ('user_rejected', 'User Rejected'), ('custom_notification_sent', 'Custom Notification Sent')], max_length=30, null=True),
+        ),
+        migrations.AddField(
+            model_name='activitylog',
+            name='action_code',
+            field=analytics.models.ActionField(choices=[('user_join', 'User Join'), ('user_called', 'User Called'), ('service_completed', 'Service Completed'), ('user_skipped', 'User Skipped'), ('user_rejected', 'User Rejected'), ('custom_notification_sent', 'Custom Notification Sent')], null=True),
+        ),
+        migrations.AddField(
+            model_name='activitylog',
+            name='token_number',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='activitylog',
+            name='queue_entry_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='activitylog',
+            name='wait_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,106 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import migrations, models, transaction
+from django.db.models import Case, Value, When
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast
+
+BATCH_SIZE = 10000
+
+# Stored code of each action, as of this migration.
+ACTION_CODES = {
+    'user_join': 0,
+    'user_called': 1,
+    'service_completed': 2,
+    'user_skipped': 3,
+    'user_rejected': 4,
+    'custom_notification_sent': 5,
+}
+
+# Entries are looked up this far before the activity that refers to them.
+ENTRY_LOOKBACK = timedelta(days=1)
+
+
+def batches(ActivityLog):
+    """
+    Yields consecutive ``[low, high)`` id ranges of at most ``BATCH_SIZE`` ids.
+    """
+    bounds = ActivityLog.objects.aggregate(low=models.Min('id'), high=models.Max('id'))
+    if bounds['low'] is None:
+        return
+    for low in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+        yield low, low + BATCH_SIZE
+
+
+def backfill(apps, schema_editor):
+    """
+    Fills the typed columns from ``action`` and ``details``, one committed batch of ids at a time.
+
+    The migration is not atomic, so an interrupted backfill resumes where it
+    stopped: rows whose ``action_code`` is set are skipped.
+    """
+    ActivityLog = apps.get_model('analytics', 'ActivityLog')
+    entry_models = [apps.get_model('smart_queue_app', name) for name in ('QueueEntry', 'ArchivedQueueEntry')]
+
+    for low, high in batches(ActivityLog):
+        with transaction.atomic():
+            logs = ActivityLog.objects.filter(id__gte=low, id__lt=high, action_code__isnull=True)
+            logs.update(
+                action_code=Case(
+                    *[When(action=action, then=Value(code)) for action, code in ACTION_CODES.items()],
+                    output_field=models.IntegerField()
+                ),
+                token_number=Cast(KeyTextTransform('token', 'details'), models.IntegerField()),
+            )
+            # Entries are identified by their service and token, the latest created before the activity.
+            rows = list(ActivityLog.objects.filter(
+                id__gte=low, id__lt=high, token_number__isnull=False, queue_entry_id__isnull=True
+            ).only('id', 'service_id', 'token_number', 'action', 'timestamp'))
+            if not rows:
+                continue
+            entries = defaultdict(list)
+            for model in entry_models:
+                for entry_id, service_id, token_number, created_at in model.objects.filter(
+                    service_id__in={row.service_id for row in rows},
+                    token_number__in={row.token_number for row in rows},
+                    created_at__gte=min(row.timestamp for row in rows) - ENTRY_LOOKBACK,
+                    created_at__lte=max(row.timestamp for row in rows)
+                ).values_list('id', 'service_id', 'token_number', 'created_at'):
+                    entries[(service_id, token_number)].append((created_at, entry_id))
+
+            resolved = []
+            for row in rows:
+                earlier = [entry for entry in entries[(row.service_id, row.token_number)] if entry[0] <= row.timestamp]
+                if not earlier:
+                    continue
+                created_at, row.queue_entry_id = max(earlier)
+                if row.action == 'user_called':
+                    row.wait_ms = int((row.timestamp - created_at).total_seconds() * 1000)
+                resolved.append(row)
+            ActivityLog.objects.bulk_update(resolved, ['queue_entry_id', 'wait_ms'], batch_size=1000)
+
+
+def restore_actions(apps, schema_editor):
+    ActivityLog = apps.get_model('analytics', 'ActivityLog')
+    for low, high in batches(ActivityLog):
+        with transaction.atomic():
+            ActivityLog.objects.filter(id__gte=low, id__lt=high).update(action=Case(
+                *[When(action_code=code, then=Value(action)) for action, code in ACTION_CODES.items()],
+                output_field=models.CharField()
+            ))
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own, so that backfilling a large log neither
+    # holds one long transaction nor starts over after an interruption.
+    atomic = False
+
+    dependencies = [
+        ('analytics', '0006_activitylog_typed_columns'),
+        ('smart_queue_app', '0004_archived_queue_entry'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, restore_actions),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0 on 2026-10-18 09:14
+
+import analytics.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_backfill_activitylog_columns'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='action',
+        ),
+        migrations.RenameField(
+            model_name='activitylog',
+            old_name='action_code',
+            new_name='action',
+        ),
+        migrations.AlterField(
+            model_name='activitylog',
+            name='action',
+            field=analytics.models.ActionField(choices=[('user_join', 'User Join'), ('user_called', 'User Called'), ('service_completed', 'Service Completed'), ('user_skipped', 'User Skipped'), ('user_rejected', 'User Rejected'), ('custom_notification_sent', 'Custom Notification Sent')]),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['queue_entry_id', 'action'], name='activity_entry_action_idx'),
+        ),
+    ]
@@ -1,21 +1,130 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import cached_property
 from services.models import Service, Counter
 
+# Stored code of each ActivityLog action. Codes are never reused or renumbered.
+ACTION_CODES = {
+    'user_join': 0,
+    'user_called': 1,
+    'service_completed': 2,
+    'user_skipped': 3,
+    'user_rejected': 4,
+    'custom_notification_sent': 5,
+}
+ACTION_NAMES = {code: action for action, code in ACTION_CODES.items()}
+
+class TimestampIndex(models.Index):
+    """
+    A BRIN index on PostgreSQL, where activity is appended in time order, and a B-tree elsewhere.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            using = ' USING brin'
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+class ActionField(models.PositiveSmallIntegerField):
+    """
+    An action stored as its small integer code in ``ACTION_CODES``.
+
+    Instances, filters and ``values()`` use the action names; expressions
+    that need the code itself wrap the column in an ``IntegerField`` output.
+    """
+
+    @cached_property
+    def validators(self):
+        # The range validators of integer fields would compare names with numbers.
+        return [*self.default_validators, *self._validators]
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else ACTION_NAMES[value]
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return ACTION_NAMES[int(value)]
+
+    def get_prep_value(self, value):
+        if value is None or not isinstance(value, str):
+            return value
+        return ACTION_CODES[value]
+
 class ActivityLog(models.Model):
+    """
+    A queue event, partitioned by ``timestamp`` on PostgreSQL (see ``analytics.partitions``).
+
+    Filter on ``timestamp`` ranges rather than ``timestamp__date``, which
+    neither the index nor partition pruning can use. The attributes analytics
+    read are typed columns; ``details`` only keeps free-form extras such as
+    the message of a custom notification.
+    """
     ACTION_CHOICES = (
         ('user_join', 'User Join'),
         ('user_called', 'User Called'),
         ('service_completed', 'Service Completed'),
         ('user_skipped', 'User Skipped'),
+        ('user_rejected', 'User Rejected'),
+        ('custom_notification_sent', 'Custom Notification Sent'),
     )
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
     counter = models.ForeignKey(Counter, on_delete=models.SET_NULL, null=True, blank=True)
-    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    action = ActionField(choices=ACTION_CHOICES)
+    timestamp = models.DateTimeField(default=timezone.now)
+    token_number = models.PositiveIntegerField(null=True, blank=True)
+    # A plain id, since entries move to ArchivedQueueEntry under the same id.
+    queue_entry_id = models.BigIntegerField(null=True, blank=True)
+    # Time from joining to being called, on user_called only.
+    wait_ms = models.PositiveIntegerField(null=True, blank=True)
     details = models.JSONField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            TimestampIndex(fields=['timestamp'], name='activity_timestamp_idx'),
+            models.Index(fields=['queue_entry_id', 'action'], name='activity_entry_action_idx'),
+        ]
+
     def __str__(self):
         return f"{self.action} on {self.service.name} at {self.timestamp}"
+
+class ActivityRollup(models.Model):
+    """
+    Activity totals of one counter of a service over one time bucket, see ``analytics.rollups``.
+    """
+    GRANULARITY_CHOICES = (
+        ('minute', 'Minute'),
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    )
+
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    service = models.ForeignKey(Service, on_delete=models.CASCADE)
+    # A plain id so that totals outlive deleted counters; 0 for activity outside any counter.
+    counter_id = models.PositiveIntegerField(default=0)
+    joins = models.PositiveIntegerField(default=0)
+    calls = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+    skips = models.PositiveIntegerField(default=0)
+    rejections = models.PositiveIntegerField(default=0)
+    # Waits from joining until being called, or skipped or rejected without being called.
+    wait_seconds = models.FloatField(default=0)
+    wait_count = models.PositiveIntegerField(default=0)
+    # Quantile sketches of waits and service times (call to completion), see ``analytics.sketches``.
+    # Only kept on hour and day buckets.
+    wait_sketch = models.BinaryField(null=True, blank=True)
+    service_sketch = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket', 'service', 'counter_id'],
+                name='unique_activity_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.service.name} {self.granularity} {self.bucket:%Y-%m-%d %H:%M}"
@@ -0,0 +1,191 @@
+"""
+Time partitions and retention of the activity log.
+
+On PostgreSQL, ``ActivityLog`` is a table partitioned by range of
+``timestamp``, one partition per ``INTERVAL`` (a UTC month or day) named
+after its first day, such as ``analytics_activitylog_p202610``, plus a
+default partition for rows outside all of them. ``ensure_partitions``
+creates the partitions of the next ``PREMAKE`` intervals ahead of time,
+moving in any rows of their range that reached the default partition
+first, and ``expire`` drops (or only detaches, with ``ON_EXPIRY =
+'detach'``) the partitions older than ``RETENTION_DAYS``: a catalog change
+instead of a ``DELETE`` over millions of rows. Expired rows in the default
+partition are deleted. Both run daily from celery beat through
+``maintain_activity_partitions``.
+
+Other databases keep a plain table, where ``expire`` deletes expired rows
+in batches along the timestamp index instead.
+"""
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ActivityLog
+from . import result_cache
+
+PARTITION_NAME = re.compile(r'_p(\d{4})(\d{2})(\d{2})?$')
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [ActivityLog._meta.db_table]
+        )
+        return cursor.fetchone() is not None
+
+
+def period_start(at, interval=None):
+    """
+    Start of the UTC month or day holding ``at``.
+    """
+    at = at.astimezone(dt_timezone.utc)
+    if (interval or settings.ACTIVITY_LOG_PARTITIONS['INTERVAL']) == 'day':
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_period(start, interval=None):
+    if (interval or settings.ACTIVITY_LOG_PARTITIONS['INTERVAL']) == 'day':
+        return start + timedelta(days=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(start, interval=None):
+    table = ActivityLog._meta.db_table
+    if (interval or settings.ACTIVITY_LOG_PARTITIONS['INTERVAL']) == 'day':
+        return f"{table}_p{start:%Y%m%d}"
+    return f"{table}_p{start:%Y%m}"
+
+
+def default_partition_name():
+    return f"{ActivityLog._meta.db_table}_default"
+
+
+def create_partition(cursor, start, interval=None):
+    """
+    Creates the partition of the interval starting at ``start``, unless it would overlap an existing one.
+
+    Rows of the interval already in the default partition are moved into
+    the new one; run it inside a transaction.
+    """
+    end = next_period(start, interval)
+    if any(start < existing_end and existing_start < end for _, existing_start, existing_end in _partitions(cursor)):
+        return False
+    quote = connection.ops.quote_name
+    table, name, default = (
+        quote(ActivityLog._meta.db_table), quote(partition_name(start, interval)), quote(default_partition_name())
+    )
+    cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s)', [start, end])
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", [start, end])
+        return True
+
+    # PostgreSQL refuses to create a partition whose rows sit in the default
+    # partition, so they are moved into a plain table that is then attached.
+    cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+        f"INSERT INTO {name} SELECT * FROM moved",
+        [start, end]
+    )
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [start, end])
+    return True
+
+
+def ensure_partitions(now=None):
+    """
+    Creates the missing partitions from the current interval to ``PREMAKE`` intervals ahead and returns how many.
+    """
+    if not is_partitioned():
+        return 0
+    start = period_start(now or timezone.now())
+    created = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for _ in range(settings.ACTIVITY_LOG_PARTITIONS['PREMAKE'] + 1):
+            created += create_partition(cursor, start)
+            start = next_period(start)
+    return created
+
+
+def expire(now=None):
+    """
+    Removes activity older than ``RETENTION_DAYS`` and returns the number of partitions or rows removed.
+    """
+    config = settings.ACTIVITY_LOG_PARTITIONS
+    if config['RETENTION_DAYS'] is None:
+        return 0
+    cutoff = (now or timezone.now()) - timedelta(days=config['RETENTION_DAYS'])
+    if not is_partitioned():
+        removed = _delete_before(ActivityLog.objects.all(), cutoff)
+        if removed:
+            result_cache.bump_on_commit()
+        return removed
+
+    quote = connection.ops.quote_name
+    removed = 0
+    with connection.cursor() as cursor:
+        for name, start, end in _partitions(cursor):
+            # Partitions still holding rows at or after the cutoff are kept whole.
+            if end > cutoff:
+                continue
+            with transaction.atomic():
+                cursor.execute(f"ALTER TABLE {quote(ActivityLog._meta.db_table)} DETACH PARTITION {quote(name)}")
+                if config['ON_EXPIRY'] == 'drop':
+                    cursor.execute(f"DROP TABLE {quote(name)}")
+            removed += 1
+        # Stray rows in the default partition. The kept partitions hold no
+        # expired rows but those of the interval the cutoff falls in.
+        removed += _delete_default_before(cursor, cutoff)
+    if removed:
+        result_cache.bump_on_commit()
+    return removed
+
+
+def _delete_before(logs, cutoff):
+    deleted = 0
+    batch_size = settings.ACTIVITY_LOG_PARTITIONS['DELETE_BATCH_SIZE']
+    while True:
+        batch = list(logs.filter(timestamp__lt=cutoff).order_by('timestamp').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += ActivityLog.objects.filter(pk__in=batch).delete()[0]
+
+
+def _delete_default_before(cursor, cutoff):
+    default = connection.ops.quote_name(default_partition_name())
+    deleted = 0
+    while True:
+        cursor.execute(
+            f"DELETE FROM {default} WHERE id IN "
+            f'(SELECT id FROM {default} WHERE "timestamp" < %s ORDER BY "timestamp" LIMIT %s)',
+            [cutoff, settings.ACTIVITY_LOG_PARTITIONS['DELETE_BATCH_SIZE']]
+        )
+        if not cursor.rowcount:
+            return deleted
+        deleted += cursor.rowcount
+
+
+def _partitions(cursor):
+    """
+    Returns ``(name, start, end)`` of the range partitions of the activity log, oldest first.
+    """
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s)",
+        [ActivityLog._meta.db_table]
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME.search(name)
+        if match:
+            year, month, day = match.groups()
+            interval = 'day' if day else 'month'
+            start = datetime(int(year), int(month), int(day or 1), tzinfo=dt_timezone.utc)
+            partitions.append((name, start, next_period(start, interval)))
+    return sorted(partitions, key=lambda partition: partition[1])
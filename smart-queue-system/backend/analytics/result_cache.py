@@ -0,0 +1,90 @@
+"""
+Cached results of the analytics endpoints.
+
+Analytics only change when activity is recorded, so a single data version
+in the cache is bumped whenever activity is ingested or rollups are
+written, and each result is cached per endpoint and parameters together with
+the version it was computed from. Dashboards refreshing between events are
+answered from the cache without a single analytics query.
+
+After a bump only one request recomputes a result (see
+``core.caching.versioned``). Results also expire after ``TIMEOUT``
+seconds to pick up changes that do not go through ingestion, such as a
+renamed service. Hits, misses, stale serves and compute time are counted
+per endpoint, see ``stats``.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core import caching
+
+VERSION_KEY = 'analytics:data_version'
+COUNTS = ('hits', 'misses', 'stale', 'compute_ms')
+
+
+def _result_key(endpoint, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f"analytics:result:{endpoint}:{digest}"
+
+
+def _stats_key(endpoint, name):
+    return f"analytics:result_stats:{endpoint}:{name}"
+
+
+def version():
+    return caching.version(VERSION_KEY)
+
+
+def bump():
+    return caching.bump(VERSION_KEY)
+
+
+def bump_on_commit():
+    """
+    Advances the data version once the current transaction, if any, has committed.
+    """
+    transaction.on_commit(bump)
+
+
+def cached(endpoint, params, compute):
+    """
+    Returns ``compute()`` for ``params`` of an endpoint, from the cache while the data version is unchanged.
+
+    ``params`` must identify the result fully, with ranges resolved to
+    dates, and be JSON serializable with ``str()`` for other values.
+    """
+    config = settings.ANALYTICS_RESULT_CACHE
+
+    def counted_compute():
+        caching.incr(_stats_key(endpoint, 'misses'))
+        started = time.perf_counter()
+        try:
+            return compute()
+        finally:
+            caching.incr(_stats_key(endpoint, 'compute_ms'), round((time.perf_counter() - started) * 1000))
+
+    data, outcome = caching.versioned(
+        _result_key(endpoint, params), version(), counted_compute,
+        config['TIMEOUT'], config['COMPUTE_TIMEOUT'], config['COMPUTE_WAIT_MS']
+    )
+    if outcome != 'miss':
+        caching.incr(_stats_key(endpoint, 'hits' if outcome == 'hit' else 'stale'))
+    return data
+
+
+def stats(endpoints):
+    """
+    Returns hit, miss, stale and compute time counts per endpoint, with the current data version.
+    """
+    counts = cache.get_many([_stats_key(endpoint, name) for endpoint in endpoints for name in COUNTS])
+    result = {'data_version': version(), 'endpoints': {}}
+    for endpoint in endpoints:
+        data = {name: counts.get(_stats_key(endpoint, name), 0) for name in COUNTS}
+        data['average_compute_ms'] = round(data['compute_ms'] / data['misses'], 1) if data['misses'] else None
+        result['endpoints'][endpoint] = data
+    return result
@@ -0,0 +1,324 @@
+"""
+Incrementally maintained activity rollups.
+
+Every queue event adds to the ``ActivityRollup`` row of its service and
+counter in the minute, hour and day bucket it falls in, through
+``RollupSink``. Analytics then sums a handful of rows per service instead of
+replaying the activity log. Waits are recorded when they end: an entry that
+is called, or skipped or rejected while still waiting, adds the time since
+it joined. Hour and day buckets also keep quantile sketches of the waits and
+of service times, from a call to the event that ends it, which ``percentiles``
+merges for any range of buckets.
+
+``rebuild`` recomputes a range from ``ActivityLog``, for backfills and to
+repair drift, and ``purge`` drops fine-grained buckets past their retention.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from notifications.sinks import ACTIVITY_ACTIONS, QueueEventSink
+from .models import ActivityLog, ActivityRollup
+from .sketches import Sketch
+from . import distributions, result_cache, wait_times
+
+GRANULARITIES = ('minute', 'hour', 'day')
+
+# Rollup columns counting each ActivityLog action.
+ACTION_FIELDS = {
+    'user_join': 'joins',
+    'user_called': 'calls',
+    'service_completed': 'completions',
+    'user_skipped': 'skips',
+    'user_rejected': 'rejections',
+}
+TOTAL_FIELDS = tuple(ACTION_FIELDS.values()) + ('wait_seconds', 'wait_count')
+
+SKETCH_GRANULARITIES = ('hour', 'day')
+SKETCH_FIELDS = ('wait_sketch', 'service_sketch')
+SERVICE_END_EVENTS = ('completed', 'skipped', 'rejected')
+
+
+def bucket_start(at, granularity):
+    local = timezone.localtime(at)
+    if granularity == 'minute':
+        return local.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def add(deltas, service_id, counter_id, action, at, wait=None, service_time=None):
+    """
+    Adds one activity to ``deltas``, a ``defaultdict(Counter)`` keyed by rollup row.
+
+    Waits and service times are also added to the sketches of the row,
+    kept in the delta as ``Sketch`` objects under ``SKETCH_FIELDS``.
+    """
+    field = ACTION_FIELDS.get(action)
+    if field is None:
+        return
+    for granularity in GRANULARITIES:
+        delta = deltas[(granularity, bucket_start(at, granularity), service_id, counter_id or 0)]
+        delta[field] += 1
+        if wait is not None:
+            delta['wait_seconds'] += wait
+            delta['wait_count'] += 1
+        if granularity in SKETCH_GRANULARITIES:
+            if wait is not None:
+                delta.setdefault('wait_sketch', Sketch()).add(wait)
+            if service_time is not None:
+                delta.setdefault('service_sketch', Sketch()).add(service_time)
+
+
+def apply(deltas):
+    """
+    Adds ``deltas`` to the stored rollups, creating missing rows.
+    """
+    # Rows are locked in key order, so concurrent batches in one transaction each never deadlock.
+    for (granularity, bucket, service_id, counter_id), delta in sorted(deltas.items(), key=lambda item: item[0]):
+        sketches = {field: delta.pop(field) for field in SKETCH_FIELDS if field in delta}
+        rows = ActivityRollup.objects.filter(
+            granularity=granularity, bucket=bucket, service_id=service_id, counter_id=counter_id
+        )
+        increments = {field: F(field) + amount for field, amount in delta.items()}
+        with transaction.atomic():
+            if rows.update(**increments):
+                _merge_sketches(rows, sketches)
+                continue
+        try:
+            with transaction.atomic():
+                ActivityRollup.objects.create(
+                    granularity=granularity, bucket=bucket, service_id=service_id, counter_id=counter_id, **delta,
+                    **{field: sketch.to_bytes() for field, sketch in sketches.items()}
+                )
+        except IntegrityError:
+            # Another worker created the row concurrently.
+            with transaction.atomic():
+                rows.update(**increments)
+                _merge_sketches(rows, sketches)
+    if deltas:
+        result_cache.bump_on_commit()
+
+
+def _merge_sketches(rows, sketches):
+    # Runs after the update of the same row in one transaction, which holds its lock.
+    if not sketches:
+        return
+    stored = rows.values(*sketches).get()
+    rows.update(**{field: sketch.merge(Sketch.from_bytes(stored[field])).to_bytes() for field, sketch in sketches.items()})
+
+
+def totals(start, end, granularity='day', series=False):
+    """
+    Sums the rollups of buckets in ``[start, end)`` per service, or per service and bucket if ``series``.
+    """
+    group_by = ('service_id', 'bucket') if series else ('service_id',)
+    return ActivityRollup.objects.filter(
+        granularity=granularity,
+        bucket__gte=start,
+        bucket__lt=end
+    ).values(*group_by).annotate(**{field: Sum(field) for field in TOTAL_FIELDS}).order_by(*group_by)
+
+
+def percentiles(start, end, service_id=None):
+    """
+    Merges the sketches of buckets in ``[start, end)`` into approximate wait and service time percentiles.
+
+    Returns ``{service_id: {'wait', 'service_time', 'counters'}}``, each
+    summary holding ``count`` and ``p50``, ``p90`` and ``p99`` in seconds
+    (see ``distributions.PERCENTILES``). Day buckets are used when ``start``
+    and ``end`` fall on day boundaries, hour buckets otherwise.
+    """
+    aligned = all(bucket_start(at, 'day') == timezone.localtime(at) for at in (start, end))
+    rows = ActivityRollup.objects.filter(
+        granularity='day' if aligned else 'hour',
+        bucket__gte=start,
+        bucket__lt=end
+    )
+    if service_id is not None:
+        rows = rows.filter(service_id=service_id)
+
+    counters = defaultdict(lambda: defaultdict(lambda: {field: Sketch() for field in SKETCH_FIELDS}))
+    for service, counter_id, *stored in rows.values_list('service_id', 'counter_id', *SKETCH_FIELDS).iterator():
+        sketches = counters[service][counter_id]
+        for field, data in zip(SKETCH_FIELDS, stored):
+            if data:
+                sketches[field].merge(Sketch.from_bytes(data))
+
+    results = {}
+    for service, by_counter in counters.items():
+        totals = {field: Sketch() for field in SKETCH_FIELDS}
+        for sketches in by_counter.values():
+            for field in SKETCH_FIELDS:
+                totals[field].merge(sketches[field])
+        results[service] = dict(
+            _summaries(totals),
+            counters=[
+                dict(_summaries(sketches), counter_id=counter_id or None)
+                for counter_id, sketches in sorted(by_counter.items())
+                if any(sketch.count for sketch in sketches.values())
+            ]
+        )
+    return results
+
+
+def empty_percentiles():
+    """
+    The percentiles of a service without activity.
+    """
+    return dict(_summaries({field: Sketch() for field in SKETCH_FIELDS}), counters=[])
+
+
+def _summaries(sketches):
+    summaries = {}
+    for name, field in (('wait', 'wait_sketch'), ('service_time', 'service_sketch')):
+        sketch = sketches[field]
+        summaries[name] = {'count': sketch.count}
+        for percentile in distributions.PERCENTILES:
+            value = sketch.quantile(percentile / 100)
+            summaries[name][f'p{percentile}'] = None if value is None else round(value, 1)
+    return summaries
+
+
+def rebuild(start, end):
+    """
+    Recomputes all rollups of buckets in ``[start, end)`` from the activity log.
+
+    ``start`` and ``end`` should fall on day boundaries so that every bucket
+    is rebuilt whole. Returns the number of rows written.
+    """
+    deltas = defaultdict(Counter)
+    logs = ActivityLog.objects.filter(timestamp__gte=start, timestamp__lt=end, action__in=ACTION_FIELDS)
+
+    # Counts are grouped in the database, one row per bucket, counter and action.
+    for granularity in GRANULARITIES:
+        grouped = logs.annotate(
+            bucket=Trunc('timestamp', granularity)
+        ).values('bucket', 'service_id', 'counter_id', 'action').annotate(total=Count('id')).order_by()
+        for row in grouped:
+            key = (granularity, bucket_start(row['bucket'], granularity), row['service_id'], row['counter_id'] or 0)
+            deltas[key][ACTION_FIELDS[row['action']]] += row['total']
+
+        # Waits are paired with window functions and summed per bucket in the database as well.
+        for service_id, counter_id, bucket, wait_count, wait_seconds in wait_times.wait_totals(start, end, granularity):
+            delta = deltas[(granularity, bucket_start(bucket, granularity), service_id, counter_id or 0)]
+            delta['wait_seconds'] += wait_seconds
+            delta['wait_count'] += wait_count
+
+    # Sketches need every duration: they are built from the pairs of the whole range at once.
+    waits, served = distributions.pairs(distributions.load_columns(start, end), start.timestamp())
+    for field, durations in (('wait_sketch', waits), ('service_sketch', served)):
+        for granularity in SKETCH_GRANULARITIES:
+            for bucket, service_id, counter_id, sketch in _bucket_sketches(durations, granularity):
+                deltas[(granularity, bucket, service_id, counter_id)][field] = sketch
+
+    with transaction.atomic():
+        ActivityRollup.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+        ActivityRollup.objects.bulk_create([
+            ActivityRollup(
+                granularity=granularity, bucket=bucket, service_id=service_id, counter_id=counter_id,
+                **{field: value.to_bytes() if field in SKETCH_FIELDS else value for field, value in delta.items()}
+            )
+            for (granularity, bucket, service_id, counter_id), delta in deltas.items()
+        ], batch_size=1000)
+    result_cache.bump_on_commit()
+    return len(deltas)
+
+
+def _bucket_sketches(durations, granularity):
+    """
+    Yields ``(bucket, service_id, counter_id, sketch)`` for the paired ``durations`` of ``distributions.pairs``.
+    """
+    # Buckets are looked up once per minute the durations ended in, which
+    # follows the local time zone whatever its offset.
+    minutes, inverse = np.unique(durations['ended_at'] // 60, return_inverse=True)
+    starts = [
+        bucket_start(datetime.fromtimestamp(minute * 60, dt_timezone.utc), granularity) for minute in minutes.tolist()
+    ]
+    buckets = np.array([at.timestamp() for at in starts])[inverse]
+    bucket_times = {at.timestamp(): at for at in starts}
+
+    keys = np.column_stack((buckets, durations['service'], durations['counter']))
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    boundaries = np.flatnonzero(np.diff(inverse[order])) + 1
+    for (bucket, service_id, counter_id), group in zip(groups.tolist(), np.split(order, boundaries)):
+        sketch = Sketch()
+        sketch.update(durations['seconds'][group])
+        yield bucket_times[bucket], int(service_id), int(counter_id), sketch
+
+
+def purge():
+    """
+    Deletes buckets older than their granularity's retention and returns how many were deleted.
+    """
+    deleted = 0
+    for granularity, days in settings.ANALYTICS_ROLLUPS['RETENTION_DAYS'].items():
+        if days is not None:
+            cutoff = timezone.now() - timedelta(days=days)
+            deleted += ActivityRollup.objects.filter(granularity=granularity, bucket__lt=cutoff).delete()[0]
+    return deleted
+
+
+def _was_waiting(event):
+    if 'previous_status' not in event:
+        # Queued before envelopes carried it; only called entries have a counter.
+        return event['entry']['counter'] is None
+    return event['previous_status'] == 'waiting'
+
+
+class RollupSink(QueueEventSink):
+    """
+    Adds queue events to the activity rollups.
+    """
+
+    message_class = 'rollup'
+
+    def handle(self, events):
+        deltas = defaultdict(Counter)
+        called_at = self.call_times(events)
+        for event_id, event in events:
+            at = parse_datetime(event['at'])
+            entry = event['entry']
+            wait = service_time = None
+            if event['event'] == 'called' or (event['event'] in ('skipped', 'rejected') and _was_waiting(event)):
+                wait = max((at - parse_datetime(entry['created_at'])).total_seconds(), 0)
+            elif event['event'] in SERVICE_END_EVENTS and entry['id'] in called_at:
+                service_time = max((at - called_at[entry['id']]).total_seconds(), 0)
+            add(deltas, event['service']['id'], entry['counter'], ACTIVITY_ACTIONS[event['event']], at, wait, service_time)
+        apply(deltas)
+
+    def call_times(self, events):
+        """
+        Returns ``{entry_id: called_at}`` for the entries whose service ends in ``events``.
+        """
+        called_at, ending = {}, {}
+        for event_id, event in events:
+            entry = event['entry']
+            if event['event'] == 'called':
+                called_at[entry['id']] = parse_datetime(event['at'])
+            elif event['event'] in SERVICE_END_EVENTS and not _was_waiting(event) and entry['id'] not in called_at:
+                ending[entry['id']] = parse_datetime(event['at'])
+        if not ending:
+            return called_at
+
+        # Called in an earlier batch: the latest logged call of the entry.
+        # Calls whose activity is not logged yet are missed, and left to ``rebuild``.
+        for entry_id, timestamp in ActivityLog.objects.filter(
+            queue_entry_id__in=ending,
+            action='user_called',
+            timestamp__gte=min(ending.values()) - wait_times.LOOKBACK,
+            timestamp__lte=max(ending.values())
+        ).order_by('timestamp').values_list('queue_entry_id', 'timestamp'):
+            if timestamp <= ending[entry_id]:
+                called_at[entry_id] = timestamp
+        return called_at
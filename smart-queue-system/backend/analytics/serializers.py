@@ -1,12 +1,107 @@
 from rest_framework import serializers
+from .models import ActivityRollup
 
 class WaitTimeSerializer(serializers.Serializer):
+    service_id = serializers.IntegerField()
+    service_name = serializers.CharField()
+    wait_count = serializers.IntegerField()
+    average_wait_time = serializers.DurationField()
+
+class AnalyticsRangeSerializer(serializers.Serializer):
+    """
+    Query parameters of the service analytics: an inclusive range of days and an optional series interval.
+    """
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    interval = serializers.ChoiceField(choices=ActivityRollup.GRANULARITY_CHOICES, required=False)
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        return attrs
+
+class DistributionParamsSerializer(AnalyticsRangeSerializer):
+    service = serializers.IntegerField(required=False)
+
+class ExportParamsSerializer(AnalyticsRangeSerializer):
+    # Not ``format``, which DRF reserves for picking a renderer.
+    output = serializers.ChoiceField(choices=('csv', 'ndjson'), default='csv')
+    gzip = serializers.BooleanField(default=False)
+
+class PercentileSummarySerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    p50 = serializers.FloatField(allow_null=True)
+    p90 = serializers.FloatField(allow_null=True)
+    p99 = serializers.FloatField(allow_null=True)
+
+class DurationSummarySerializer(PercentileSummarySerializer):
+    histogram = serializers.ListField(child=serializers.IntegerField())
+
+class CounterDistributionSerializer(serializers.Serializer):
+    counter_id = serializers.IntegerField(allow_null=True)
+    wait = DurationSummarySerializer()
+    service_time = DurationSummarySerializer()
+
+class HeatmapSerializer(serializers.Serializer):
+    wait_count = serializers.ListField(child=serializers.ListField(child=serializers.IntegerField()))
+    wait_p90 = serializers.ListField(child=serializers.ListField(child=serializers.FloatField(allow_null=True)))
+
+class ServiceDistributionSerializer(serializers.Serializer):
+    service_id = serializers.IntegerField()
+    service_name = serializers.CharField()
+    wait = DurationSummarySerializer()
+    service_time = DurationSummarySerializer()
+    heatmap = HeatmapSerializer()
+    counters = CounterDistributionSerializer(many=True)
+
+class CounterPercentileSerializer(serializers.Serializer):
+    counter_id = serializers.IntegerField(allow_null=True)
+    wait = PercentileSummarySerializer()
+    service_time = PercentileSummarySerializer()
+
+class ServicePercentileSerializer(serializers.Serializer):
+    service_id = serializers.IntegerField()
+    service_name = serializers.CharField()
+    wait = PercentileSummarySerializer()
+    service_time = PercentileSummarySerializer()
+    counters = CounterPercentileSerializer(many=True)
+
+class CounterMetricsParamsSerializer(serializers.Serializer):
+    service = serializers.IntegerField(required=False)
+
+class CounterMetricsSerializer(serializers.Serializer):
+    counter_id = serializers.IntegerField()
+    counter_name = serializers.CharField()
+    served = serializers.IntegerField()
+    served_per_hour = serializers.FloatField(allow_null=True)
+    service_time_mean = serializers.FloatField(allow_null=True)
+    service_time_variance = serializers.FloatField(allow_null=True)
+    busy_seconds = serializers.FloatField()
+    idle_seconds = serializers.FloatField()
+    utilization = serializers.FloatField(allow_null=True)
+    serving = serializers.BooleanField()
+
+class ServiceCounterMetricsSerializer(serializers.Serializer):
+    service_id = serializers.IntegerField()
+    service_name = serializers.CharField()
+    counters = CounterMetricsSerializer(many=True)
+
+class AnalyticsBucketSerializer(serializers.Serializer):
+    bucket = serializers.DateTimeField()
+    total_users = serializers.IntegerField()
+    called_users = serializers.IntegerField()
+    completed_users = serializers.IntegerField()
+    skipped_users = serializers.IntegerField()
+    rejected_users = serializers.IntegerField()
     average_wait_time = serializers.DurationField()
 
 class ServiceAnalyticsSerializer(serializers.Serializer):
     service_id = serializers.IntegerField()
     service_name = serializers.CharField()
     total_users = serializers.IntegerField()
+    called_users = serializers.IntegerField()
     completed_users = serializers.IntegerField()
     skipped_users = serializers.IntegerField()
+    rejected_users = serializers.IntegerField()
     average_wait_time = serializers.DurationField()
+    series = AnalyticsBucketSerializer(many=True, required=False)
@@ -1,15 +1,17 @@
 from celery import shared_task
-from .models import ActivityLog
 
 @shared_task
-def log_activity(user_id, service_id, action, counter_id=None, details=None):
+def purge_rollups():
     """
-    Logs an activity.
+    Deletes activity rollup buckets past their retention.
     """
-    ActivityLog.objects.create(
-        user_id=user_id,
-        service_id=service_id,
-        counter_id=counter_id,
-        action=action,
-        details=details or {}
-    )
+    from . import rollups
+    return rollups.purge()
+
+@shared_task
+def maintain_activity_partitions():
+    """
+    Creates the upcoming activity log partitions and removes activity past its retention.
+    """
+    from . import partitions
+    return {'created': partitions.ensure_partitions(), 'expired': partitions.expire()}
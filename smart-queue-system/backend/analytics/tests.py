@@ -0,0 +1,580 @@
+import json
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from notifications import queue_events
+from notifications.sinks import ActivityLogSink
+from services.models import Counter, Service
+from smart_queue_app.models import QueueEntry, create_waiting_entry
+from smart_queue_app.tests import LOCAL_BACKENDS
+from users.models import User
+from . import distributions, exports, partitions, result_cache, rollups, sketches, wait_times
+from .models import ActivityLog, ActivityRollup
+
+
+@override_settings(**LOCAL_BACKENDS)
+class ResultCacheTests(SimpleTestCase):
+    params = {'range': '2026-10-01..2026-10-07'}
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_result_is_computed_once_per_version(self):
+        computed = []
+
+        def compute():
+            computed.append(None)
+            return len(computed)
+
+        self.assertEqual(result_cache.cached('services', self.params, compute), 1)
+        self.assertEqual(result_cache.cached('services', self.params, compute), 1)
+        result_cache.bump()
+        self.assertEqual(result_cache.cached('services', self.params, compute), 2)
+
+        counts = result_cache.stats(['services'])['endpoints']['services']
+        self.assertEqual((counts['hits'], counts['misses'], counts['stale']), (1, 2, 0))
+
+
+class ExportTests(TestCase):
+    """
+    Exports stream a range far larger than the memory they are allowed to use.
+    """
+    rows = 50000
+    # Peak allocations stay around 2 MB whatever the number of rows; the export itself is over 4 MB.
+    memory_ceiling = 4 * 1024 * 1024
+
+    @classmethod
+    def setUpTestData(cls):
+        service = Service.objects.create(name='Library')
+        cls.end = timezone.now()
+        cls.start = cls.end - timedelta(hours=1)
+        ActivityLog.objects.bulk_create((
+            ActivityLog(
+                service=service,
+                action='user_called',
+                timestamp=cls.start + timedelta(milliseconds=i * 50),
+                token_number=i,
+                queue_entry_id=i,
+                wait_ms=i * 10,
+                details={'note': f"row {i}, quoted"} if i % 10 == 0 else None,
+            ) for i in range(cls.rows)
+        ), batch_size=5000)
+
+    def stream(self, output, compress=False):
+        """
+        Consumes the export chunk by chunk, returning its first line, its line count and the peak memory allocated.
+        """
+        decompressor = zlib.decompressobj(wbits=31) if compress else None
+        first_line, lines, size = b'', 0, 0
+        tracemalloc.start()
+        try:
+            for chunk in exports.export('activity', self.start, self.end, output, compress):
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                if not lines:
+                    first_line = chunk.split(b'\n', 1)[0]
+                lines += chunk.count(b'\n')
+                size += len(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # Otherwise the ceiling would not show that the export is streamed.
+        self.assertGreater(size, self.memory_ceiling)
+        return first_line.decode(), lines, peak
+
+    def test_csv(self):
+        header, lines, peak = self.stream('csv')
+        self.assertEqual(header.rstrip('\r'), ','.join(exports.EXPORTS['activity'][0]))
+        self.assertEqual(lines, self.rows + 1)
+        self.assertLess(peak, self.memory_ceiling)
+
+    def test_ndjson(self):
+        first, lines, peak = self.stream('ndjson')
+        self.assertEqual(list(json.loads(first)), exports.EXPORTS['activity'][0])
+        self.assertEqual(lines, self.rows)
+        self.assertLess(peak, self.memory_ceiling)
+
+    def test_gzipped_csv(self):
+        header, lines, peak = self.stream('csv', compress=True)
+        self.assertEqual(header.rstrip('\r'), ','.join(exports.EXPORTS['activity'][0]))
+        self.assertEqual(lines, self.rows + 1)
+        self.assertLess(peak, self.memory_ceiling)
+
+
+class ExportViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        service = Service.objects.create(name='Library')
+        ActivityLog.objects.bulk_create(
+            ActivityLog(service=service, action='user_join', token_number=i) for i in range(3)
+        )
+        cls.admin = User.objects.create_user('admin', password='pw', role='admin')
+        cls.url = f"/api/analytics/exports/activity/?start={timezone.localdate().isoformat()}"
+
+    def test_wsgi_response_streams_synchronously(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get(self.url)
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+
+    async def test_asgi_response_streams_asynchronously(self):
+        response = await AsyncClient().get(self.url, headers={'Authorization': f"Bearer {AccessToken.for_user(self.admin)}"})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.splitlines()), 4)
+
+
+@override_settings(**LOCAL_BACKENDS)
+class RollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = Service.objects.create(name='Library')
+        self.counter = Counter.objects.create(name='Counter 1', service=self.service)
+        self.day = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        self.start = self.day + timedelta(hours=10)
+
+    def tearDown(self):
+        cache.clear()
+
+    def join(self, name, seconds):
+        entry = create_waiting_entry(self.service, User.objects.create_user(name, password='pw'))
+        QueueEntry.objects.filter(pk=entry.pk).update(created_at=self.start + timedelta(seconds=seconds))
+        entry.refresh_from_db()
+        return entry, self.event('joined', entry, seconds)
+
+    def event(self, event_type, entry, seconds, status=None, counter=None):
+        previous_status = None if event_type == 'joined' else entry.status
+        entry.status = status or entry.status
+        entry.counter = counter or entry.counter
+        payload = queue_events.envelope(event_type, entry, previous_status)
+        payload['at'] = (self.start + timedelta(seconds=seconds)).isoformat()
+        return f"{event_type}:{entry.id}", payload
+
+    def deliver(self, *events):
+        # The activity log first, as the outbox dispatcher does; later batches look calls up in it.
+        for sink in (ActivityLogSink(), rollups.RollupSink()):
+            sink.handle(list(events))
+
+    def totals(self, granularity):
+        return list(rollups.totals(self.day, self.day + timedelta(days=1), granularity))
+
+    def test_sink_matches_rebuild(self):
+        (a, joined_a), (b, joined_b), (c, joined_c), (d, joined_d) = [
+            self.join(name, seconds) for name, seconds in (('a', 0), ('b', 10), ('c', 20), ('d', 30))
+        ]
+        self.deliver(joined_a, joined_b, joined_c, joined_d)
+        self.deliver(
+            self.event('called', a, 60, 'in_progress', self.counter),
+            self.event('skipped', b, 130, 'skipped'),
+            # Called without a counter, so its skip below ends a service, not a wait.
+            self.event('called', d, 130, 'in_progress'),
+        )
+        self.deliver(
+            self.event('completed', a, 360, 'completed'),
+            self.event('skipped', d, 430, 'skipped'),
+            self.event('called', c, 220, 'in_progress', self.counter),
+            self.event('rejected', c, 280, 'rejected'),
+        )
+
+        expected = {
+            'service_id': self.service.id, 'joins': 4, 'calls': 3, 'completions': 1, 'skips': 2, 'rejections': 1,
+            'wait_seconds': 60 + 120 + 200 + 100, 'wait_count': 4,
+        }
+        for granularity in rollups.GRANULARITIES:
+            self.assertEqual(self.totals(granularity), [expected])
+        percentiles = rollups.percentiles(self.day, self.day + timedelta(days=1))[self.service.id]
+        self.assertEqual((percentiles['wait']['count'], percentiles['service_time']['count']), (4, 3))
+        self.assertAlmostEqual(percentiles['service_time']['p50'], 300, delta=300 * sketches.RELATIVE_ACCURACY)
+
+        rows = {
+            row.pop('counter_id'): row
+            for row in ActivityRollup.objects.filter(granularity='hour').values('counter_id', *rollups.TOTAL_FIELDS)
+        }
+        self.assertEqual(rollups.rebuild(self.day, self.day + timedelta(days=1)), ActivityRollup.objects.count())
+        for granularity in rollups.GRANULARITIES:
+            self.assertEqual(self.totals(granularity), [expected])
+        self.assertEqual(rows, {
+            row.pop('counter_id'): row
+            for row in ActivityRollup.objects.filter(granularity='hour').values('counter_id', *rollups.TOTAL_FIELDS)
+        })
+        self.assertEqual(rollups.percentiles(self.day, self.day + timedelta(days=1))[self.service.id], percentiles)
+
+    def test_purge_drops_buckets_past_their_retention(self):
+        now = timezone.now()
+        for granularity, days in (('minute', 8), ('minute', 6), ('hour', 401), ('hour', 10), ('day', 1000)):
+            ActivityRollup.objects.create(granularity=granularity, bucket=now - timedelta(days=days), service=self.service)
+
+        self.assertEqual(rollups.purge(), 2)
+        self.assertEqual(
+            sorted(ActivityRollup.objects.values_list('granularity', flat=True)), ['day', 'hour', 'minute']
+        )
+
+
+class WaitTimesTests(TestCase):
+    def setUp(self):
+        self.services = [Service.objects.create(name='Library'), Service.objects.create(name='Registry')]
+        self.counter = Counter.objects.create(name='Counter 1', service=self.services[0])
+        self.users = [User.objects.create_user(f"student{n}", password='pw') for n in range(3)]
+        self.start = timezone.localtime().replace(hour=10, minute=0, second=0, microsecond=0) - timedelta(days=2)
+
+    def log(self, user, service, action, minutes, counter=None):
+        ActivityLog.objects.create(
+            user=self.users[user], service=self.services[service], counter=counter, action=action,
+            timestamp=self.start + timedelta(minutes=minutes)
+        )
+
+    def totals(self, method, granularity):
+        end = self.start + timedelta(hours=3)
+        return sorted((
+            (service_id, counter_id, bucket, count, round(seconds, 3))
+            for service_id, counter_id, bucket, count, seconds in wait_times.wait_totals(self.start, end, granularity, method)
+        ), key=lambda row: (row[0], row[1] or 0, row[2] or self.start))
+
+    def test_window_and_streamed_totals_agree(self):
+        # A wait spanning the start of the range, and one that ended before it.
+        self.log(0, 0, 'user_join', -30)
+        self.log(0, 0, 'user_called', 5, self.counter)
+        self.log(1, 0, 'user_join', -50)
+        self.log(1, 0, 'user_skipped', -10)
+        # Joined twice: only the second join is paired.
+        self.log(1, 0, 'user_join', 10)
+        self.log(1, 0, 'user_join', 20)
+        self.log(1, 0, 'user_called', 70, self.counter)
+        self.log(1, 0, 'service_completed', 80, self.counter)
+        # The same user in another service, ending in the next hour.
+        self.log(0, 1, 'user_join', 50)
+        self.log(0, 1, 'user_rejected', 65)
+        # Events at the same time are paired in insertion order.
+        self.log(2, 0, 'user_join', 90)
+        self.log(2, 0, 'user_called', 90)
+        # Still waiting at the end of the range.
+        self.log(2, 1, 'user_join', 170)
+
+        for granularity in (None, 'minute', 'hour', 'day'):
+            with self.subTest(granularity=granularity):
+                self.assertEqual(self.totals('window', granularity), self.totals('streamed', granularity))
+
+        by_service = wait_times.average_wait_times(self.start, self.start + timedelta(hours=3))
+        self.assertEqual(by_service[self.services[0].id]['wait_count'], 3)
+        self.assertEqual(by_service[self.services[0].id]['average_wait_time'], timedelta(minutes=(35 + 50 + 0) / 3))
+        self.assertEqual(by_service[self.services[1].id]['average_wait_time'], timedelta(minutes=15))
+
+
+class ServiceTimesFixture:
+    """
+    A morning of one service: ten users called at a counter and served, and one skipped while waiting.
+
+    Waits are 30 to 300 seconds in steps of 30 at the counter, plus 400
+    seconds without one; service times are 100 to 190 seconds.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.service = Service.objects.create(name='Library')
+        self.other = Service.objects.create(name='Registry')
+        self.counter = Counter.objects.create(name='Counter 1', service=self.service)
+        self.day = timezone.localdate() - timedelta(days=2)
+        self.start = timezone.make_aware(datetime.combine(self.day, datetime.min.time())) + timedelta(hours=10)
+        logs = []
+        for n in range(11):
+            user = User.objects.create_user(f"student{n}")
+            joined = self.start + timedelta(minutes=n)
+            logs.append(ActivityLog(user=user, service=self.service, action='user_join', timestamp=joined))
+            if n == 10:
+                logs.append(ActivityLog(user=user, service=self.service, action='user_skipped', timestamp=joined + timedelta(seconds=400)))
+                continue
+            called = joined + timedelta(seconds=30 * (n + 1))
+            logs += [
+                ActivityLog(user=user, service=self.service, counter=self.counter, action='user_called', timestamp=called),
+                ActivityLog(
+                    user=user, service=self.service, counter=self.counter, action='service_completed',
+                    timestamp=called + timedelta(seconds=100 + 10 * n)
+                ),
+            ]
+        ActivityLog.objects.bulk_create(logs)
+
+        admin = User.objects.create_user('admin', password='pw', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def tearDown(self):
+        cache.clear()
+
+    def get(self, url, **params):
+        return self.client.get(url, {'start': self.day.isoformat(), 'end': self.day.isoformat(), **params})
+
+
+@override_settings(**LOCAL_BACKENDS)
+class DistributionTests(ServiceTimesFixture, TestCase):
+    waits = {'count': 11, 'p50': 180.0, 'p90': 300.0, 'p99': 390.0, 'histogram': [1, 2, 6, 2, 0, 0, 0, 0, 0, 0, 0, 0]}
+    service_times = {'count': 10, 'p50': 145.0, 'p90': 181.0, 'p99': 189.1, 'histogram': [0, 2, 8] + [0] * 9}
+
+    def test_distribution_endpoint(self):
+        response = self.get('/api/analytics/distributions/', service=self.service.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['histogram_edges'], list(distributions.HISTOGRAM_EDGES))
+        [service] = response.data['services']
+        self.assertEqual(service['service_id'], self.service.id)
+        self.assertEqual(service['wait'], self.waits)
+        self.assertEqual(service['service_time'], self.service_times)
+
+        weekday = self.day.weekday()
+        self.assertEqual(service['heatmap']['wait_count'][weekday][10], 11)
+        self.assertEqual(sum(map(sum, service['heatmap']['wait_count'])), 11)
+        self.assertEqual(service['heatmap']['wait_p90'][weekday][10], 300.0)
+
+        no_counter, counter = service['counters']
+        self.assertEqual((counter['counter_id'], counter['wait']['count'], counter['service_time']), (self.counter.id, 10, self.service_times))
+        self.assertEqual((no_counter['counter_id'], no_counter['wait']['p50'], no_counter['service_time']['count']), (None, 400.0, 0))
+
+    def test_services_without_activity_are_empty(self):
+        response = self.get('/api/analytics/distributions/')
+        self.assertEqual([service['service_id'] for service in response.data['services']], [self.service.id, self.other.id])
+        empty = response.data['services'][1]
+        self.assertEqual(empty['wait'], {'count': 0, 'p50': None, 'p90': None, 'p99': None, 'histogram': [0] * 12})
+        self.assertEqual(empty['counters'], [])
+
+        # Waits ending outside the range are left out.
+        response = self.client.get('/api/analytics/distributions/', {'start': (self.day + timedelta(days=1)).isoformat()})
+        self.assertEqual(response.data['services'][0]['wait']['count'], 0)
+
+    def test_staff_cannot_read_distributions(self):
+        self.client.force_authenticate(User.objects.create_user('staff', password='pw', role='staff'))
+        self.assertEqual(self.get('/api/analytics/distributions/').status_code, 403)
+
+
+class SketchTests(SimpleTestCase):
+    def setUp(self):
+        # Waits of a few seconds to a few hours, plus some under MIN_SECONDS.
+        rng = np.random.default_rng(7)
+        self.seconds = np.concatenate((rng.lognormal(5, 1.5, 20000), rng.uniform(0, 1, 200), [1.0, 7 * 86400.0]))
+
+    def sketch(self, seconds):
+        sketch = sketches.Sketch()
+        sketch.update(seconds)
+        return sketch
+
+    def assert_same(self, first, second):
+        self.assertEqual((first.zero_count, first.bins), (second.zero_count, second.bins))
+
+    def test_bytes_round_trip(self):
+        sketch = self.sketch(self.seconds)
+        data = sketch.to_bytes()
+        self.assert_same(sketches.Sketch.from_bytes(data), sketch)
+        self.assert_same(sketches.Sketch.from_bytes(memoryview(data)), sketch)
+        self.assertEqual(sketches.Sketch.from_bytes(None).count, 0)
+        self.assertLess(len(data), 2000)
+
+        with self.assertRaises(ValueError):
+            sketches.Sketch.from_bytes(bytes([sketches.VERSION + 1]) + data[1:])
+
+    def test_add_and_update_agree(self):
+        added = sketches.Sketch()
+        for value in self.seconds[:500]:
+            added.add(float(value))
+        self.assert_same(added, self.sketch(self.seconds[:500]))
+
+    def test_merge_equals_the_sketch_of_all_durations(self):
+        parts = np.array_split(self.seconds, 7)
+        merged = sketches.Sketch()
+        for part in parts:
+            merged.merge(sketches.Sketch.from_bytes(self.sketch(part).to_bytes()))
+        self.assert_same(merged, self.sketch(self.seconds))
+        self.assertEqual(merged.count, self.seconds.size)
+
+    def test_quantiles_are_within_the_relative_accuracy(self):
+        sketch = self.sketch(self.seconds)
+        for q in (0.05, 0.25, 0.5, 0.9, 0.99, 0.999, 1):
+            with self.subTest(q=q):
+                exact = np.percentile(self.seconds, q * 100, method='lower')
+                self.assertGreaterEqual(exact, sketches.MIN_SECONDS)
+                self.assertLessEqual(abs(sketch.quantile(q) - exact), exact * sketches.RELATIVE_ACCURACY * (1 + 1e-9))
+
+        short = self.sketch([0.2, 0.5, 3.0])
+        self.assertEqual(short.quantile(0.5), 0.0)
+        self.assertIsNone(sketches.Sketch().quantile(0.5))
+
+
+@override_settings(**LOCAL_BACKENDS)
+class PercentileTests(ServiceTimesFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        day_start = self.start - timedelta(hours=10)
+        rollups.rebuild(day_start, day_start + timedelta(days=1))
+
+    def test_percentile_endpoint(self):
+        response = self.get('/api/analytics/percentiles/', service=self.service.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['relative_accuracy'], response.data['min_seconds']),
+            (sketches.RELATIVE_ACCURACY, sketches.MIN_SECONDS)
+        )
+        [service] = response.data['services']
+        # Sketch quantiles are taken at a rank, not interpolated between ranks.
+        exact = {
+            'wait': np.array([30 * n for n in range(1, 11)] + [400]),
+            'service_time': np.array([100 + 10 * n for n in range(10)]),
+        }
+        for name, seconds in exact.items():
+            self.assertEqual(service[name]['count'], seconds.size)
+            for percentile in distributions.PERCENTILES:
+                expected = np.percentile(seconds, percentile, method='lower')
+                self.assertAlmostEqual(service[name][f'p{percentile}'], expected, delta=expected * sketches.RELATIVE_ACCURACY + 0.05)
+
+        no_counter, counter = service['counters']
+        self.assertEqual((no_counter['counter_id'], no_counter['wait']['count']), (None, 1))
+        self.assertEqual((counter['counter_id'], counter['wait']['count'], counter['service_time']['count']), (self.counter.id, 10, 10))
+
+    def test_hour_buckets_serve_ranges_within_a_day(self):
+        hours = rollups.percentiles(self.start, self.start + timedelta(hours=1), self.service.id)
+        self.assertEqual(hours, rollups.percentiles(self.start - timedelta(hours=10), self.start + timedelta(hours=14), self.service.id))
+
+        response = self.get('/api/analytics/percentiles/')
+        empty = response.data['services'][1]
+        self.assertEqual((empty['service_id'], empty['wait']['count'], empty['counters']), (self.other.id, 0, []))
+
+
+@override_settings(**LOCAL_BACKENDS)
+class PartitionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = Service.objects.create(name='Library')
+        self.now = timezone.now()
+
+    def tearDown(self):
+        cache.clear()
+
+    def log(self, timestamp):
+        pk = ActivityLog.objects.create(service=self.service, action='user_join', timestamp=timestamp).pk
+        if connection.vendor == 'postgresql':
+            # Deferred foreign key checks would keep the test transaction from altering the table.
+            with connection.cursor() as cursor:
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        return pk
+
+    def count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {connection.ops.quote_name(table)}")
+            return cursor.fetchone()[0]
+
+    def require_partitions(self):
+        if not partitions.is_partitioned():
+            self.skipTest("The activity log is only partitioned on PostgreSQL.")
+
+    @override_settings(ACTIVITY_LOG_PARTITIONS={
+        'INTERVAL': 'month', 'PREMAKE': 1, 'RETENTION_DAYS': None, 'ON_EXPIRY': 'drop', 'DELETE_BATCH_SIZE': 2
+    })
+    def test_ensure_partitions_moves_rows_out_of_the_default_partition(self):
+        self.require_partitions()
+        # Two years ahead, where no partition exists yet.
+        later = partitions.period_start(self.now + timedelta(days=730)) + timedelta(days=3)
+        pk = self.log(later)
+        self.assertEqual(self.count(partitions.default_partition_name()), 1)
+
+        self.assertEqual(partitions.ensure_partitions(now=later), 2)
+        self.assertEqual(partitions.ensure_partitions(now=later), 0)
+        self.assertEqual(self.count(partitions.default_partition_name()), 0)
+        self.assertEqual(self.count(partitions.partition_name(partitions.period_start(later))), 1)
+        self.assertEqual(ActivityLog.objects.get(pk=pk).timestamp, later)
+        self.assertGreater(self.log(later + timedelta(hours=1)), pk)
+
+    @override_settings(ACTIVITY_LOG_PARTITIONS={
+        'INTERVAL': 'month', 'PREMAKE': 1, 'RETENTION_DAYS': 30, 'ON_EXPIRY': 'drop', 'DELETE_BATCH_SIZE': 2
+    })
+    def test_expire_keeps_the_partition_the_cutoff_falls_in(self):
+        self.require_partitions()
+        oldest = partitions.period_start(self.now - timedelta(days=120))
+        boundary = partitions.next_period(oldest)
+        with connection.cursor() as cursor:
+            partitions.create_partition(cursor, oldest)
+            partitions.create_partition(cursor, boundary)
+        cutoff = boundary + timedelta(days=5)
+
+        self.log(oldest + timedelta(days=1))
+        kept = [self.log(boundary + timedelta(days=1)), self.log(boundary + timedelta(days=10))]
+        # Before every partition, so in the default partition.
+        stray = [self.log(oldest - timedelta(days=n)) for n in range(1, 4)]
+        kept.append(self.log(cutoff + timedelta(days=1)))
+        kept.append(self.log(oldest - timedelta(days=1) + timedelta(days=365 * 3)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(partitions.expire(now=cutoff + timedelta(days=30)), 1 + len(stray))
+        names = [name for name, start, end in partitions._partitions(connection.cursor())]
+        self.assertNotIn(partitions.partition_name(oldest), names)
+        self.assertIn(partitions.partition_name(boundary), names)
+        self.assertCountEqual(ActivityLog.objects.values_list('pk', flat=True), kept)
+
+    @override_settings(ACTIVITY_LOG_PARTITIONS={
+        'INTERVAL': 'month', 'PREMAKE': 1, 'RETENTION_DAYS': 30, 'ON_EXPIRY': 'drop', 'DELETE_BATCH_SIZE': 2
+    })
+    def test_expire_deletes_rows_in_batches_without_partitions(self):
+        if partitions.is_partitioned():
+            self.skipTest("The activity log is partitioned.")
+        for days in (40, 35, 32, 31, 31):
+            self.log(self.now - timedelta(days=days))
+        kept = [self.log(self.now - timedelta(days=29)), self.log(self.now)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(partitions.expire(now=self.now), 5)
+        self.assertCountEqual(ActivityLog.objects.values_list('pk', flat=True), kept)
+
+
+class ActionBackfillMigrationTests(TransactionTestCase):
+    """
+    Migration 0007 fills the action codes and queue entries of existing activity.
+    """
+    before = [('analytics', '0006_activitylog_typed_columns')]
+    after = [('analytics', '0007_backfill_activitylog_columns')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        # The other apps stay fully migrated.
+        leaves = [node for node in executor.loader.graph.leaf_nodes() if node[0] != 'analytics']
+        self.apps = executor.loader.project_state(self.before + leaves).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_codes_and_entries_are_backfilled(self):
+        User = self.apps.get_model('users', 'User')
+        Service = self.apps.get_model('services', 'Service')
+        QueueEntry = self.apps.get_model('smart_queue_app', 'QueueEntry')
+        ActivityLog = self.apps.get_model('analytics', 'ActivityLog')
+        user = User.objects.create(username='student0')
+        service = Service.objects.create(name='Library')
+        joined = timezone.now() - timedelta(minutes=10)
+        entry = QueueEntry.objects.create(user=user, service=service, token_number=7, status='completed')
+        QueueEntry.objects.filter(pk=entry.pk).update(created_at=joined)
+        actions = [
+            'user_join', 'user_called', 'service_completed', 'user_skipped', 'user_rejected', 'custom_notification_sent'
+        ]
+        for minutes, action in enumerate(actions):
+            ActivityLog.objects.create(
+                user=user, service=service, action=action, timestamp=joined + timedelta(minutes=minutes),
+                details={'token': 7}
+            )
+
+        MigrationExecutor(connection).migrate(self.after)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT action, action_code, token_number, queue_entry_id, wait_ms FROM analytics_activitylog ORDER BY id"
+            )
+            rows = cursor.fetchall()
+        self.assertEqual(rows, [
+            (action, code, 7, entry.pk, 60000 if action == 'user_called' else None)
+            for code, action in enumerate(actions)
+        ])
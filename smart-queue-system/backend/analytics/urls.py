@@ -1,6 +1,15 @@
 from django.urls import path
-from .views import ServiceAnalyticsView
+from .views import (
+    CounterMetricsView, ExportView, ResultCacheStatsView, ServiceAnalyticsView, ServiceDistributionView,
+    ServicePercentileView, ServiceWaitTimeView
+)
 
 urlpatterns = [
     path('services/', ServiceAnalyticsView.as_view(), name='service-analytics'),
+    path('wait-times/', ServiceWaitTimeView.as_view(), name='service-wait-times'),
+    path('distributions/', ServiceDistributionView.as_view(), name='service-distributions'),
+    path('percentiles/', ServicePercentileView.as_view(), name='service-percentiles'),
+    path('counters/', CounterMetricsView.as_view(), name='counter-metrics'),
+    path('cache-stats/', ResultCacheStatsView.as_view(), name='analytics-cache-stats'),
+    path('exports/<slug:name>/', ExportView.as_view(), name='analytics-export'),
 ]
@@ -1,70 +1,266 @@
-from django.db.models import Avg, Count, F, ExpressionWrapper, fields
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.http import Http404, StreamingHttpResponse
 from django.utils import timezone
 from rest_framework import views, response, status
 from rest_framework.permissions import IsAuthenticated
-from .models import ActivityLog, Service
-from .serializers import ServiceAnalyticsSerializer
-from core.permissions import IsAdminUser
-from collections import defaultdict
+from .models import Counter, Service
+from .serializers import (
+    AnalyticsRangeSerializer, CounterMetricsParamsSerializer, DistributionParamsSerializer, ExportParamsSerializer,
+    ServiceAnalyticsSerializer, ServiceCounterMetricsSerializer, ServiceDistributionSerializer,
+    ServicePercentileSerializer, WaitTimeSerializer
+)
+from . import counter_metrics, distributions, exports, result_cache, rollups, sketches, wait_times
+from core.permissions import IsAdminUser, IsStaffOrAdmin
+
+# Endpoints whose results are cached, see ``result_cache``.
+CACHED_ENDPOINTS = ('services', 'wait-times', 'distributions', 'percentiles')
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def served_over_asgi(request):
+    # WSGI servers put wsgi.version in every environ (PEP 3333); ASGI requests are built from a scope without it.
+    return 'wsgi.version' not in request.META
+
+def requested_range(request, serializer_class=AnalyticsRangeSerializer):
+    """
+    Returns the validated range parameters and the ``[start, end)`` they cover, today by default.
+    """
+    params = serializer_class(data=request.query_params)
+    params.is_valid(raise_exception=True)
+    today = timezone.localdate()
+    start = day_start(params.validated_data.get('start', today))
+    end = day_start(params.validated_data.get('end', today)) + timedelta(days=1)
+    return params.validated_data, start, end
 
 class ServiceAnalyticsView(views.APIView):
     """
     Provides analytics for all services.
+
+    Covers today unless ``?start=`` and ``?end=`` (inclusive dates) ask for
+    another range, and adds a per-bucket ``series`` with
+    ``?interval=minute|hour|day``. Totals are read from the activity
+    rollups, a few rows per service whatever the traffic.
     """
     permission_classes = [IsAuthenticated, IsAdminUser]
 
     def get(self, request):
-        today = timezone.now().date()
-        
-        services = Service.objects.all()
+        params, start, end = requested_range(request)
+        interval = params.get('interval')
+        data = result_cache.cached(
+            'services', {'start': start, 'end': end, 'interval': interval}, lambda: self.results(start, end, interval)
+        )
+        return response.Response(data, status=status.HTTP_200_OK)
+
+    def results(self, start, end, interval):
+        totals = {row['service_id']: row for row in rollups.totals(start, end)}
+        series = defaultdict(list)
+        if interval:
+            for row in rollups.totals(start, end, granularity=interval, series=True):
+                series[row['service_id']].append(dict(self.summarize(row), bucket=row['bucket']))
+
         analytics_data = []
+        for service in Service.objects.all():
+            data = {
+                'service_id': service.id,
+                'service_name': service.name,
+                **self.summarize(totals.get(service.id, {})),
+            }
+            if interval:
+                data['series'] = series[service.id]
+            analytics_data.append(data)
 
-        # Get all logs for today to process in memory
-        logs_today = ActivityLog.objects.filter(timestamp__date=today).order_by('timestamp')
+        return ServiceAnalyticsSerializer(analytics_data, many=True).data
 
-        # Group logs by service
-        logs_by_service = defaultdict(list)
-        for log in logs_today:
-            logs_by_service[log.service_id].append(log)
+    def summarize(self, row):
+        wait_count = row.get('wait_count') or 0
+        return {
+            'total_users': row.get('joins') or 0,
+            'called_users': row.get('calls') or 0,
+            'completed_users': row.get('completions') or 0,
+            'skipped_users': row.get('skips') or 0,
+            'rejected_users': row.get('rejections') or 0,
+            'average_wait_time': timedelta(seconds=row['wait_seconds'] / wait_count) if wait_count else timedelta(0),
+        }
 
-        for service in services:
-            service_logs = logs_by_service.get(service.id, [])
-            
-            total_users = sum(1 for log in service_logs if log.action == 'user_join')
-            completed_users = sum(1 for log in service_logs if log.action == 'service_completed')
-            skipped_users = sum(1 for log in service_logs if log.action == 'user_skipped')
+class ServiceWaitTimeView(views.APIView):
+    """
+    Provides the average wait of every service over a range of days, computed from the activity log.
+
+    Takes the same ``?start=`` and ``?end=`` as the service analytics. Waits
+    are paired in the database, so it stays exact for ranges the rollups
+    no longer hold at a fine granularity.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
 
-            avg_wait_time = self.calculate_average_wait_time(service_logs)
+    def get(self, request):
+        params, start, end = requested_range(request)
+        data = result_cache.cached('wait-times', {'start': start, 'end': end}, lambda: self.results(start, end))
+        return response.Response(data, status=status.HTTP_200_OK)
 
-            analytics_data.append({
+    def results(self, start, end):
+        averages = wait_times.average_wait_times(start, end)
+        data = [
+            {
                 'service_id': service.id,
                 'service_name': service.name,
-                'total_users': total_users,
-                'completed_users': completed_users,
-                'skipped_users': skipped_users,
-                'average_wait_time': avg_wait_time,
+                **averages.get(service.id, {'wait_count': 0, 'average_wait_time': timedelta(0)}),
+            }
+            for service in Service.objects.all()
+        ]
+        return WaitTimeSerializer(data, many=True).data
+
+class ServiceDistributionView(views.APIView):
+    """
+    Provides wait and service time percentiles, histograms and heatmaps per service and counter.
+
+    Takes the same ``?start=`` and ``?end=`` as the service analytics, and
+    ``?service=`` to narrow it to one service. Durations are in seconds;
+    ``histogram_edges`` are the lower bounds of the histogram buckets.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        params, start, end = requested_range(request, DistributionParamsSerializer)
+        service_id = params.get('service')
+        data = result_cache.cached(
+            'distributions', {'start': start, 'end': end, 'service': service_id},
+            lambda: self.results(start, end, service_id)
+        )
+        return response.Response(data, status=status.HTTP_200_OK)
+
+    def results(self, start, end, service_id):
+        results = distributions.distributions(start, end, service_id)
+
+        services = Service.objects.all()
+        if service_id is not None:
+            services = services.filter(pk=service_id)
+        data = [
+            {
+                'service_id': service.id,
+                'service_name': service.name,
+                **(results.get(service.id) or distributions.empty()),
+            }
+            for service in services
+        ]
+        return {
+            'histogram_edges': list(distributions.HISTOGRAM_EDGES),
+            'services': ServiceDistributionSerializer(data, many=True).data,
+        }
+
+class ServicePercentileView(views.APIView):
+    """
+    Provides approximate wait and service time percentiles per service and counter over any range of days.
+
+    Takes the same parameters as the distributions, but merges the quantile
+    sketches of the rollups instead of reading the activity log, so a year
+    costs about as much as a day. Every percentile is within
+    ``relative_accuracy`` of the exact value for durations of at least
+    ``min_seconds``; shorter durations are reported as 0.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        params, start, end = requested_range(request, DistributionParamsSerializer)
+        service_id = params.get('service')
+        data = result_cache.cached(
+            'percentiles', {'start': start, 'end': end, 'service': service_id},
+            lambda: self.results(start, end, service_id)
+        )
+        return response.Response(data, status=status.HTTP_200_OK)
+
+    def results(self, start, end, service_id):
+        results = rollups.percentiles(start, end, service_id)
+
+        services = Service.objects.all()
+        if service_id is not None:
+            services = services.filter(pk=service_id)
+        data = [
+            {
+                'service_id': service.id,
+                'service_name': service.name,
+                **(results.get(service.id) or rollups.empty_percentiles()),
+            }
+            for service in services
+        ]
+        return {
+            'relative_accuracy': sketches.RELATIVE_ACCURACY,
+            'min_seconds': sketches.MIN_SECONDS,
+            'services': ServicePercentileSerializer(data, many=True).data,
+        }
+
+class ResultCacheStatsView(views.APIView):
+    """
+    Reports hits, misses and compute time of the analytics result cache.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return response.Response(result_cache.stats(CACHED_ENDPOINTS), status=status.HTTP_200_OK)
+
+class CounterMetricsView(views.APIView):
+    """
+    Provides today's throughput, service times and utilization of each counter, per service.
+
+    Read from the live counter states kept by ``CounterMetricsSink``, the
+    same figures pushed to the staff WebSocket group as ``counter_metrics``
+    messages. Staff see the services they manage.
+    """
+    permission_classes = [IsAuthenticated, IsStaffOrAdmin]
+
+    def get(self, request):
+        params = CounterMetricsParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        services = Service.objects.all() if request.user.role == 'admin' else request.user.services.all()
+        if 'service' in params.validated_data:
+            services = services.filter(pk=params.validated_data['service'])
+
+        counters = defaultdict(list)
+        for counter in Counter.objects.filter(service__in=services).order_by('id'):
+            counters[counter.service_id].append(counter)
+        now = timezone.now()
+        data = []
+        for service in services:
+            live = counter_metrics.service_metrics(service.id, now)
+            data.append({
+                'service_id': service.id,
+                'service_name': service.name,
+                'counters': [
+                    {
+                        'counter_id': counter.id,
+                        'counter_name': counter.name,
+                        **(live.get(counter.id) or counter_metrics.metrics(None, now)),
+                    }
+                    for counter in counters[service.id]
+                ],
             })
-            
-        serializer = ServiceAnalyticsSerializer(analytics_data, many=True)
-        return response.Response(serializer.data, status=status.HTTP_200_OK)
-
-    def calculate_average_wait_time(self, logs):
-        total_wait_time = timezone.timedelta(0)
-        user_join_times = {}
-        completed_count = 0
-
-        for log in logs:
-            if log.action == 'user_join':
-                # Store the last join time for a user (in case they join multiple times)
-                user_join_times[log.user_id] = log.timestamp
-            elif log.action in ['service_completed', 'user_skipped', 'user_called']:
-                if log.user_id in user_join_times:
-                    wait_time = log.timestamp - user_join_times[log.user_id]
-                    # Basic check to avoid negative wait times if data is weird
-                    if wait_time > timezone.timedelta(0):
-                        total_wait_time += wait_time
-                        completed_count += 1
-                        # A user's wait time is only counted once.
-                        del user_join_times[log.user_id] 
-
-        return total_wait_time / completed_count if completed_count > 0 else timezone.timedelta(0)
+        return response.Response(ServiceCounterMetricsSerializer(data, many=True).data, status=status.HTTP_200_OK)
+
+class ExportView(views.APIView):
+    """
+    Streams the ``activity`` log or the ``queue-entries`` history of a range of days as a file.
+
+    Takes the same ``?start=`` and ``?end=`` as the service analytics,
+    ``?output=csv|ndjson`` and ``?gzip=true``. Rows are streamed from a
+    database cursor as they are encoded, so memory use does not grow with
+    the size of the export.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, name):
+        if name not in exports.EXPORTS:
+            raise Http404
+        params, start, end = requested_range(request, ExportParamsSerializer)
+        output, compress = params['output'], params['gzip']
+        today = timezone.localdate()
+
+        chunks = exports.export(name, start, end, output, compress)
+        if served_over_asgi(request):
+            chunks = exports.aiter_chunks(chunks)
+        streamed = StreamingHttpResponse(
+            chunks, content_type='application/gzip' if compress else exports.FORMATS[output][0]
+        )
+        file_name = exports.filename(name, params.get('start', today), params.get('end', today), output, compress)
+        streamed['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        return streamed
@@ -0,0 +1,137 @@
+"""
+Wait times computed from the activity log in the database.
+
+A wait runs from a ``user_join`` to the next activity of the same user and
+service, when that is a call or a terminal event. On PostgreSQL, ``LEAD``
+over the activity of each (user, service) pairs every join with exactly that
+event, so repeated joins are each counted once, and the pairs are summed by
+a ``GROUP BY`` around the window query: only the totals come back to Python.
+
+Other backends pair the events in a single streaming pass instead. SQLite
+can run the window query, but sorting the partitions makes it slower there
+than streaming (see ``benchmark_wait_times``).
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import DurationField, ExpressionWrapper, F, Window
+from django.db.models.functions import Lead, Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ACTION_CODES, ActivityLog
+
+WAIT_END_ACTIONS = ('user_called', 'service_completed', 'user_skipped', 'user_rejected')
+
+# Joins are looked up this far before the start of a range, for waits that span it.
+LOOKBACK = timedelta(days=1)
+
+# Total seconds of the summed ``wait`` durations, per backend that can run the window query.
+WAIT_SECONDS_SQL = {
+    'postgresql': 'EXTRACT(EPOCH FROM SUM(paired.wait))',
+    'sqlite': 'SUM(paired.wait) / 1000000.0',
+}
+
+
+def wait_totals(start, end, granularity=None, method=None):
+    """
+    Returns ``(service_id, counter_id, bucket, wait_count, wait_seconds)`` for the waits that ended in ``[start, end)``.
+
+    Waits are grouped by service, by the counter of the event that ended
+    them and, if ``granularity`` is given, by the bucket they ended in;
+    ``bucket`` is None otherwise. ``method`` is ``'window'`` or
+    ``'streamed'``, by default window functions on PostgreSQL.
+    """
+    logs = ActivityLog.objects.filter(
+        timestamp__gte=start - LOOKBACK,
+        timestamp__lt=end,
+        action__in=('user_join',) + WAIT_END_ACTIONS
+    )
+    if method is None:
+        method = 'window' if connection.vendor == 'postgresql' else 'streamed'
+    if method == 'window':
+        return _window_totals(logs, start, granularity)
+    return _streamed_totals(logs, start, granularity)
+
+
+def average_wait_times(start, end):
+    """
+    Returns ``{service_id: {'wait_count', 'average_wait_time'}}`` for the waits that ended in ``[start, end)``.
+    """
+    totals = defaultdict(lambda: [0, 0.0])
+    for service_id, counter_id, bucket, wait_count, wait_seconds in wait_totals(start, end):
+        totals[service_id][0] += wait_count
+        totals[service_id][1] += wait_seconds
+    return {
+        service_id: {'wait_count': count, 'average_wait_time': timedelta(seconds=seconds / count)}
+        for service_id, (count, seconds) in totals.items()
+    }
+
+
+def _window_totals(logs, start, granularity):
+    window = {
+        'partition_by': [F('user_id'), F('service_id')],
+        'order_by': [F('timestamp').asc(), F('id').asc()],
+    }
+    # Conditions on the pairs are applied around the window query: filtering
+    # the joins inside it would hide the events that end their waits.
+    annotations = {
+        'ended_action': Window(Lead('action'), **window),
+        'ended_counter_id': Window(Lead('counter_id'), **window),
+        'ended_at': Window(Lead('timestamp'), **window),
+        'wait': ExpressionWrapper(Window(Lead('timestamp'), **window) - F('timestamp'), output_field=DurationField()),
+    }
+    if granularity:
+        annotations['bucket'] = Trunc(Window(Lead('timestamp'), **window), granularity)
+    paired = logs.annotate(**annotations).values('service_id', 'action', *annotations)
+
+    inner_sql, inner_params = paired.query.sql_with_params()
+    group_by = 'paired.service_id, paired.ended_counter_id' + (', paired.bucket' if granularity else '')
+    sql = (
+        f"SELECT paired.service_id, paired.ended_counter_id, {'paired.bucket' if granularity else 'NULL'}, "
+        f"COUNT(*), {WAIT_SECONDS_SQL[connection.vendor]} "
+        f"FROM ({inner_sql}) paired "
+        f"WHERE paired.action = %s AND paired.ended_action IN ({', '.join(['%s'] * len(WAIT_END_ACTIONS))}) "
+        f"AND paired.ended_at >= %s "
+        f"GROUP BY {group_by}"
+    )
+    # The raw columns hold action codes.
+    params = (
+        *inner_params, ACTION_CODES['user_join'], *[ACTION_CODES[action] for action in WAIT_END_ACTIONS],
+        connection.ops.adapt_datetimefield_value(start)
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [
+            (service_id, counter_id, _bucket(value), count, float(seconds))
+            for service_id, counter_id, value, count, seconds in cursor.fetchall()
+        ]
+
+
+def _bucket(value):
+    # Raw rows skip the field converters: SQLite returns text, and both return local time without a zone.
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def _streamed_totals(logs, start, granularity):
+    from .rollups import bucket_start
+
+    previous = {}
+    totals = defaultdict(lambda: [0, 0.0])
+    events = logs.order_by('timestamp', 'id').values_list('user_id', 'service_id', 'counter_id', 'action', 'timestamp')
+    for user_id, service_id, counter_id, action, timestamp in events.iterator():
+        key = (user_id, service_id)
+        joined_at = previous.get(key)
+        previous[key] = timestamp if action == 'user_join' else None
+        if action != 'user_join' and joined_at is not None and timestamp >= start:
+            bucket = bucket_start(timestamp, granularity) if granularity else None
+            total = totals[(service_id, counter_id, bucket)]
+            total[0] += 1
+            total[1] += (timestamp - joined_at).total_seconds()
+    return [key + tuple(total) for key, total in totals.items()]
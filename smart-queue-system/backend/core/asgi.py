@@ -9,14 +9,18 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from core.socket_auth_middleware import TokenAuthMiddlewareStack
-import notifications.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
+# Sets Django up before the imports below load any models.
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from core.socket_auth_middleware import TokenAuthMiddlewareStack  # noqa: E402
+import notifications.routing  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": TokenAuthMiddlewareStack(
         URLRouter(
             notifications.routing.websocket_urlpatterns
@@ -0,0 +1,73 @@
+"""
+Cache helpers shared by the apps.
+
+``versioned`` caches a value together with the version of the data it was
+computed from, such as the queue status of a service or an analytics
+result. Writers only bump the version; after a bump only one request
+recomputes the value, while others serve the previous one meanwhile, or
+wait for the computation if there is none yet.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def incr(key, delta=1):
+    """
+    Adds ``delta`` to a counter in the cache, starting it at zero, and returns the new count.
+    """
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key, delta)
+
+
+def version(key):
+    # Start from the clock, so that a version lost from the cache never comes back with old values.
+    cache.add(key, int(time.time() * 1000), timeout=None)
+    return cache.get(key)
+
+
+def bump(key):
+    version(key)
+    return cache.incr(key)
+
+
+def computing_key(key):
+    return f"{key}:computing"
+
+
+def versioned(key, current, compute, timeout, compute_timeout, wait_ms):
+    """
+    Returns ``(value, outcome)``, with ``value`` from the cache if it was computed at version ``current``.
+
+    ``outcome`` is ``'hit'``, ``'stale'`` for the previous value served
+    while another request computes the current one, or ``'miss'`` if
+    ``compute()`` ran. A request finding no value at all waits up to
+    ``wait_ms`` for the request computing it before computing it too.
+    Values expire after ``timeout`` seconds and a request that dies
+    computing holds the others off for ``compute_timeout`` seconds.
+    """
+    cached = cache.get(key)
+    if cached is not None and cached['version'] == current:
+        return cached['value'], 'hit'
+
+    acquired = cache.add(computing_key(key), current, timeout=compute_timeout)
+    if not acquired:
+        # Somebody else is computing it; a value a moment old beats computing it twice.
+        if cached is not None:
+            return cached['value'], 'stale'
+        deadline = time.monotonic() + wait_ms / 1000
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached['value'], 'hit'
+
+    try:
+        # Tagged with the version read before computing, so a bump meanwhile forces another one.
+        value = compute()
+        cache.set(key, {'version': current, 'value': value}, timeout=timeout)
+    finally:
+        # A request that gave up waiting computes without the key; the key is the other request's.
+        if acquired:
+            cache.delete(computing_key(key))
+    return value, 'miss'
@@ -166,6 +166,145 @@ CHANNEL_LAYERS = {
     },
 }
 
+# --- Cache ---
+CACHES = {
+    'default': env.cache('CACHE_URL', default='rediscache://redis:6379/1'),
+}
+
+# --- Queue index ---
+QUEUE_INDEX = {
+    "BACKEND": env('QUEUE_INDEX_BACKEND', default='smart_queue_app.queue_index.RedisQueueIndex'),
+    "CONFIG": {
+        "url": env('REDIS_URL', default='redis://redis:6379/0'),
+    },
+}
+
+# Serve join, call_next, status and my-queues from the async views in
+# smart_queue_app.async_views instead of the DRF views.
+QUEUE_ASYNC_VIEWS = env.bool('QUEUE_ASYNC_VIEWS', default=False)
+
+# Snapshots of the public queue status, see smart_queue_app.status_cache.
+# TIMEOUT bounds how long changes made outside queue events (e.g. a renamed
+# service) take to show up.
+QUEUE_STATUS_CACHE = {
+    'TIMEOUT': 300,
+    'REBUILD_TIMEOUT': 10,
+    'REBUILD_WAIT_MS': 1000,
+}
+
+# Wait time estimates, see smart_queue_app.eta. ALPHA weighs the latest service
+# time in each counter's moving average; counters that called nobody within
+# ACTIVE_MINUTES are left out, and service times over MAX_SERVICE_MINUTES are
+# taken as breaks rather than service. A service without state is replayed
+# by a worker, scheduled at most once per RELOAD_SCHEDULE_TIMEOUT seconds.
+QUEUE_ETA = {
+    'ALPHA': env.float('QUEUE_ETA_ALPHA', default=0.2),
+    'DEFAULT_SERVICE_SECONDS': 300,
+    'ACTIVE_MINUTES': 30,
+    'MAX_SERVICE_MINUTES': 60,
+    'RELOAD_HOURS': 8,
+    'RELOAD_SCHEDULE_TIMEOUT': 60,
+}
+
+# Archival of finished queue entries, see smart_queue_app.archive. Entries
+# created more than AFTER_DAYS ago are moved in batches of BATCH_SIZE, at most
+# MAX_BATCHES per run.
+QUEUE_ARCHIVE = {
+    'AFTER_DAYS': env.int('QUEUE_ARCHIVE_AFTER_DAYS', default=30),
+    'BATCH_SIZE': 1000,
+    'MAX_BATCHES': 100,
+}
+
+# How call_next claims the next waiting entry: 'index', 'skip_locked' or 'locking'.
+QUEUE_DISPATCH_MODE = env('QUEUE_DISPATCH_MODE', default='index')
+
+# --- Notification coalescing ---
+# Bursts of staff/public updates for a service are merged into one message that is
+# sent once the service has been quiet for WINDOW_MS, and at most MAX_LATENCY_MS
+# after the first update. A window of 0 sends every update on its own.
+NOTIFICATION_COALESCING = {
+    'WINDOW_MS': env.int('NOTIFICATION_COALESCE_WINDOW_MS', default=150),
+    'MAX_LATENCY_MS': env.int('NOTIFICATION_COALESCE_MAX_LATENCY_MS', default=500),
+}
+
+# --- Notification outbox ---
+# DISPATCH is 'celery' (a dispatch_outbox task per burst of commits) or 'eager'
+# (dispatch in process right after commit, for tests and local development).
+NOTIFICATION_OUTBOX = {
+    'DISPATCH': env('NOTIFICATION_OUTBOX_DISPATCH', default='celery'),
+    'BATCH_SIZE': 200,
+    'SCHEDULE_TIMEOUT': 30,
+    'RETENTION_HOURS': 24,
+    # Failed deliveries before an event is parked and left to an admin.
+    'MAX_ATTEMPTS': 5,
+}
+
+# --- Real-time publishing ---
+# Per message class, 'direct' publishes to the channel layer from the web process
+# right after commit and 'celery' leaves delivery to a worker.
+NOTIFICATION_PUBLISH = {
+    'user': env('NOTIFICATION_PUBLISH_USER', default='direct'),
+    'staff': env('NOTIFICATION_PUBLISH_STAFF', default='direct'),
+    'public': env('NOTIFICATION_PUBLISH_PUBLIC', default='celery'),
+    'activity': env('NOTIFICATION_PUBLISH_ACTIVITY', default='celery'),
+    'status': env('NOTIFICATION_PUBLISH_STATUS', default='direct'),
+    'eta': env('NOTIFICATION_PUBLISH_ETA', default='direct'),
+    'rollup': env('NOTIFICATION_PUBLISH_ROLLUP', default='celery'),
+    'counter_metrics': env('NOTIFICATION_PUBLISH_COUNTER_METRICS', default='celery'),
+}
+
+# Sinks that every queue event is fanned out to, by the outbox dispatcher or, for
+# message classes published directly, by the web process after commit.
+QUEUE_EVENT_SINKS = [
+    'notifications.sinks.UserNotificationSink',
+    'notifications.sinks.StaffQueueSink',
+    'notifications.sinks.PublicDisplaySink',
+    'notifications.sinks.ActivityLogSink',
+    'analytics.rollups.RollupSink',
+    'analytics.counter_metrics.CounterMetricsSink',
+    # Before the status snapshots, so that rebuilt ones carry the updated estimates.
+    'smart_queue_app.eta.EtaSink',
+    'smart_queue_app.status_cache.StatusCacheSink',
+]
+
+# Activity rollups behind the analytics endpoint, see analytics.rollups. Buckets
+# of each granularity are kept for RETENTION_DAYS (None keeps them forever).
+ANALYTICS_ROLLUPS = {
+    'RETENTION_DAYS': {'minute': 7, 'hour': 400, 'day': None},
+}
+
+# Cached results of the analytics endpoints, see analytics.result_cache. Results
+# are recomputed once new activity is ingested, and at the latest after TIMEOUT
+# seconds. Concurrent requests wait up to COMPUTE_WAIT_MS for a computation in
+# progress, which is considered abandoned after COMPUTE_TIMEOUT seconds.
+ANALYTICS_RESULT_CACHE = {
+    'TIMEOUT': 300,
+    'COMPUTE_TIMEOUT': 60,
+    'COMPUTE_WAIT_MS': 10000,
+}
+
+# Live per-counter metrics, see analytics.counter_metrics. Metrics cover the
+# current local day; service times over MAX_SERVICE_MINUTES are taken as breaks
+# rather than service, and gaps between services over MAX_IDLE_MINUTES as the
+# counter being closed rather than idle.
+COUNTER_METRICS = {
+    'MAX_SERVICE_MINUTES': 60,
+    'MAX_IDLE_MINUTES': 30,
+}
+
+# ActivityLog partitions and retention, see analytics.partitions. On PostgreSQL the
+# table is partitioned by INTERVAL ('month' or 'day', fixed once partitions exist),
+# PREMAKE intervals ahead. Activity older than RETENTION_DAYS (None keeps it forever)
+# is dropped by partition, or only detached from the table with ON_EXPIRY = 'detach';
+# other databases delete it in batches of DELETE_BATCH_SIZE rows.
+ACTIVITY_LOG_PARTITIONS = {
+    'INTERVAL': 'month',
+    'PREMAKE': 3,
+    'RETENTION_DAYS': env.int('ACTIVITY_LOG_RETENTION_DAYS', default=400),
+    'ON_EXPIRY': env('ACTIVITY_LOG_ON_EXPIRY', default='drop'),
+    'DELETE_BATCH_SIZE': 10000,
+}
+
 # --- Celery ---
 CELERY_BROKER_URL = env('REDIS_URL', default='redis://redis:6379/0')
 CELERY_RESULT_BACKEND = env('REDIS_URL', default='redis://redis:6379/0')
@@ -173,6 +312,32 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-queue-index': {
+        'task': 'smart_queue_app.tasks.reconcile_queue_index',
+        'schedule': 60.0,
+    },
+    'dispatch-notification-outbox': {
+        'task': 'notifications.tasks.dispatch_outbox',
+        'schedule': 10.0,
+    },
+    'purge-notification-outbox': {
+        'task': 'notifications.tasks.purge_outbox',
+        'schedule': 3600.0,
+    },
+    'archive-queue-entries': {
+        'task': 'smart_queue_app.tasks.archive_queue_entries',
+        'schedule': 3600.0,
+    },
+    'purge-analytics-rollups': {
+        'task': 'analytics.tasks.purge_rollups',
+        'schedule': 86400.0,
+    },
+    'maintain-activity-partitions': {
+        'task': 'analytics.tasks.maintain_activity_partitions',
+        'schedule': 86400.0,
+    },
+}
 
 # --- OpenAPI (drf-spectacular) ---
 SPECTACULAR_SETTINGS = {
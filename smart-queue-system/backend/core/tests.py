@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from smart_queue_app.tests import LOCAL_BACKENDS
+from . import caching
+
+
+@override_settings(**LOCAL_BACKENDS)
+class VersionedCacheTests(SimpleTestCase):
+    key = 'test:value'
+    version_key = 'test:version'
+
+    def tearDown(self):
+        cache.clear()
+
+    def get(self, compute, wait_ms=20):
+        return caching.versioned(self.key, caching.version(self.version_key), compute, 300, 60, wait_ms)
+
+    def test_value_is_computed_once_per_version(self):
+        computed = []
+
+        def compute():
+            computed.append(None)
+            return len(computed)
+
+        self.assertEqual(self.get(compute), (1, 'miss'))
+        self.assertEqual(self.get(compute), (1, 'hit'))
+        caching.bump(self.version_key)
+        self.assertEqual(self.get(compute), (2, 'miss'))
+        self.assertIsNone(cache.get(caching.computing_key(self.key)))
+
+    def test_previous_value_is_served_while_another_request_computes(self):
+        self.get(lambda: 'old')
+        caching.bump(self.version_key)
+        cache.add(caching.computing_key(self.key), 'other', timeout=60)
+
+        self.assertEqual(self.get(lambda: 'new'), ('old', 'stale'))
+
+    def test_waiter_leaves_the_computing_key_alone(self):
+        # Another request is computing and takes longer than we wait.
+        cache.add(caching.computing_key(self.key), 'other', timeout=60)
+
+        self.assertEqual(self.get(lambda: 'value'), ('value', 'miss'))
+        self.assertEqual(cache.get(caching.computing_key(self.key)), 'other')
+
+    def test_incr_starts_at_zero(self):
+        self.assertEqual(caching.incr('test:count'), 1)
+        self.assertEqual(caching.incr('test:count', 5), 6)
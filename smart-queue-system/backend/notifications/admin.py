@@ -0,0 +1,15 @@
+from django.contrib import admin
+from .models import OutboxEvent
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'dedup_key', 'created_at', 'dispatched_at', 'attempts', 'last_error')
+    list_filter = ('kind',)
+    search_fields = ('dedup_key',)
+    ordering = ('-id',)
+    actions = ['retry']
+
+    @admin.action(description='Retry the selected undelivered events')
+    def retry(self, request, queryset):
+        retried = queryset.filter(dispatched_at__isnull=True).update(attempts=0, last_error='')
+        self.message_user(request, f"{retried} event(s) will be retried by the next dispatch.")
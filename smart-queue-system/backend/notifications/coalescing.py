@@ -0,0 +1,138 @@
+"""
+Per-service coalescing of bursty queue broadcasts.
+
+Instead of sending a WebSocket message per mutation, the views record that a
+stream (``staff`` or ``public``) of a service has pending changes and a single
+flush task is scheduled for it. Further updates inside the window only
+refresh the pending state. The flush waits until the stream has been quiet
+for ``WINDOW_MS`` but never longer than ``MAX_LATENCY_MS`` after the first
+pending update, then emits the latest state in one message.
+
+All state lives in the Django cache so that every web process feeds the same
+window. Submitted/emitted counters are kept per stream to tune the window.
+
+Streams published in ``direct`` mode send the first update of each window
+from the calling process straight away; the rest of a burst is merged by
+the scheduled flush as usual.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import caching
+from . import publishing
+
+STREAMS = ('staff', 'public')
+PUBLIC_FIELDS = ('now_serving', 'queue_length')
+
+
+def _window():
+    return settings.NOTIFICATION_COALESCING['WINDOW_MS'] / 1000
+
+
+def _max_latency():
+    return settings.NOTIFICATION_COALESCING['MAX_LATENCY_MS'] / 1000
+
+
+def _key(stream, service_id, name):
+    return f"coalesce:{stream}:{service_id}:{name}"
+
+
+def submit(stream, service_id):
+    """
+    Records a pending update for a stream and schedules its flush if needed.
+    """
+    from .tasks import flush_coalesced_update
+
+    if stream not in STREAMS:
+        raise ValueError(f"Unknown coalescing stream: {stream}")
+
+    caching.incr(f"coalesce:stats:{stream}:submitted")
+    now = time.time()
+    cache.set(_key(stream, service_id, 'last'), now, timeout=None)
+
+    window = _window()
+    direct = publishing.is_direct(stream)
+    if window <= 0:
+        if direct:
+            publish_now(stream, service_id)
+        else:
+            flush_coalesced_update.delay(stream, service_id)
+    elif direct and cache.add(
+        # At most one direct send per window; later updates in it are scheduled below.
+        _key(stream, service_id, f"direct:{int(now / window)}"), 1, timeout=math.ceil(window) + 1
+    ):
+        publish_now(stream, service_id)
+    elif cache.add(_key(stream, service_id, 'first'), now, timeout=None):
+        # First update of a new window; later ones ride along with this flush.
+        flush_coalesced_update.apply_async((stream, service_id), countdown=window)
+
+
+def publish_now(stream, service_id):
+    """
+    Flushes a stream and sends the result from the current process.
+    """
+    flushed = flush(stream, service_id)
+    if flushed is not None:
+        publishing.group_send(*flushed)
+
+
+def publish_public_update(service_id, **fields):
+    """
+    Updates the public state of a service and queues a coalesced broadcast.
+    """
+    cache.set_many({_key('public', service_id, name): value for name, value in fields.items()}, timeout=None)
+    submit('public', service_id)
+
+
+def remaining_delay(stream, service_id):
+    """
+    Seconds until a pending flush is due; zero or less means flush now.
+    """
+    first = cache.get(_key(stream, service_id, 'first'))
+    if first is None:
+        return 0
+    last = cache.get(_key(stream, service_id, 'last'), first)
+    due = min(last + _window(), first + _max_latency())
+    return due - time.time()
+
+
+def flush(stream, service_id):
+    """
+    Builds the latest state of a stream and returns ``(group, event)``, or None if nothing is pending.
+    """
+    # Clear the window first so updates arriving during the flush schedule a new one.
+    cache.delete(_key(stream, service_id, 'first'))
+
+    if stream == 'staff':
+        from smart_queue_app.staff_updates import build_pending_message
+        message = build_pending_message(service_id)
+        group, handler = f"service_{service_id}_staff", 'send_staff_notification'
+    else:
+        state = cache.get_many([_key('public', service_id, name) for name in PUBLIC_FIELDS])
+        message = {'type': 'public_update', 'service_id': service_id}
+        for name in PUBLIC_FIELDS:
+            if _key('public', service_id, name) in state:
+                message[name] = state[_key('public', service_id, name)]
+        group, handler = "public_service_updates", 'send_notification'
+
+    if message is None:
+        return None
+
+    caching.incr(f"coalesce:stats:{stream}:emitted")
+    return group, {'type': handler, 'message': message}
+
+
+def stats():
+    """
+    Returns submitted, emitted and merged update counts per stream.
+    """
+    counts = cache.get_many([f"coalesce:stats:{stream}:{name}" for stream in STREAMS for name in ('submitted', 'emitted')])
+    result = {}
+    for stream in STREAMS:
+        submitted = counts.get(f"coalesce:stats:{stream}:submitted", 0)
+        emitted = counts.get(f"coalesce:stats:{stream}:emitted", 0)
+        result[stream] = {'submitted': submitted, 'emitted': emitted, 'merged': max(submitted - emitted, 0)}
+    return result
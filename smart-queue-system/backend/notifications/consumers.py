@@ -2,6 +2,7 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from services.models import Service
+from smart_queue_app import staff_updates
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -20,11 +21,13 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
         # For staff/admin, join groups for the services they manage
         self.staff_service_groups = []
+        self.staff_service_ids = []
         if self.user.role in ['staff', 'admin']:
             services = await self.get_user_services()
             for service in services:
                 group_name = f"service_{service.id}_staff"
                 self.staff_service_groups.append(group_name)
+                self.staff_service_ids.append(service.id)
                 await self.channel_layer.group_add(group_name, self.channel_name)
         
         await self.accept()
@@ -33,6 +36,10 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             'message': 'Connection established successfully.'
         }))
 
+        # Staff clients start from a full snapshot and apply deltas on top of it
+        for service_id in self.staff_service_ids:
+            await self.send_queue_snapshot(service_id)
+
     async def disconnect(self, close_code):
         if self.user.is_authenticated:
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
@@ -42,8 +49,16 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 await self.channel_layer.group_discard(group_name, self.channel_name)
 
     async def receive(self, text_data):
-        # We don't need to receive messages from the client for this app
-        pass
+        # Staff clients ask for a fresh snapshot when they detect a gap in the delta sequence
+        try:
+            content = json.loads(text_data)
+        except ValueError:
+            return
+
+        if content.get('type') == 'resync':
+            service_id = content.get('service_id')
+            if service_id in self.staff_service_ids:
+                await self.send_queue_snapshot(service_id)
 
     async def send_notification(self, event):
         """ Handler for personal user notifications. """
@@ -53,6 +68,10 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         """ Handler for staff-specific notifications. """
         await self.send(text_data=json.dumps(event['message']))
 
+    async def send_queue_snapshot(self, service_id):
+        snapshot = await database_sync_to_async(staff_updates.build_snapshot)(service_id)
+        await self.send(text_data=json.dumps(snapshot))
+
     @database_sync_to_async
     def get_user_services(self):
         if self.user.role == 'admin':
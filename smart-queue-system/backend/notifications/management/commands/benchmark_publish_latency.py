@@ -0,0 +1,145 @@
+import statistics
+import threading
+import time
+import uuid
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from asgiref.sync import async_to_sync
+from celery.contrib.testing.worker import start_worker
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from core.celery import app
+from notifications import outbox, publishing, queue_events
+from notifications.models import OutboxEvent
+from services.models import Service, Counter
+from users.models import User
+from smart_queue_app.models import QueueEntry
+
+
+@app.task(name='benchmark_publish_latency.busy')
+def busy(seconds):
+    """
+    Stand-in for unrelated work that sits ahead of a notification in the worker queue.
+    """
+    time.sleep(seconds)
+
+
+class TimedInMemoryChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory channel layer that records when each event reaches a channel.
+    """
+
+    arrivals = {}
+    arrived = threading.Condition()
+
+    async def send(self, channel, message):
+        event_id = message.get('message', {}).get('event_id')
+        if event_id:
+            with self.arrived:
+                self.arrivals.setdefault(event_id, time.perf_counter())
+                self.arrived.notify_all()
+        await super().send(channel, message)
+
+    @classmethod
+    def wait_for(cls, event_id, timeout):
+        with cls.arrived:
+            cls.arrived.wait_for(lambda: event_id in cls.arrivals, timeout=timeout)
+            return cls.arrivals.get(event_id)
+
+
+class Command(BaseCommand):
+    help = "Measures commit-to-receive latency of \"it's your turn\" notifications per publish mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=200, help='Number of calls measured per mode.')
+        parser.add_argument(
+            '--backlog', type=int, default=0,
+            help='Unrelated tasks queued ahead of each call, standing in for a busy worker.'
+        )
+        parser.add_argument('--task-ms', type=float, default=5.0, help='How long each backlog task runs.')
+        parser.add_argument('--poll-ms', type=float, default=1.0, help='Polling interval of the in-memory broker.')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for a single notification.')
+        parser.add_argument('--modes', nargs='+', choices=publishing.PUBLISH_MODES, default=list(publishing.PUBLISH_MODES))
+
+    def handle(self, *args, **options):
+        # Everything runs in this process: the web side on the main thread, a Celery
+        # worker on another thread over the in-memory broker, and the in-memory channel layer.
+        # The memory transport polls, so poll often enough not to dwarf what is being measured.
+        app.conf.update(
+            CELERY_TASK_ALWAYS_EAGER=False,
+            CELERY_BROKER_URL='memory://',
+            CELERY_BROKER_TRANSPORT_OPTIONS={'polling_interval': options['poll_ms'] / 1000},
+            CELERY_RESULT_BACKEND='cache+memory://'
+        )
+        layers = {'default': {
+            'BACKEND': f"{__name__}.TimedInMemoryChannelLayer",
+            'CONFIG': {'capacity': options['samples'] * len(options['modes']) + 1},
+        }}
+
+        prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+        service = Service.objects.create(name=prefix)
+        counter = Counter.objects.create(name='Counter 1', service=service)
+        user = User.objects.create(username=prefix)
+        event_ids = []
+
+        try:
+            with override_settings(CHANNEL_LAYERS=layers), \
+                    start_worker(app, pool='solo', perform_ping_check=False, shutdown_timeout=30):
+                layer = get_channel_layer()
+                channel = async_to_sync(layer.new_channel)()
+                async_to_sync(layer.group_add)(f"user_{user.id}", channel)
+
+                self.stdout.write(f"{'mode':<8} {'received':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+                for mode in options['modes']:
+                    publish = dict(settings.NOTIFICATION_PUBLISH, user=mode, staff=mode)
+                    outbox = dict(settings.NOTIFICATION_OUTBOX, DISPATCH='celery')
+                    with override_settings(NOTIFICATION_PUBLISH=publish, NOTIFICATION_OUTBOX=outbox):
+                        latencies = self.run_calls(service, counter, user, options, event_ids)
+                    self.report(mode, latencies, options['samples'])
+        finally:
+            OutboxEvent.objects.filter(dedup_key__in=event_ids).delete()
+            service.delete()
+            user.delete()
+
+    def run_calls(self, service, counter, user, options, event_ids):
+        latencies = []
+        for _ in range(options['samples']):
+            entry = QueueEntry.objects.create(user=user, service=service, token_number=len(event_ids) + 1)
+            for _ in range(options['backlog']):
+                busy.delay(options['task_ms'] / 1000)
+
+            started = time.perf_counter()
+            with transaction.atomic():
+                entry.status = 'in_progress'
+                entry.counter = counter
+                entry.save()
+                queue_events.emit('called', entry, previous_status='waiting')
+
+            event_id = f"called:{entry.id}"
+            event_ids.append(event_id)
+            received = TimedInMemoryChannelLayer.wait_for(event_id, options['timeout'])
+            if received is not None:
+                latencies.append((received - started) * 1000)
+
+            self.wait_for_outbox(options['timeout'])
+            entry.status = 'completed'
+            entry.save()
+        return latencies
+
+    def wait_for_outbox(self, timeout):
+        # Let the worker finish the rest of the event so samples do not overlap.
+        deadline = time.monotonic() + timeout
+        while outbox.pending().exists() and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    def report(self, mode, latencies, samples):
+        if len(latencies) < samples:
+            self.stdout.write(self.style.ERROR(f"{mode}: {samples - len(latencies)} notifications never arrived"))
+        if len(latencies) < 2:
+            return
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        self.stdout.write(
+            f"{mode:<8} {len(latencies):>8} {statistics.median(latencies):>8.2f} "
+            f"{percentiles[94]:>8.2f} {percentiles[98]:>8.2f} {max(latencies):>8.2f}"
+        )
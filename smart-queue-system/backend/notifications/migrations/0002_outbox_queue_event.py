@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 23:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='kind',
+            field=models.CharField(choices=[('queue_event', 'Queue Event'), ('user_notification', 'User Notification'), ('activity', 'Activity')], max_length=30),
+        ),
+    ]
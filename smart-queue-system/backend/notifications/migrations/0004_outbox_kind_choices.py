@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 02:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_outbox_attempts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='kind',
+            field=models.CharField(choices=[('queue_event', 'Queue Event')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import models
+
+class OutboxEvent(models.Model):
+    """
+    Side effect of a queue mutation, written in the same transaction as the mutation.
+
+    The outbox dispatcher delivers pending events in batches after commit;
+    ``dedup_key`` makes enqueueing idempotent and is passed on to clients so
+    they can drop redeliveries. Events that keep failing are parked, see
+    ``outbox.dispatch``.
+    """
+    KIND_CHOICES = (
+        ('queue_event', 'Queue Event'),
+    )
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    payload = models.JSONField()
+    dedup_key = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    # Failed deliveries; events are parked at NOTIFICATION_OUTBOX['MAX_ATTEMPTS'].
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['id'],
+                condition=models.Q(dispatched_at__isnull=True),
+                name='outbox_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} ({self.dedup_key})"
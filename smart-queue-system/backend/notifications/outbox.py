@@ -0,0 +1,157 @@
+"""
+Transactional outbox for queue events.
+
+Views call ``queue_events.emit`` inside their transaction, which only inserts
+an ``OutboxEvent`` row. Once the transaction commits a single dispatch is
+scheduled (at most one in flight), and the dispatcher drains pending events
+in batches, handing them to ``queue_events.fan_out`` (notifications, activity
+log, rollups and caches) in the same transaction that marks the events
+dispatched. Rolled-back requests therefore never notify anybody, workers
+never see uncommitted rows, and delivery is at-least-once with the dedup key
+attached to every message.
+
+A batch that fails is retried one event at a time, each in its own
+transaction, so a single bad event (say one whose user was deleted before
+dispatch) cannot hold back the rest. Failed events count their attempts
+and keep their last error, and are retried by later dispatches until
+``MAX_ATTEMPTS``; then they are parked and left for an admin to look at
+(and requeue by resetting ``attempts``).
+
+With ``NOTIFICATION_OUTBOX['DISPATCH'] = 'eager'`` events are dispatched in
+process right after commit, which is what tests use instead of Celery.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_KEY = 'outbox:dispatch_scheduled'
+
+
+def enqueue(kind, payload, dedup_key=None):
+    """
+    Writes an event to the outbox as part of the current transaction.
+
+    Enqueueing a ``dedup_key`` that already exists is a no-op.
+    """
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(kind=kind, payload=payload, dedup_key=dedup_key or uuid.uuid4().hex)],
+        ignore_conflicts=True
+    )
+    transaction.on_commit(schedule_dispatch)
+
+
+def schedule_dispatch():
+    if settings.NOTIFICATION_OUTBOX['DISPATCH'] == 'eager':
+        dispatch()
+    elif cache.add(SCHEDULED_KEY, 1, timeout=settings.NOTIFICATION_OUTBOX['SCHEDULE_TIMEOUT']):
+        from .tasks import dispatch_outbox
+        dispatch_outbox.delay()
+
+
+def pending():
+    """
+    Events waiting for delivery, excluding parked ones.
+    """
+    return OutboxEvent.objects.filter(
+        dispatched_at__isnull=True,
+        attempts__lt=settings.NOTIFICATION_OUTBOX['MAX_ATTEMPTS']
+    )
+
+
+def dispatch(batch_size=None):
+    """
+    Delivers pending events in batches and returns how many were dispatched.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_OUTBOX['BATCH_SIZE']
+
+    # Release the schedule guard before reading, so events committed from now on
+    # schedule another dispatch instead of waiting for the periodic sweep.
+    cache.delete(SCHEDULED_KEY)
+
+    total = 0
+    failed = set()
+    while True:
+        events = []
+        try:
+            with transaction.atomic():
+                events = list(_lock(pending().exclude(pk__in=failed).order_by('id')[:batch_size]))
+                if not events:
+                    break
+                _deliver_and_mark(events)
+            total += len(events)
+        except Exception:
+            if not events:
+                raise
+            logger.exception("Delivering %d outbox events failed; retrying them one at a time.", len(events))
+            for event in events:
+                if _deliver_one(event.pk):
+                    total += 1
+                else:
+                    # Retried by the next dispatch, not again in this one.
+                    failed.add(event.pk)
+
+        if len(events) < batch_size:
+            break
+    return total
+
+
+def _lock(queryset):
+    return queryset.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+
+
+def _deliver_and_mark(events):
+    deliver(events)
+    if connection.vendor == 'postgresql':
+        # Deferred foreign keys are otherwise checked at commit, where a
+        # violation could no longer be pinned on a single event.
+        connection.check_constraints()
+    OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(dispatched_at=timezone.now())
+
+
+def _deliver_one(pk):
+    """
+    Delivers one event in its own transaction, recording the failure on the event if it fails.
+    """
+    try:
+        with transaction.atomic():
+            event = _lock(pending().filter(pk=pk)).first()
+            if event is None:
+                # Delivered or parked meanwhile.
+                return False
+            _deliver_and_mark([event])
+        return True
+    except Exception as error:
+        logger.exception("Delivering outbox event %s failed.", pk)
+        OutboxEvent.objects.filter(pk=pk).update(
+            attempts=F('attempts') + 1,
+            last_error=f"{type(error).__name__}: {error}"
+        )
+        if not pending().filter(pk=pk).exists():
+            logger.error("Parked outbox event %s after %d failed attempts.", pk, settings.NOTIFICATION_OUTBOX['MAX_ATTEMPTS'])
+        return False
+
+
+def deliver(events):
+    queue_events = [(event.dedup_key, event.payload) for event in events if event.kind == 'queue_event']
+    if queue_events:
+        from .queue_events import fan_out
+        fan_out(queue_events)
+
+
+def purge(older_than=None):
+    """
+    Deletes dispatched events past the retention window.
+    """
+    older_than = older_than or timedelta(hours=settings.NOTIFICATION_OUTBOX['RETENTION_HOURS'])
+    deleted, _ = OutboxEvent.objects.filter(dispatched_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -0,0 +1,39 @@
+"""
+Where real-time messages are published from.
+
+Each message class (``user``, ``staff``, ``public``, ``activity``) is
+published in one of two modes, set in ``NOTIFICATION_PUBLISH``:
+
+``celery``
+    A worker delivers the message, through the outbox dispatcher or a
+    coalesced flush task. Survives crashes of the web process, but waits
+    behind whatever else the workers are busy with.
+``direct``
+    The web process sends the message to the channel layer itself right
+    after the transaction commits, skipping the broker and the worker queue.
+    A message is lost if the process dies between commit and publish, and a
+    failed publish is handed to a worker instead. Coalesced streams send
+    only the first update of each window directly; the rest of a burst is
+    still flushed by a Celery task.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PUBLISH_MODES = ('direct', 'celery')
+
+
+def mode(message_class):
+    publish_mode = settings.NOTIFICATION_PUBLISH.get(message_class, 'celery')
+    if publish_mode not in PUBLISH_MODES:
+        raise ImproperlyConfigured(f"Unknown publish mode for {message_class} messages: {publish_mode}")
+    return publish_mode
+
+
+def is_direct(message_class):
+    return mode(message_class) == 'direct'
+
+
+def group_send(group, event):
+    async_to_sync(get_channel_layer().group_send)(group, event)
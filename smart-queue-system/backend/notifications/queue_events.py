@@ -0,0 +1,128 @@
+"""
+One compact envelope per queue mutation.
+
+A view records a single ``queue_event`` in the outbox instead of enqueueing a
+task per side effect. The outbox dispatcher hands each batch of envelopes to
+every sink listed in ``QUEUE_EVENT_SINKS`` (user, staff, public, analytics),
+so new sinks add work inside the worker but no extra round-trips from the
+web tier.
+
+Sinks whose message class is published in ``direct`` mode (see
+``publishing``) are skipped by the dispatcher and run in the web process
+right after commit instead.
+"""
+import logging
+import uuid
+from functools import lru_cache, partial
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import outbox, publishing
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('joined', 'called', 'completed', 'skipped', 'rejected', 'custom_notification')
+
+
+def envelope(event_type, entry, previous_status=None, **extra):
+    from smart_queue_app.staff_updates import entry_data
+
+    return {
+        'event': event_type,
+        'at': timezone.now().isoformat(),
+        'previous_status': previous_status,
+        'service': {'id': entry.service_id, 'name': entry.service.name},
+        'counter_name': entry.counter.name if entry.counter_id else None,
+        'entry': entry_data(entry),
+        **extra,
+    }
+
+
+def emit(event_type, entry, previous_status=None, publish_on_commit=True, **extra):
+    """
+    Records a queue event in the outbox as part of the current transaction.
+
+    ``previous_status`` is the status the entry had before the change the
+    event records; joins and custom notifications have none. Returns the ``(event_id, envelope)`` pair. Async callers pass
+    ``publish_on_commit=False`` and await ``apublish_direct`` once the
+    transaction has committed.
+    """
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown queue event: {event_type}")
+
+    # State transitions happen once per entry, so they double as dedup keys.
+    event_id = uuid.uuid4().hex if event_type == 'custom_notification' else f"{event_type}:{entry.id}"
+    payload = envelope(event_type, entry, previous_status, **extra)
+
+    # Registered first so that direct publishes go out before the outbox dispatch is scheduled.
+    event = (event_id, payload)
+    if publish_on_commit and get_sinks('direct'):
+        transaction.on_commit(partial(publish_direct, [event]))
+    outbox.enqueue('queue_event', payload, event_id)
+    return event
+
+
+@lru_cache(maxsize=None)
+def _load_sinks():
+    return tuple((path, import_string(path)()) for path in settings.QUEUE_EVENT_SINKS)
+
+
+def get_sinks(mode='celery'):
+    """
+    Returns ``(path, sink)`` pairs of the sinks published in the given mode.
+    """
+    return [(path, sink) for path, sink in _load_sinks() if publishing.mode(sink.message_class) == mode]
+
+
+def fan_out(events):
+    """
+    Delivers a batch of ``(event_id, envelope)`` pairs to every Celery-published sink.
+    """
+    for path, sink in get_sinks('celery'):
+        sink.handle(events)
+
+
+def publish_direct(events):
+    """
+    Delivers events to the direct sinks from the current process.
+
+    A sink that fails is retried once by a worker rather than failing the
+    request; if the broker is down as well, the events are only logged.
+    Direct sinks feeding a coalesced stream (``staff``) still need the broker
+    for the rest of a burst: only the first update of each window is sent
+    from here, later ones are merged by a scheduled flush task (see
+    ``coalescing.submit``).
+    """
+    for path, sink in get_sinks('direct'):
+        try:
+            sink.handle(events)
+        except Exception:
+            logger.exception("Direct publish to %s failed; handing it to a worker.", path)
+            _hand_to_worker(events, path)
+
+
+async def apublish_direct(events):
+    """
+    Async counterpart of ``publish_direct`` for views running on the event loop.
+    """
+    for path, sink in get_sinks('direct'):
+        try:
+            await sink.ahandle(events)
+        except Exception:
+            logger.exception("Direct publish to %s failed; handing it to a worker.", path)
+            await sync_to_async(_hand_to_worker)(events, path)
+
+
+def _hand_to_worker(events, path):
+    from .tasks import deliver_queue_events
+
+    try:
+        deliver_queue_events.delay(events, path)
+    except Exception:
+        # The mutation has committed; losing a notification must not fail the request.
+        logger.exception("Could not hand events %s for %s to a worker.", [event_id for event_id, _ in events], path)
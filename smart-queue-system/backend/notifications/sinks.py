@@ -0,0 +1,311 @@
+"""
+Sinks for queue events, see ``queue_events``.
+
+A sink receives a batch of ``(event_id, envelope)`` pairs from the outbox
+dispatcher. ``event_id`` is the dedup key of the outbox event; delivery is
+at-least-once, so sinks must tolerate seeing an event twice. Batches may be
+handled by several workers at once, so sinks that update state in the cache
+hold a ``cache_lock`` around each read-modify-write; ``CounterStateStore``
+does so for state kept per counter.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+STAFF_OPS = {
+    'joined': 'added',
+    'called': 'status_changed',
+    'completed': 'removed',
+    'skipped': 'removed',
+    'rejected': 'removed',
+}
+
+ACTIVITY_ACTIONS = {
+    'joined': 'user_join',
+    'called': 'user_called',
+    'completed': 'service_completed',
+    'skipped': 'user_skipped',
+    'rejected': 'user_rejected',
+    'custom_notification': 'custom_notification_sent',
+}
+
+# Queue events at a counter, and the ActivityLog actions replaying them.
+COUNTER_EVENTS = ('called', 'completed', 'skipped', 'rejected')
+COUNTER_LOG_ACTIONS = {ACTIVITY_ACTIONS[event]: event for event in COUNTER_EVENTS}
+
+
+@contextmanager
+def cache_lock(key, timeout=10):
+    """
+    Holds ``key`` in the cache for the duration of the block, waiting while another process holds it.
+
+    A holder that dies releases the key after ``timeout`` seconds.
+    """
+    token = uuid.uuid4().hex
+    while not cache.add(key, token, timeout=timeout):
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        # Past the timeout the key may be somebody else's by now.
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+class CounterStateStore:
+    """
+    A state per counter of each service, kept in the cache and updated in O(1) per queue event.
+
+    Subclasses define how an event changes the state of its counter in
+    ``observe`` and how far back the activity log is replayed into a service
+    without state (cold cache, restart) in ``replay_since``. ``subject`` is
+    the ``ActivityLog`` column standing for the entry an event is about.
+    """
+    # Prefix of the cache keys.
+    prefix = None
+    subject = None
+
+    def observe(self, state, event, subject, at):
+        """
+        Applies one event at a counter to its state and returns the new state.
+
+        ``at`` is an aware datetime.
+        """
+        raise NotImplementedError
+
+    def replay_since(self, until):
+        raise NotImplementedError
+
+    def counter_of(self, counter_id):
+        """
+        Returns the counter that an event at ``counter_id`` counts for, or None to ignore the event.
+        """
+        return counter_id
+
+    def counters_key(self, service_id):
+        return f"{self.prefix}:{service_id}:counters"
+
+    def counter_key(self, service_id, counter_id):
+        return f"{self.prefix}:{service_id}:counter:{counter_id}"
+
+    def lock_key(self, service_id):
+        return f"{self.prefix}:{service_id}:lock"
+
+    def record(self, service_id, counter_id, event, subject, at):
+        counter_id = self.counter_of(counter_id)
+        if counter_id is None:
+            return
+        key = self.counter_key(service_id, counter_id)
+        # Sinks in other workers may be updating the same service.
+        with cache_lock(self.lock_key(service_id)):
+            self.ensure_loaded(service_id, at)
+            cache.set(key, self.observe(cache.get(key), event, subject, at), timeout=None)
+
+            counters = cache.get(self.counters_key(service_id)) or []
+            if counter_id not in counters:
+                cache.set(self.counters_key(service_id), sorted(counters + [counter_id]), timeout=None)
+
+    def reload(self, service_id, until=None):
+        """
+        Rebuilds the states of a service from its activity log up to ``until``.
+        """
+        from analytics.models import ActivityLog
+
+        until = until or timezone.now()
+        logs = ActivityLog.objects.filter(
+            service_id=service_id,
+            timestamp__gte=self.replay_since(until),
+            timestamp__lt=until,
+            action__in=COUNTER_LOG_ACTIONS
+        ).order_by('timestamp', 'id').values_list('counter_id', 'action', self.subject, 'timestamp')
+
+        states = {}
+        for counter_id, action, subject, timestamp in logs.iterator():
+            counter_id = self.counter_of(counter_id)
+            if counter_id is not None:
+                states[counter_id] = self.observe(states.get(counter_id), COUNTER_LOG_ACTIONS[action], subject, timestamp)
+
+        cache.set_many({self.counter_key(service_id, counter_id): state for counter_id, state in states.items()}, timeout=None)
+        cache.set(self.counters_key(service_id), sorted(states), timeout=None)
+
+    def ensure_loaded(self, service_id, until=None):
+        if cache.get(self.counters_key(service_id)) is None:
+            self.reload(service_id, until)
+
+    def states(self, service_id):
+        """
+        Returns ``{counter_id: state}`` for the counters of a service, or None if it has no state yet.
+        """
+        counters = cache.get(self.counters_key(service_id))
+        if counters is None:
+            return None
+        states = cache.get_many([self.counter_key(service_id, counter_id) for counter_id in counters])
+        return {counter_id: states.get(self.counter_key(service_id, counter_id)) for counter_id in counters}
+
+
+class QueueEventSink:
+    # Selects the publish mode in NOTIFICATION_PUBLISH, see ``publishing``.
+    message_class = None
+
+    def handle(self, events):
+        raise NotImplementedError
+
+    async def ahandle(self, events):
+        await sync_to_async(self.handle)(events)
+
+
+class UserNotificationSink(QueueEventSink):
+    """
+    Tells the user behind an entry what happened to it.
+    """
+
+    message_class = 'user'
+
+    def handle(self, events):
+        async_to_sync(self.ahandle)(events)
+
+    async def ahandle(self, events):
+        channel_layer = get_channel_layer()
+        for event_id, event in events:
+            message = self.build_message(event)
+            if message is None:
+                continue
+            message['event_id'] = event_id
+            await channel_layer.group_send(
+                f"user_{event['entry']['user']['id']}",
+                {
+                    "type": "send_notification",
+                    "message": message,
+                },
+            )
+
+    def build_message(self, event):
+        service_name = event['service']['name']
+        kind = event['event']
+
+        if kind == 'called':
+            return {
+                'type': 'queue_update',
+                'status': 'in_progress',
+                'service': service_name,
+                'token': event['entry']['token_number'],
+                'message': f"It's your turn for {service_name}. Please proceed to counter {event['counter_name'] or ''}."
+            }
+        if kind == 'completed':
+            return {
+                'type': 'queue_update',
+                'status': 'completed',
+                'service': service_name,
+                'message': f"Your service for {service_name} is complete. Thank you!"
+            }
+        if kind == 'skipped':
+            return {
+                'type': 'queue_update',
+                'status': 'skipped',
+                'service': service_name,
+                'message': f"You have been skipped in the queue for {service_name}. Please contact staff for assistance."
+            }
+        if kind == 'rejected':
+            return {
+                'type': 'queue_update',
+                'status': 'rejected',
+                'service': service_name,
+                'message': f"Your request for {service_name} has been rejected. Please contact staff for more information."
+            }
+        if kind == 'custom_notification':
+            return {
+                'type': 'custom_notification',
+                'service': service_name,
+                'message': event['message']
+            }
+        return None
+
+
+class StaffQueueSink(QueueEventSink):
+    """
+    Publishes queue deltas to the staff of the service.
+    """
+
+    message_class = 'staff'
+
+    def handle(self, events):
+        from smart_queue_app.staff_updates import record_delta
+
+        for event_id, event in events:
+            op = STAFF_OPS.get(event['event'])
+            if op:
+                record_delta(event['service']['id'], op, event['entry'])
+
+
+class PublicDisplaySink(QueueEventSink):
+    """
+    Updates the public lobby state: queue length on joins, now serving on calls.
+    """
+
+    message_class = 'public'
+
+    def handle(self, events):
+        from smart_queue_app.models import ACTIVE_STATUSES, QueueEntry
+        from . import coalescing
+
+        now_serving = {}
+        joined = set()
+        for event_id, event in events:
+            service_id = event['service']['id']
+            if event['event'] == 'called':
+                now_serving[service_id] = event['entry']['token_number']
+            elif event['event'] == 'joined':
+                joined.add(service_id)
+
+        queue_lengths = dict(
+            QueueEntry.objects.filter(service_id__in=joined, status__in=ACTIVE_STATUSES)
+            .values_list('service_id')
+            .annotate(total=Count('id'))
+        ) if joined else {}
+
+        for service_id in now_serving.keys() | joined:
+            fields = {}
+            if service_id in now_serving:
+                fields['now_serving'] = now_serving[service_id]
+            if service_id in joined:
+                fields['queue_length'] = queue_lengths.get(service_id, 0)
+            coalescing.publish_public_update(service_id, **fields)
+
+
+class ActivityLogSink(QueueEventSink):
+    """
+    Records every queue event in ``ActivityLog``.
+    """
+
+    message_class = 'activity'
+
+    def handle(self, events):
+        from analytics.ingestion import insert_activities
+        from analytics.models import ActivityLog
+
+        rows = []
+        for event_id, event in events:
+            entry = event['entry']
+            at = parse_datetime(event['at'])
+            wait_ms = None
+            if event['event'] == 'called':
+                wait_ms = max(round((at - parse_datetime(entry['created_at'])).total_seconds() * 1000), 0)
+            rows.append(ActivityLog(
+                user_id=entry['user']['id'],
+                service_id=event['service']['id'],
+                counter_id=entry['counter'],
+                action=ACTIVITY_ACTIONS[event['event']],
+                token_number=entry['token_number'],
+                queue_entry_id=entry['id'],
+                wait_ms=wait_ms,
+                details={'message': event['message']} if event['event'] == 'custom_notification' else None,
+                timestamp=at
+            ))
+        insert_activities(rows)
@@ -1,46 +1,48 @@
 from celery import shared_task
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-import json
 
-@shared_task
-def send_notification_to_user(user_id, message):
+@shared_task(bind=True)
+def flush_coalesced_update(self, stream, service_id):
     """
-    Sends a notification to a specific user.
+    Emits the coalesced state of a stream once its window has closed.
     """
+    from . import coalescing
+
+    delay = coalescing.remaining_delay(stream, service_id)
+    if delay > 0 and not self.request.is_eager:
+        # More updates arrived inside the window; wait for it to go quiet.
+        flush_coalesced_update.apply_async((stream, service_id), countdown=delay)
+        return
+
+    flushed = coalescing.flush(stream, service_id)
+    if flushed is None:
+        return
+
+    group, event = flushed
     channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"user_{user_id}",
-        {
-            "type": "send_notification",
-            "message": message,
-        },
-    )
+    async_to_sync(channel_layer.group_send)(group, event)
 
 @shared_task
-def broadcast_public_update(message):
+def deliver_queue_events(events, sink_path):
     """
-    Broadcasts a message to all connected clients on the public channel.
+    Delivers queue events to one sink, for direct publishes that failed in the web process.
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "public_service_updates",
-        {
-            "type": "send_notification",
-            "message": message,
-        },
-    )
+    from django.utils.module_loading import import_string
+    import_string(sink_path)().handle(events)
 
 @shared_task
-def notify_staff_of_queue_update(service_id, message):
+def dispatch_outbox():
     """
-    Sends a real-time queue update to all staff members of a specific service.
+    Delivers pending outbox events in batches.
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"service_{service_id}_staff",
-        {
-            "type": "send_staff_notification",
-            "message": message,
-        },
-    )
+    from . import outbox
+    return outbox.dispatch()
+
+@shared_task
+def purge_outbox():
+    """
+    Deletes outbox events that were dispatched past the retention window.
+    """
+    from . import outbox
+    return outbox.purge()
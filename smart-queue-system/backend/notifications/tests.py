@@ -0,0 +1,204 @@
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from analytics.models import ActivityLog
+from services.models import Service
+from smart_queue_app.models import create_waiting_entry
+from smart_queue_app.tests import LOCAL_BACKENDS
+from users.models import User
+from . import coalescing, outbox, queue_events
+from .models import OutboxEvent
+from .sinks import CounterStateStore
+
+
+@override_settings(**LOCAL_BACKENDS)
+class OutboxDispatchTests(TransactionTestCase):
+    # Foreign keys are only checked when a real transaction commits.
+
+    def setUp(self):
+        self.service = Service.objects.create(name='Library')
+        self.student = User.objects.create_user('student', password='pw')
+
+    def enqueue(self, user_ids):
+        entry = create_waiting_entry(self.service, self.student)
+        with mock.patch.object(outbox, 'schedule_dispatch'), transaction.atomic():
+            for n, user_id in enumerate(user_ids):
+                payload = queue_events.envelope('joined', entry)
+                payload['entry']['user']['id'] = user_id
+                outbox.enqueue('queue_event', payload, f"joined:{entry.id}:{n}")
+
+    def test_failing_event_does_not_block_the_batch(self):
+        self.enqueue([self.student.id, 0, self.student.id])
+
+        with self.assertLogs('notifications.outbox', 'ERROR'):
+            self.assertEqual(outbox.dispatch(), 2)
+        self.assertEqual(ActivityLog.objects.count(), 2)
+        failed = OutboxEvent.objects.get(dispatched_at__isnull=True)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('IntegrityError', failed.last_error)
+
+    @override_settings(NOTIFICATION_OUTBOX={**settings.NOTIFICATION_OUTBOX, 'MAX_ATTEMPTS': 2})
+    def test_event_is_parked_after_max_attempts(self):
+        self.enqueue([0])
+
+        with self.assertLogs('notifications.outbox', 'ERROR') as logs:
+            for _ in range(3):
+                outbox.dispatch()
+        self.assertEqual(OutboxEvent.objects.get().attempts, 2)
+        self.assertFalse(outbox.pending().exists())
+        self.assertIn('Parked outbox event', logs.output[-1])
+
+
+@override_settings(
+    **LOCAL_BACKENDS,
+    NOTIFICATION_COALESCING={'WINDOW_MS': 100, 'MAX_LATENCY_MS': 300},
+    NOTIFICATION_PUBLISH={**settings.NOTIFICATION_PUBLISH, 'public': 'celery'},
+)
+class CoalescingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        for target, attribute in ((coalescing.time, 'time'), (coalescing.publishing, 'group_send')):
+            patcher = mock.patch.object(target, attribute)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        coalescing.time.time.side_effect = lambda: self.now
+        patcher = mock.patch('notifications.tasks.flush_coalesced_update')
+        self.addCleanup(patcher.stop)
+        self.task = patcher.start()
+
+    def tearDown(self):
+        cache.clear()
+
+    def update(self, at, **fields):
+        self.now = at
+        coalescing.publish_public_update(1, **fields)
+
+    def test_burst_is_flushed_once_with_the_latest_state(self):
+        self.update(1000.0, queue_length=1)
+        self.update(1000.05, queue_length=2, now_serving=7)
+        self.update(1000.08, queue_length=3)
+        self.task.apply_async.assert_called_once_with(('public', 1), countdown=0.1)
+
+        group, event = coalescing.flush('public', 1)
+        self.assertEqual(group, 'public_service_updates')
+        self.assertEqual(event['message'], {'type': 'public_update', 'service_id': 1, 'now_serving': 7, 'queue_length': 3})
+        self.assertEqual(coalescing.stats()['public'], {'submitted': 3, 'emitted': 1, 'merged': 2})
+
+        # The flush closed the window, so the next update opens a new one.
+        self.update(1000.2, queue_length=2)
+        self.assertEqual(self.task.apply_async.call_count, 2)
+
+    def test_flush_waits_for_quiet_but_not_past_the_max_latency(self):
+        self.update(1000.0, queue_length=1)
+        self.update(1000.05, queue_length=2)
+        self.assertAlmostEqual(coalescing.remaining_delay('public', 1), 0.1)
+
+        self.update(1000.25, queue_length=3)
+        self.assertAlmostEqual(coalescing.remaining_delay('public', 1), 0.05)
+        self.now = 1000.3
+        self.assertLessEqual(coalescing.remaining_delay('public', 1), 0)
+
+        coalescing.flush('public', 1)
+        self.assertEqual(coalescing.remaining_delay('public', 1), 0)
+
+    @override_settings(NOTIFICATION_PUBLISH={**settings.NOTIFICATION_PUBLISH, 'public': 'direct'})
+    def test_direct_stream_sends_the_first_update_of_each_window(self):
+        self.update(1000.0, queue_length=1)
+        coalescing.publishing.group_send.assert_called_once()
+        self.task.apply_async.assert_not_called()
+
+        self.update(1000.05, queue_length=2)
+        self.assertEqual(coalescing.publishing.group_send.call_count, 1)
+        self.task.apply_async.assert_called_once_with(('public', 1), countdown=0.1)
+
+        self.update(1000.15, queue_length=3)
+        self.assertEqual(coalescing.publishing.group_send.call_count, 2)
+        self.assertEqual(coalescing.publishing.group_send.call_args.args[1]['message']['queue_length'], 3)
+
+    @override_settings(NOTIFICATION_COALESCING={'WINDOW_MS': 0, 'MAX_LATENCY_MS': 0})
+    def test_zero_window_sends_every_update(self):
+        self.update(1000.0, queue_length=1)
+        self.task.delay.assert_called_once_with('public', 1)
+        with override_settings(NOTIFICATION_PUBLISH={**settings.NOTIFICATION_PUBLISH, 'public': 'direct'}):
+            self.update(1000.0, queue_length=2)
+        coalescing.publishing.group_send.assert_called_once()
+
+    def test_staff_flush_without_deltas_sends_nothing(self):
+        self.assertIsNone(coalescing.flush('staff', 1))
+        self.assertEqual(coalescing.stats()['staff']['emitted'], 0)
+
+    def test_unknown_stream_is_rejected(self):
+        with self.assertRaises(ValueError):
+            coalescing.submit('private', 1)
+
+
+class PublishDirectTests(SimpleTestCase):
+    def setUp(self):
+        sink = mock.Mock(handle=mock.Mock(side_effect=OSError('channel layer down')), ahandle=mock.AsyncMock(side_effect=OSError))
+        patcher = mock.patch.object(queue_events, 'get_sinks', return_value=[('sinks.Broken', sink)])
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.events = [('joined:1', {'event': 'joined'})]
+
+    def test_failed_sink_is_handed_to_a_worker(self):
+        with mock.patch('notifications.tasks.deliver_queue_events') as task, self.assertLogs('notifications.queue_events'):
+            queue_events.publish_direct(self.events)
+        task.delay.assert_called_once_with(self.events, 'sinks.Broken')
+
+    def test_unreachable_broker_is_logged_not_raised(self):
+        with mock.patch('notifications.tasks.deliver_queue_events.delay', side_effect=OSError('broker down')):
+            with self.assertLogs('notifications.queue_events') as logs:
+                queue_events.publish_direct(self.events)
+            self.assertIn('Could not hand events', logs.output[-1])
+
+            with self.assertLogs('notifications.queue_events') as logs:
+                async_to_sync(queue_events.apublish_direct)(self.events)
+            self.assertIn('Could not hand events', logs.output[-1])
+
+
+class CallCountStore(CounterStateStore):
+    prefix = 'test_calls'
+    subject = 'queue_entry_id'
+
+    def observe(self, state, event, entry_id, at):
+        return (state or 0) + (event == 'called')
+
+
+@override_settings(**LOCAL_BACKENDS)
+class CounterStateStoreTests(SimpleTestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_concurrent_records_keep_every_counter(self):
+        store = CallCountStore()
+        # Loaded already, so recording needs no database.
+        cache.set(store.counters_key(1), [], timeout=None)
+        get = LocMemCache.get
+
+        def slow_get(*args, **kwargs):
+            # Widens the window between reading the state and writing it back.
+            value = get(*args, **kwargs)
+            time.sleep(0.02)
+            return value
+
+        threads = [
+            threading.Thread(target=store.record, args=(1, counter_id, 'called', counter_id, timezone.now()))
+            for counter_id in [1, 2, 3, 4, 5, None]
+        ]
+        with mock.patch.object(LocMemCache, 'get', slow_get):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(store.states(1), {counter_id: 1 for counter_id in range(1, 6)})
@@ -1,5 +1,6 @@
 from django.urls import path
+from .views import CoalescingStatsView
 
 urlpatterns = [
-    # API endpoints for notifications will be added here
+    path('coalescing-stats/', CoalescingStatsView.as_view(), name='coalescing-stats'),
 ]
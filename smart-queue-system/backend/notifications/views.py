@@ -0,0 +1,13 @@
+from rest_framework import views, response, status
+from rest_framework.permissions import IsAuthenticated
+from core.permissions import IsAdminUser
+from . import coalescing
+
+class CoalescingStatsView(views.APIView):
+    """
+    Reports how many queue broadcasts were merged by the coalescing stage.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return response.Response(coalescing.stats(), status=status.HTTP_200_OK)
@@ -3,8 +3,8 @@ from .models import Service, Counter
 
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'is_active')
-    list_filter = ('is_active',)
+    list_display = ('name', 'is_active', 'token_reset')
+    list_filter = ('is_active', 'token_reset')
     search_fields = ('name',)
 
 @admin.register(Counter)
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0002_service_staff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='token_reset',
+            field=models.CharField(choices=[('never', 'Never'), ('daily', 'Daily')], default='never', max_length=10),
+        ),
+    ]
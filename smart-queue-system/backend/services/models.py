@@ -2,6 +2,11 @@ from django.db import models
 from django.conf import settings
 
 class Service(models.Model):
+    TOKEN_RESET_CHOICES = (
+        ('never', 'Never'),
+        ('daily', 'Daily'),
+    )
+
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
@@ -11,6 +16,7 @@ class Service(models.Model):
         blank=True,
         limit_choices_to={'role__in': ['staff', 'admin']}
     )
+    token_reset = models.CharField(max_length=10, choices=TOKEN_RESET_CHOICES, default='never')
 
     def __str__(self):
         return self.name
@@ -17,4 +17,4 @@ class ServiceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Service
-        fields = ('id', 'name', 'description', 'is_active', 'counters', 'staff')
+        fields = ('id', 'name', 'description', 'is_active', 'token_reset', 'counters', 'staff')
@@ -8,7 +8,7 @@ class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Provides a read-only list of active services for all authenticated users.
     """
-    queryset = Service.objects.filter(is_active=True)
+    queryset = Service.objects.filter(is_active=True).prefetch_related('counters', 'staff')
     serializer_class = ServiceSerializer
 
 class CounterViewSet(viewsets.ModelViewSet):
@@ -25,7 +25,7 @@ class AdminServiceViewSet(viewsets.ModelViewSet):
     Allows admins to perform CRUD operations on all services.
     """
     permission_classes = [IsAdminUser]
-    queryset = Service.objects.all()
+    queryset = Service.objects.prefetch_related('counters', 'staff')
     serializer_class = ServiceSerializer
 
 class AdminCounterViewSet(viewsets.ModelViewSet):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import QueueEntry
+from .models import ArchivedQueueEntry, QueueEntry, TokenSequence
 
 @admin.register(QueueEntry)
 class QueueEntryAdmin(admin.ModelAdmin):
@@ -7,3 +7,14 @@ class QueueEntryAdmin(admin.ModelAdmin):
     list_filter = ('status', 'service', 'counter')
     search_fields = ('user__username', 'token_number')
     ordering = ('-created_at',)
+
+@admin.register(ArchivedQueueEntry)
+class ArchivedQueueEntryAdmin(admin.ModelAdmin):
+    list_display = ('token_number', 'service', 'user', 'status', 'counter', 'created_at', 'archived_at')
+    list_filter = ('status', 'service')
+    search_fields = ('user__username', 'token_number')
+    ordering = ('-created_at',)
+
+@admin.register(TokenSequence)
+class TokenSequenceAdmin(admin.ModelAdmin):
+    list_display = ('service', 'last_value', 'day')
@@ -0,0 +1,62 @@
+"""
+Archival of finished queue entries.
+
+Completed, skipped and rejected entries are only read again as a user's
+history, but left in ``QueueEntry`` they grow the table and the indexes that
+every join, call and status poll goes through. ``archive`` moves the ones
+created more than ``AFTER_DAYS`` ago into ``ArchivedQueueEntry``, one short
+transaction per batch; celery beat runs it through ``archive_queue_entries``.
+``history`` reads both tables back as a single list.
+"""
+import heapq
+from datetime import timedelta
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedQueueEntry, FINISHED_STATUSES, QueueEntry
+
+ARCHIVED_FIELDS = (
+    'id', 'user_id', 'service_id', 'counter_id', 'token_number', 'token_day', 'status', 'created_at', 'updated_at'
+)
+
+
+def archive(before=None, queryset=None):
+    """
+    Moves finished entries created before ``before`` to the archive and returns how many were moved.
+
+    ``queryset`` narrows the entries considered, all of them by default. At
+    most ``MAX_BATCHES`` batches are moved per call; the next run picks up
+    the rest.
+    """
+    config = settings.QUEUE_ARCHIVE
+    if before is None:
+        before = timezone.now() - timedelta(days=config['AFTER_DAYS'])
+    if queryset is None:
+        queryset = QueueEntry.objects.all()
+
+    # Ids grow with created_at, so the oldest finished entries are found at the start of the primary key.
+    finished = queryset.filter(status__in=FINISHED_STATUSES, created_at__lt=before).order_by('id')
+
+    moved = 0
+    for _ in range(config['MAX_BATCHES']):
+        with transaction.atomic():
+            rows = list(finished.select_for_update(skip_locked=True).values(*ARCHIVED_FIELDS)[:config['BATCH_SIZE']])
+            if not rows:
+                break
+            # Conflicts are rows archived by an earlier run that failed before deleting them.
+            ArchivedQueueEntry.objects.bulk_create([ArchivedQueueEntry(**row) for row in rows], ignore_conflicts=True)
+            QueueEntry.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        moved += len(rows)
+        if len(rows) < config['BATCH_SIZE']:
+            break
+    return moved
+
+
+def history(*entry_lists):
+    """
+    Merges lists of entries, each newest first, into one list newest first.
+    """
+    return list(heapq.merge(*entry_lists, key=attrgetter('created_at'), reverse=True))
@@ -0,0 +1,187 @@
+"""
+Async variants of the hot queue endpoints: join, call_next, status and my-queues.
+
+They serve the same URLs and responses as the DRF views when
+``QUEUE_ASYNC_VIEWS`` is on, but run on the event loop instead of the single
+thread that ASGI uses for sync views, so a process keeps many requests in
+flight during join bursts. That thread also runs ``sync_to_async`` calls with
+the default ``thread_sensitive=True``, the async ORM included, so the
+database work of each request runs as one sync block in a worker thread of
+its own instead (see ``_in_worker``). Joining and calling change several rows
+in one transaction, which lives entirely in that block; the direct
+notifications are awaited on the channel layer once it has committed.
+"""
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import ArchivedQueueEntry, QueueEntry, Service, create_waiting_entry
+from .serializers import QueueEntrySerializer, CreateQueueEntrySerializer, prepare_entries, serialize_entries
+from . import archive, dispatch, eta, queue_index, status_cache
+from notifications import queue_events
+from core.permissions import IsStaffOrAdmin
+
+
+def _error(detail, status_code):
+    return JsonResponse({'detail': detail}, status=status_code)
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+def _in_worker(func):
+    """
+    Returns an async callable running ``func`` in a thread pool rather than the shared sync thread.
+
+    Database connections are closed or kept around afterwards as they are at
+    the end of a sync request, since no request signal reaches these threads.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def async_api_view(methods, permission_class=IsAuthenticated):
+    """
+    Authenticates and authorizes like the DRF views do before calling an async view.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @transaction.non_atomic_requests
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return _error(f'Method "{request.method}" not allowed.', status.HTTP_405_METHOD_NOT_ALLOWED)
+
+            authenticator = JWTAuthentication()
+            try:
+                result = await _in_worker(authenticator.authenticate)(request)
+            except AuthenticationFailed as exc:
+                detail = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+                response = JsonResponse(detail, status=status.HTTP_401_UNAUTHORIZED)
+                response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+                return response
+            request.user = result[0] if result is not None else AnonymousUser()
+
+            if not permission_class().has_permission(request, None):
+                if not request.user.is_authenticated:
+                    response = _error('Authentication credentials were not provided.', status.HTTP_401_UNAUTHORIZED)
+                    response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+                    return response
+                return _error('You do not have permission to perform this action.', status.HTTP_403_FORBIDDEN)
+
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _join(service, user):
+    with transaction.atomic():
+        # Allocate the next token from the service's sequence
+        entry = create_waiting_entry(service, user)
+        if entry is None:
+            return None, []
+        queue_index.add_on_commit(entry)
+        return entry, [queue_events.emit('joined', entry, publish_on_commit=False)]
+
+
+def _authorized_service(pk, user):
+    service = Service.objects.filter(pk=pk).first()
+    # Check if the user is authorized to manage this service
+    authorized = service is not None and (user.role == 'admin' or service.staff.filter(pk=user.pk).exists())
+    return service, authorized
+
+
+def _call_next(service_id, counter_id):
+    with transaction.atomic():
+        entry = dispatch.claim_next(service_id, counter_id)
+        if entry is None:
+            return None, [], None
+        event = queue_events.emit('called', entry, previous_status='waiting', publish_on_commit=False)
+        return entry, [event], QueueEntrySerializer(entry).data
+
+
+@async_api_view(['POST'])
+async def join_queue(request):
+    data = _request_data(request)
+    if data is None:
+        return _error('JSON parse error.', status.HTTP_400_BAD_REQUEST)
+
+    serializer = CreateQueueEntrySerializer(data=data)
+    if not await _in_worker(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    entry, events = await _in_worker(_join)(serializer.validated_data['service'], request.user)
+    if entry is None:
+        # The partial unique constraint allows one active entry per user and service.
+        return JsonResponse(["You are already in the queue for this service."], status=status.HTTP_400_BAD_REQUEST, safe=False)
+
+    await queue_events.apublish_direct(events)
+    return JsonResponse({'service': entry.service_id}, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(['POST'], permission_class=IsStaffOrAdmin)
+async def call_next(request, pk):
+    service, authorized = await _in_worker(_authorized_service)(pk, request.user)
+    if service is None:
+        return _error('Not found.', status.HTTP_404_NOT_FOUND)
+    if not authorized:
+        return _error('You are not authorized to manage this service.', status.HTTP_403_FORBIDDEN)
+
+    data = _request_data(request)
+    if data is None:
+        return _error('JSON parse error.', status.HTTP_400_BAD_REQUEST)
+    if not isinstance(data, dict):
+        return _error('Expected a JSON object.', status.HTTP_400_BAD_REQUEST)
+
+    try:
+        entry, events, payload = await _in_worker(_call_next)(service.id, data.get('counter_id'))
+    except ValidationError as error:
+        return JsonResponse({'counter_id': error.messages}, status=status.HTTP_400_BAD_REQUEST)
+    if entry is None:
+        return _error('No users in the queue.', status.HTTP_404_NOT_FOUND)
+
+    await queue_events.apublish_direct(events)
+    return JsonResponse(payload, status=status.HTTP_200_OK)
+
+
+def _serialized_entries(request, *querysets):
+    # Each queryset is ordered newest first; their entries are merged into one list.
+    entries = archive.history(*(list(prepare_entries(queryset, request)) for queryset in querysets))
+    return serialize_entries(entries, request)
+
+
+@async_api_view(['GET'])
+async def my_queues(request):
+    data = await _in_worker(_serialized_entries)(
+        request,
+        eta.with_positions(QueueEntry.objects.filter(user=request.user).order_by('-created_at')),
+        ArchivedQueueEntry.objects.filter(user=request.user).order_by('-created_at')
+    )
+    return JsonResponse(data, safe=False)
+
+
+@async_api_view(['GET'], permission_class=AllowAny)
+async def service_queue_status(request, service_id):
+    # Served from a snapshot that queue mutations invalidate, with ETag support
+    return await _in_worker(status_cache.status_response)(service_id, request)
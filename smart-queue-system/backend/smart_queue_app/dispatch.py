@@ -0,0 +1,76 @@
+"""
+Strategies used by ``call_next`` to claim the next waiting entry of a service.
+
+``index``
+    Finds the head in the queue index and claims it with ``SKIP LOCKED``
+    (see ``queue_index``).
+``skip_locked``
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` on the oldest waiting rows, so that
+    concurrent counters of one service each claim a different entry instead
+    of queueing behind the same row lock. Falls back to ``locking`` on
+    databases without ``SKIP LOCKED`` support.
+``locking``
+    Plain ``SELECT ... FOR UPDATE`` on the head row.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from . import queue_index
+from .models import QueueEntry
+
+DISPATCH_MODES = ('index', 'skip_locked', 'locking')
+
+
+def claim_next(service_id, counter_id=None, mode=None):
+    """
+    Marks the next waiting entry of a service as in progress and returns it.
+
+    Returns None if nobody is waiting. Raises ``ValidationError`` if
+    ``counter_id`` is not a counter of the service.
+    """
+    mode = mode or settings.QUEUE_DISPATCH_MODE
+    if mode not in DISPATCH_MODES:
+        raise ValueError(f"Unknown queue dispatch mode: {mode}")
+    counter_id = clean_counter_id(service_id, counter_id)
+
+    if mode == 'index':
+        return queue_index.claim_next(service_id, counter_id)
+
+    skip_locked = mode == 'skip_locked' and connection.features.has_select_for_update_skip_locked
+    entry = _claim_with_row_lock(service_id, counter_id, skip_locked)
+    if entry:
+        queue_index.remove_on_commit(entry)
+    return entry
+
+
+def clean_counter_id(service_id, counter_id):
+    """
+    Returns ``counter_id`` as an id of a counter of the service, or None if it is empty.
+    """
+    from services.models import Counter
+
+    if counter_id in (None, ''):
+        return None
+    # Request data may carry the id as a string.
+    counter_id = QueueEntry._meta.get_field('counter').to_python(counter_id)
+    if not Counter.objects.filter(pk=counter_id, service_id=service_id).exists():
+        raise ValidationError("Counter %(counter)s does not belong to this service.", params={'counter': counter_id})
+    return counter_id
+
+
+def _claim_with_row_lock(service_id, counter_id, skip_locked):
+    with transaction.atomic():
+        entry = QueueEntry.objects.select_for_update(skip_locked=skip_locked).filter(
+            service_id=service_id,
+            status='waiting'
+        ).order_by('created_at', 'id').first()
+
+        if not entry:
+            return None
+
+        entry.status = 'in_progress'
+        if counter_id:
+            entry.counter_id = counter_id
+        entry.save(update_fields=['status', 'counter', 'updated_at'])
+        return entry
@@ -0,0 +1,166 @@
+"""
+Online estimate of how long waiting entries have left.
+
+Every counter keeps an exponentially weighted moving average (EWMA) of its
+service time, updated in O(1) per queue event by ``EtaSink``: calling an
+entry starts the clock at its counter, and completing that entry, or calling
+the next one, stops it. Counters active within ``ACTIVE_MINUTES`` serve in
+parallel, so a service gets through ``sum(1 / ewma)`` entries per second and
+the entry at position ``p`` is expected to be called in ``p`` over that rate.
+Calls without a counter count as one more counter.
+
+The states of the counters are kept by ``store``, a ``CounterStateStore``.
+A service without state (cold cache, restart) is replayed once from the last
+``RELOAD_HOURS`` of ``ActivityLog`` instead of being recomputed per request.
+Requests never replay it themselves: they schedule the replay on a worker
+and estimate at the default pace meanwhile.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+
+from notifications.sinks import COUNTER_EVENTS, CounterStateStore, QueueEventSink
+from .models import QueueEntry
+
+logger = logging.getLogger(__name__)
+
+
+def _reload_key(service_id):
+    return f"queue:{service_id}:eta:reload_scheduled"
+
+
+class EtaStore(CounterStateStore):
+    prefix = 'eta'
+    subject = 'user_id'
+
+    def observe(self, state, event, user_id, at):
+        config = settings.QUEUE_ETA
+        timestamp = at.timestamp()
+        state = dict(state or {})
+        current = state.get('started') is not None
+        if event != 'called' and not (current and state.get('user') == user_id):
+            # Not about the entry this counter is serving.
+            return state
+
+        if current and event in ('called', 'completed'):
+            sample = timestamp - state['started']
+            if 0 < sample <= config['MAX_SERVICE_MINUTES'] * 60:
+                ewma = state.get('ewma')
+                state['ewma'] = sample if ewma is None else config['ALPHA'] * sample + (1 - config['ALPHA']) * ewma
+
+        if event == 'called':
+            state.update(started=timestamp, user=user_id)
+        else:
+            state.update(started=None, user=None)
+        state['seen'] = timestamp
+        return state
+
+    def replay_since(self, until):
+        return until - timedelta(hours=settings.QUEUE_ETA['RELOAD_HOURS'])
+
+    def counter_of(self, counter_id):
+        # Counter ids start at 1.
+        return counter_id or 0
+
+
+store = EtaStore()
+
+
+def schedule_reload(service_id):
+    """
+    Has a worker rebuild the state of a service, unless that is already scheduled.
+    """
+    from .tasks import reload_eta
+
+    if not cache.add(_reload_key(service_id), 1, timeout=settings.QUEUE_ETA['RELOAD_SCHEDULE_TIMEOUT']):
+        return
+    try:
+        reload_eta.delay(service_id)
+    except Exception:
+        # An estimate at the default pace is still an estimate; retried by a later request.
+        logger.exception("Could not schedule the ETA reload of service %s.", service_id)
+        cache.delete(_reload_key(service_id))
+
+
+def service_rate(service_id):
+    """
+    Entries per second the active counters of a service are expected to get through.
+    """
+    config = settings.QUEUE_ETA
+    states = store.states(service_id)
+    if states is None:
+        schedule_reload(service_id)
+        states = {}
+
+    active_since = time.time() - config['ACTIVE_MINUTES'] * 60
+    rate = sum(
+        1 / (state.get('ewma') or config['DEFAULT_SERVICE_SECONDS'])
+        for state in states.values() if state and state.get('seen', 0) >= active_since
+    )
+    # Nobody has called recently; assume a single counter at the default pace.
+    return rate or 1 / config['DEFAULT_SERVICE_SECONDS']
+
+
+def with_positions(queryset):
+    """
+    Annotates entries with ``waiting_ahead``, the number of entries waiting before them.
+    """
+    ahead = QueueEntry.objects.filter(
+        service=OuterRef('service'),
+        status='waiting',
+        created_at__lt=OuterRef('created_at')
+    ).order_by().values('service').annotate(total=Count('id')).values('total')
+    return queryset.annotate(waiting_ahead=Coalesce(Subquery(ahead), 0))
+
+
+def estimate(entries):
+    """
+    Returns ``{entry_id: {'position', 'eta_seconds'}}`` for the waiting entries.
+
+    Positions come from ``with_positions`` if the entries were annotated,
+    otherwise ``entries`` must hold the whole waiting queue of their
+    services in order.
+    """
+    positions = {}
+    counted = defaultdict(int)
+    for entry in entries:
+        if entry.status != 'waiting':
+            continue
+        if hasattr(entry, 'waiting_ahead'):
+            position = entry.waiting_ahead + 1
+        else:
+            counted[entry.service_id] += 1
+            position = counted[entry.service_id]
+        positions[entry.id] = (entry.service_id, position)
+
+    rates = {service_id: service_rate(service_id) for service_id, position in positions.values()}
+    return {
+        entry_id: {'position': position, 'eta_seconds': round(position / rates[service_id])}
+        for entry_id, (service_id, position) in positions.items()
+    }
+
+
+class EtaSink(QueueEventSink):
+    """
+    Feeds calls and completions into the per-counter service time estimates.
+    """
+
+    message_class = 'eta'
+
+    def handle(self, events):
+        for event_id, event in events:
+            if event['event'] in COUNTER_EVENTS:
+                store.record(
+                    event['service']['id'],
+                    event['entry']['counter'],
+                    event['event'],
+                    event['entry']['user']['id'],
+                    parse_datetime(event['at'])
+                )
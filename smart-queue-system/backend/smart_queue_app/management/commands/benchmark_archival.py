@@ -0,0 +1,107 @@
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from services.models import Service
+from users.models import User
+from smart_queue_app import archive
+from smart_queue_app.models import ACTIVE_STATUSES, ArchivedQueueEntry, QueueEntry
+
+
+class Command(BaseCommand):
+    help = 'Measures hot-path queue queries against a table full of finished entries, before and after archival.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--finished', type=int, default=200000, help='Finished entries from past days.')
+        parser.add_argument('--waiting', type=int, default=200, help='Entries waiting in the queue.')
+        parser.add_argument('--repeat', type=int, default=200, help='Runs of each query per measurement.')
+
+    def handle(self, *args, **options):
+        prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+        service = Service.objects.create(name=prefix)
+        User.objects.bulk_create([User(username=f"{prefix}-{i}") for i in range(options['waiting'])])
+        users = list(User.objects.filter(username__startswith=prefix))
+
+        try:
+            self.fill(service, users, options['finished'])
+            queries = self.queries(service, users, options['finished'])
+
+            before = self.measure(queries, options['repeat'])
+            started = time.perf_counter()
+            moved = 0
+            while True:
+                # Each run is capped at MAX_BATCHES; the beat schedule would pick up the rest later.
+                batch = archive.archive(before=timezone.now() - timedelta(days=1), queryset=QueueEntry.objects.filter(service=service))
+                if not batch:
+                    break
+                moved += batch
+            elapsed = time.perf_counter() - started
+            after = self.measure(queries, options['repeat'])
+
+            self.stdout.write(f"Archived {moved} entries in {elapsed:.2f}s ({moved / elapsed:.0f} rows/sec).")
+            self.stdout.write(f"{'query':<14} {'before p50 ms':>14} {'after p50 ms':>13} {'speedup':>8}")
+            for name in queries:
+                self.stdout.write(
+                    f"{name:<14} {before[name]:>14.3f} {after[name]:>13.3f} {before[name] / after[name]:>7.1f}x"
+                )
+        finally:
+            QueueEntry.objects.filter(service=service).delete()
+            ArchivedQueueEntry.objects.filter(service=service).delete()
+            service.delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def fill(self, service, users, finished):
+        statuses = ('completed', 'completed', 'completed', 'skipped', 'rejected')
+        QueueEntry.objects.bulk_create([
+            QueueEntry(user=users[i % len(users)], service=service, token_number=i + 1, status=statuses[i % len(statuses)])
+            for i in range(finished)
+        ], batch_size=5000)
+        QueueEntry.objects.filter(service=service).update(created_at=F('created_at') - timedelta(days=60))
+        QueueEntry.objects.bulk_create([
+            QueueEntry(user=user, service=service, token_number=finished + i + 1)
+            for i, user in enumerate(users)
+        ])
+
+    def queries(self, service, users, finished):
+        """
+        The hot-path queries: status list, dispatch, token lookups and a user's history.
+        """
+        today = timezone.localdate()
+
+        def history():
+            user = random.choice(users)
+            return archive.history(
+                list(QueueEntry.objects.filter(user=user).order_by('-created_at')),
+                list(ArchivedQueueEntry.objects.filter(user=user).order_by('-created_at'))
+            )
+
+        return {
+            'status': lambda: list(
+                QueueEntry.objects.filter(service=service, status__in=ACTIVE_STATUSES).order_by('created_at')
+            ),
+            'next waiting': lambda: QueueEntry.objects.filter(service=service, status='waiting').order_by('created_at').first(),
+            'waiting count': lambda: QueueEntry.objects.filter(service=service, status='waiting').count(),
+            'token lookup': lambda: QueueEntry.objects.filter(
+                service=service, token_number=finished + random.randint(1, len(users)), token_day=today
+            ).first(),
+            'my queues': history,
+        }
+
+    def measure(self, queries, repeat):
+        with connection.cursor() as cursor:
+            # Fresh planner statistics for the table as it is now.
+            cursor.execute('ANALYZE')
+        results = {}
+        for name, query in queries.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                query()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings)
+        return results
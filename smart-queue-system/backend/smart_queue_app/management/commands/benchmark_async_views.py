@@ -0,0 +1,105 @@
+import asyncio
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from django.urls import path, include
+from rest_framework_simplejwt.tokens import AccessToken
+from services.models import Service, Counter
+from users.models import User
+from smart_queue_app.urls import queue_urlpatterns
+
+VARIANTS = ('sync', 'async')
+
+
+class QueueURLConf:
+    """
+    URLconf serving only the queue endpoints, with either variant of the hot views.
+    """
+
+    def __init__(self, use_async):
+        self.urlpatterns = [path('api/queue/', include(queue_urlpatterns(use_async)))]
+
+
+class Command(BaseCommand):
+    help = 'Compares requests/sec and latency of the sync and async queue endpoints under concurrent load.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users joining the queue, and requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once.')
+        parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+
+    def handle(self, *args, **options):
+        prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+        staff = User.objects.create(username=f"{prefix}-staff", role='staff')
+        User.objects.bulk_create([User(username=f"{prefix}-{i}") for i in range(options['users'])])
+        users = list(User.objects.filter(username__startswith=f"{prefix}-").exclude(pk=staff.pk))
+        tokens = {user.pk: str(AccessToken.for_user(user)) for user in users + [staff]}
+
+        services = []
+        try:
+            self.stdout.write(
+                f"{'variant':<8} {'endpoint':<10} {'requests':>8} {'errors':>7} {'req/sec':>9} {'p50 ms':>8} {'p99 ms':>8}"
+            )
+            for variant in options['variants']:
+                service = Service.objects.create(name=f"{prefix}-{variant}")
+                service.staff.add(staff)
+                counter = Counter.objects.create(name='Counter 1', service=service)
+                services.append(service)
+
+                with override_settings(ROOT_URLCONF=QueueURLConf(variant == 'async')):
+                    results = asyncio.run(self.run_load(service, counter, staff, users, tokens, options['concurrency']))
+                for endpoint, (latencies, errors, elapsed) in results.items():
+                    self.report(variant, endpoint, latencies, errors, elapsed)
+        finally:
+            for service in services:
+                service.delete()
+            User.objects.filter(username__startswith=f"{prefix}-").delete()
+
+    async def run_load(self, service, counter, staff, users, tokens, concurrency):
+        """
+        Runs the endpoints one after another, each with ``concurrency`` requests in flight.
+        """
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(method, url, user, data=None):
+            headers = {'Authorization': f"Bearer {tokens[user.pk]}"}
+            async with semaphore:
+                started = time.perf_counter()
+                if method == 'post':
+                    response = await client.post(url, data or {}, content_type='application/json', headers=headers)
+                else:
+                    response = await client.get(url, headers=headers)
+                return (time.perf_counter() - started) * 1000, response.status_code < 400
+
+        phases = {
+            'join': [('post', '/api/queue/join/', user, {'service': service.id}) for user in users],
+            'status': [('get', f"/api/queue/status/{service.id}/", user) for user in users],
+            'my-queues': [('get', '/api/queue/my-queues/', user) for user in users],
+            'call_next': [
+                ('post', f"/api/queue/manage/{service.id}/call_next/", staff, {'counter_id': counter.id})
+                for _ in users
+            ],
+        }
+
+        results = {}
+        for endpoint, requests in phases.items():
+            started = time.perf_counter()
+            outcomes = await asyncio.gather(*(timed(*request) for request in requests))
+            elapsed = time.perf_counter() - started
+            results[endpoint] = (
+                [latency for latency, ok in outcomes],
+                sum(1 for latency, ok in outcomes if not ok),
+                elapsed,
+            )
+        return results
+
+    def report(self, variant, endpoint, latencies, errors, elapsed):
+        p99 = statistics.quantiles(latencies, n=100, method='inclusive')[98] if len(latencies) > 1 else latencies[0]
+        self.stdout.write(
+            f"{variant:<8} {endpoint:<10} {len(latencies):>8} {errors:>7} {len(latencies) / elapsed:>9.1f} "
+            f"{statistics.median(latencies):>8.2f} {p99:>8.2f}"
+        )
@@ -0,0 +1,99 @@
+import threading
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from services.models import Service, Counter
+from users.models import User
+from smart_queue_app import dispatch, queue_index
+from smart_queue_app.models import QueueEntry
+
+class Command(BaseCommand):
+    help = 'Benchmarks call_next dispatch modes with concurrent simulated counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counters', type=int, default=4, help='Number of counters calling concurrently.')
+        parser.add_argument('--entries', type=int, default=1000, help='Number of waiting entries to drain per mode.')
+        parser.add_argument(
+            '--hold-ms', type=float, default=2.0,
+            help='How long each call keeps its transaction open, standing in for the rest of the request.'
+        )
+        parser.add_argument('--modes', nargs='+', choices=dispatch.DISPATCH_MODES, default=list(dispatch.DISPATCH_MODES))
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and options['counters'] > 1:
+            # SQLite has no row locks and fails concurrent read-then-write transactions outright.
+            self.stdout.write(self.style.WARNING(
+                "SQLite serializes all writers; running a single counter. Use PostgreSQL to compare modes under contention."
+            ))
+            options['counters'] = 1
+
+        prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+        service = Service.objects.create(name=prefix)
+        counters = [Counter.objects.create(name=f"Counter {i + 1}", service=service) for i in range(options['counters'])]
+        User.objects.bulk_create([User(username=f"{prefix}-{i}") for i in range(options['entries'])])
+        users = list(User.objects.filter(username__startswith=prefix))
+
+        try:
+            self.stdout.write(f"{'mode':<12} {'calls':>7} {'misses':>7} {'seconds':>8} {'calls/sec':>10}")
+            for mode in options['modes']:
+                self.fill_queue(service, users)
+                calls, misses, elapsed = self.run_counters(service, counters, mode, options['hold_ms'] / 1000)
+
+                claimed = QueueEntry.objects.filter(service=service, status='in_progress').count()
+                if claimed != calls:
+                    self.stdout.write(self.style.ERROR(f"{mode}: {calls} calls but {claimed} entries claimed"))
+
+                self.stdout.write(f"{mode:<12} {calls:>7} {misses:>7} {elapsed:>8.2f} {calls / elapsed:>10.1f}")
+        finally:
+            service.delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def fill_queue(self, service, users):
+        QueueEntry.objects.filter(service=service).delete()
+        QueueEntry.objects.bulk_create([
+            QueueEntry(user=user, service=service, token_number=i + 1)
+            for i, user in enumerate(users)
+        ])
+        queue_index.load_service(service.id)
+
+    def run_counters(self, service, counters, mode, hold):
+        """
+        Lets every counter call the next user until the queue is drained.
+
+        A miss is a call that found nobody although entries were still
+        waiting, which happens when a locked head row is re-checked after the
+        lock holder commits.
+        """
+        lock = threading.Lock()
+        totals = {'calls': 0, 'misses': 0}
+        barrier = threading.Barrier(len(counters))
+
+        def work(counter):
+            calls = misses = 0
+            barrier.wait()
+            try:
+                while True:
+                    with transaction.atomic():
+                        entry = dispatch.claim_next(service.id, counter.id, mode=mode)
+                        if entry:
+                            time.sleep(hold)
+                    if entry:
+                        calls += 1
+                    elif QueueEntry.objects.filter(service=service, status='waiting').exists():
+                        misses += 1
+                    else:
+                        break
+            finally:
+                connections.close_all()
+                with lock:
+                    totals['calls'] += calls
+                    totals['misses'] += misses
+
+        threads = [threading.Thread(target=work, args=(counter,)) for counter in counters]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return totals['calls'], totals['misses'], time.perf_counter() - started
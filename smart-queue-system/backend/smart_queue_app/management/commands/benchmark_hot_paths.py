@@ -0,0 +1,340 @@
+import asyncio
+import gc
+import json
+import platform
+import random
+import statistics
+import time
+from collections import Counter as Tally, defaultdict
+from datetime import timedelta
+
+import django
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from analytics import distributions, rollups
+from analytics.models import ACTION_CODES
+from analytics.sketches import Sketch
+from notifications.consumers import NotificationConsumer
+from notifications.sinks import UserNotificationSink
+from services.models import Counter, Service
+from smart_queue_app import staff_updates
+from smart_queue_app.models import QueueEntry
+from smart_queue_app.serializers import CompactQueueEntrySerializer, QueueEntrySerializer
+from users.models import User
+
+STATS = ('min', 'median', 'mean', 'max', 'stddev')
+
+
+def prefetched(model, objects):
+    """
+    A queryset that is already evaluated, as ``prefetch_related`` leaves it in ``_prefetched_objects_cache``.
+    """
+    queryset = QuerySet(model)
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    return queryset
+
+
+def make_entries(size, rng):
+    """
+    Unsaved queue entries with their user, service and counter loaded, as ``prepare_entries`` returns them.
+    """
+    staff = [User(id=i + 1, username=f"staff{i}", role='staff') for i in range(3)]
+    services = []
+    for service_id in range(1, 4):
+        service = Service(id=service_id, name=f"Service {service_id}", description='Benchmark service')
+        counters = [Counter(id=service_id * 10 + i, name=f"Counter {i + 1}", service=service) for i in range(3)]
+        service._prefetched_objects_cache = {'counters': prefetched(Counter, counters), 'staff': prefetched(User, staff)}
+        services.append((service, counters))
+
+    now = timezone.now()
+    entries = []
+    for i in range(size):
+        service, counters = rng.choice(services)
+        status = rng.choice(('waiting', 'waiting', 'waiting', 'in_progress'))
+        entries.append(QueueEntry(
+            id=i + 1,
+            user=User(id=1000 + i, username=f"student{i}", email=f"student{i}@example.com", role='student'),
+            service=service,
+            counter=rng.choice(counters) if status == 'in_progress' else None,
+            token_number=i + 1,
+            status=status,
+            created_at=now - timedelta(seconds=size - i),
+        ))
+    return entries
+
+
+def make_activity(size, rng):
+    """
+    ``size`` activities as ``(service_id, counter_id, action, at, wait, service_time)``, in time order.
+    """
+    now = timezone.now()
+    actions = list(rollups.ACTION_FIELDS)
+    activity = []
+    for i in range(size):
+        action = rng.choice(actions)
+        activity.append((
+            rng.randint(1, 3),
+            rng.randint(1, 9) if action != 'user_join' else None,
+            action,
+            now - timedelta(seconds=(size - i) * 3),
+            rng.expovariate(1 / 600) if action == 'user_called' else None,
+            rng.expovariate(1 / 300) if action == 'service_completed' else None,
+        ))
+    return activity
+
+
+def make_columns(size, rng):
+    """
+    ``size`` activities as the array ``distributions.load_columns`` returns: each user joins, is called and is served.
+    """
+    codes = (ACTION_CODES['user_join'], ACTION_CODES['user_called'], ACTION_CODES['service_completed'])
+    rows, at = [], 1.7e9
+    for i in range(size):
+        user = i // 3
+        at += rng.expovariate(1 / 20)
+        rows.append((i + 1, user, user % 3 + 1, 0 if i % 3 == 0 else user % 9 + 1, codes[i % 3], at))
+    return np.array(rows, dtype=np.float64).reshape(-1, 6)
+
+
+def bench_serializer_nested(size, rng):
+    entries = make_entries(size, rng)
+    context = {'eta': {entry.id: {'position': entry.id, 'eta_seconds': entry.id * 60.0} for entry in entries}}
+    return lambda: QueueEntrySerializer(entries, many=True, context=context).data
+
+
+def bench_serializer_compact(size, rng):
+    entries = make_entries(size, rng)
+    return lambda: CompactQueueEntrySerializer(entries, many=True, context={'eta': {}}).data
+
+
+def bench_analytics_rollups(size, rng):
+    # What RollupSink does with a batch before writing it: add every activity to its buckets and sketches.
+    activity = make_activity(size, rng)
+
+    def run():
+        deltas = defaultdict(Tally)
+        for service_id, counter_id, action, at, wait, service_time in activity:
+            rollups.add(deltas, service_id, counter_id, action, at, wait, service_time)
+        return deltas
+    return run
+
+
+def bench_analytics_rollup_sketches(size, rng):
+    # What rollups.rebuild does with the paired durations of a range: one sketch per bucket, serialized for storage.
+    columns = make_columns(size, rng)
+    waits, served = distributions.pairs(columns, columns[0, 5])
+
+    def run():
+        return [
+            sketch.to_bytes()
+            for durations in (waits, served) for granularity in rollups.SKETCH_GRANULARITIES
+            for _, _, _, sketch in rollups._bucket_sketches(durations, granularity)
+        ]
+    return run
+
+
+def bench_analytics_distributions(size, rng):
+    columns = make_columns(size, rng)
+
+    def run():
+        waits, served = distributions.pairs(columns, columns[0, 5])
+        return distributions.summary(waits['seconds']), distributions.summary(served['seconds'])
+    return run
+
+
+def bench_analytics_sketches(size, rng):
+    seconds = [rng.expovariate(1 / 600) for _ in range(size)]
+
+    def run():
+        sketch = Sketch()
+        for value in seconds:
+            sketch.add(value)
+        sketch = Sketch.from_bytes(sketch.to_bytes())
+        return [sketch.quantile(q) for q in (0.5, 0.9, 0.99)]
+    return run
+
+
+def consumer_collecting(sent):
+    consumer = NotificationConsumer()
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        sent.append(text_data)
+    consumer.send = send
+    return consumer
+
+
+def bench_notifications_user(size, rng):
+    # Messages built by the user sink and encoded by the consumer, one per event.
+    sink = UserNotificationSink()
+    events = [{
+        'event': rng.choice(('called', 'completed', 'skipped')),
+        'service': {'id': 1, 'name': 'Service 1'},
+        'entry': {'id': i + 1, 'token_number': i + 1, 'user': {'id': 1000 + i}},
+        'counter_name': 'Counter 1',
+    } for i in range(size)]
+    sent = []
+    consumer = consumer_collecting(sent)
+    loop = asyncio.new_event_loop()
+
+    async def deliver():
+        for i, event in enumerate(events):
+            message = sink.build_message(event)
+            message['event_id'] = f"queue_event:{i}"
+            await consumer.send_notification({'type': 'send_notification', 'message': message})
+
+    def run():
+        sent.clear()
+        loop.run_until_complete(deliver())
+    return run
+
+
+def bench_notifications_staff(size, rng):
+    # One queue_deltas message with a delta per entry, encoded by the consumer.
+    entries = make_entries(size, rng)
+    sent = []
+    consumer = consumer_collecting(sent)
+    loop = asyncio.new_event_loop()
+
+    def run():
+        sent.clear()
+        message = {
+            'type': 'queue_deltas', 'service_id': 1, 'from_seq': 1, 'seq': size,
+            'deltas': [{'op': 'added', 'entry': staff_updates.entry_data(entry)} for entry in entries],
+        }
+        loop.run_until_complete(consumer.send_staff_notification({'type': 'send_staff_notification', 'message': message}))
+    return run
+
+
+BENCHMARKS = {
+    'serializer.nested': bench_serializer_nested,
+    'serializer.compact': bench_serializer_compact,
+    'analytics.rollups': bench_analytics_rollups,
+    'analytics.rollup_sketches': bench_analytics_rollup_sketches,
+    'analytics.distributions': bench_analytics_distributions,
+    'analytics.sketches': bench_analytics_sketches,
+    'notifications.user': bench_notifications_user,
+    'notifications.staff': bench_notifications_staff,
+}
+
+
+def measure(run, min_rounds, max_time):
+    """
+    Times ``run()`` for at least ``min_rounds`` rounds and until ``max_time`` seconds have passed.
+    """
+    # Warm up caches (DRF builds its fields on first use) and start without garbage from the setup.
+    run()
+    gc.collect()
+    timings = []
+    deadline = time.perf_counter() + max_time
+    while len(timings) < min_rounds or time.perf_counter() < deadline:
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return {
+        'rounds': len(timings),
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'max': max(timings),
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the hot pure-Python paths (entry serializers, analytics math and notification payloads) at several '
+        'sizes, saves the results as a baseline, and fails when a path got slower than its baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS), metavar='NAME',
+            help=f"Benchmarks to run, all by default: {', '.join(BENCHMARKS)}."
+        )
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10, 1000, 100000], help='Entries, activities or messages per run.'
+        )
+        parser.add_argument('--min-rounds', type=int, default=7, help='Fewest timed rounds of each benchmark.')
+        parser.add_argument('--max-time', type=float, default=3.0, help='Seconds to keep repeating rounds for.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save', metavar='PATH', help='Write the results to PATH as a baseline.')
+        parser.add_argument('--compare', metavar='PATH', help='Compare the results with the baseline at PATH.')
+        parser.add_argument(
+            '--compare-stat', choices=STATS, default='min',
+            help='Statistic compared with the baseline; the fastest round is the least disturbed by other load.'
+        )
+        # Runs of unchanged code on a shared machine differed by up to about 50% even in their fastest round.
+        parser.add_argument(
+            '--threshold', type=float, default=75.0,
+            help='Fail --compare when a benchmark is this many percent slower than its baseline. '
+                 'Lower it on a quiet, dedicated machine.'
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as file:
+                    baseline = json.load(file)['benchmarks']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(f"Cannot read the baseline {options['compare']}: {error}")
+
+        results = {}
+        self.stdout.write(
+            f"{'benchmark':<32} {'rounds':>6} {'min ms':>10} {'median ms':>10} {'mean ms':>10} {'stddev ms':>10} "
+            f"{'us/item':>9}" + (f" {'vs baseline':>12}" if baseline is not None else '')
+        )
+        regressions = []
+        for name in options['benchmarks']:
+            for size in options['sizes']:
+                key = f"{name}[{size}]"
+                run = BENCHMARKS[name](size, random.Random(options['seed']))
+                with CaptureQueriesContext(connection) as queries:
+                    stats = measure(run, options['min_rounds'], options['max_time'])
+                if queries.captured_queries:
+                    # A query would time the database rather than the code.
+                    raise CommandError(f"{key} ran {len(queries.captured_queries)} queries.")
+                results[key] = stats
+
+                line = (
+                    f"{key:<32} {stats['rounds']:>6} {stats['min'] * 1000:>10.3f} {stats['median'] * 1000:>10.3f} "
+                    f"{stats['mean'] * 1000:>10.3f} {stats['stddev'] * 1000:>10.3f} {stats['median'] * 1e6 / size:>9.2f}"
+                )
+                if baseline is not None:
+                    if key not in baseline:
+                        line += f" {'new':>12}"
+                    else:
+                        change = (stats[options['compare_stat']] / baseline[key][options['compare_stat']] - 1) * 100
+                        line += f" {change:>+11.1f}%"
+                        if change > options['threshold']:
+                            regressions.append(f"{key} is {change:.1f}% slower ({options['compare_stat']})")
+                            line = self.style.ERROR(line)
+                self.stdout.write(line)
+
+        if options['save']:
+            with open(options['save'], 'w') as file:
+                json.dump({
+                    'created_at': timezone.now().isoformat(),
+                    'machine': {
+                        'python': platform.python_version(),
+                        'implementation': platform.python_implementation(),
+                        'django': django.get_version(),
+                        'platform': platform.platform(),
+                        'processor': platform.machine(),
+                    },
+                    'config': {name: options[name] for name in ('min_rounds', 'max_time', 'seed')},
+                    'benchmarks': results,
+                }, file, indent=2)
+            self.stdout.write(f"Saved the baseline to {options['save']}.")
+
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} benchmark(s) slower than the baseline by more than {options['threshold']:g}%:\n"
+                + '\n'.join(regressions)
+            )
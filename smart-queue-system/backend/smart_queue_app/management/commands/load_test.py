@@ -0,0 +1,533 @@
+import asyncio
+import base64
+import gc
+import http.client
+import json
+import os
+import random
+import statistics
+import struct
+import tempfile
+import time
+import uuid
+from collections import Counter as Tally, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.celery import app as celery_app
+from services.models import Counter, Service
+from smart_queue_app import queue_index
+from smart_queue_app.models import ArchivedQueueEntry
+from users.models import User
+
+
+class InProcessTarget:
+    """
+    Calls ``core.asgi.application`` directly, HTTP and WebSocket alike.
+    """
+
+    name = 'in-process'
+
+    def __init__(self):
+        from core.asgi import application
+        self.application = application
+
+    async def request(self, method, path, token, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method.upper(),
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+            'headers': [
+                (b'host', b'localhost'),
+                (b'authorization', f"Bearer {token}".encode()),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        }
+        done = asyncio.Event()
+        requested = False
+        status, chunks = None, []
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # Django listens for a disconnect while the view runs.
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body'):
+                    done.set()
+
+        await self.application(scope, receive, send)
+        done.set()
+        return status, b''.join(chunks)
+
+    async def websocket(self, token):
+        communicator = WebsocketCommunicator(self.application, f"/ws/notifications/?token={token}")
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            raise ConnectionError("WebSocket connection refused.")
+        return InProcessSocket(communicator)
+
+    def close(self):
+        pass
+
+
+class InProcessSocket:
+    def __init__(self, communicator):
+        self.communicator = communicator
+
+    async def receive(self):
+        # Never time out: a timed out receive cancels the consumer.
+        while True:
+            message = await self.communicator.receive_output(timeout=24 * 3600)
+            if message['type'] == 'websocket.send':
+                return message.get('text')
+            if message['type'] == 'websocket.close':
+                return None
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class ServerTarget:
+    """
+    Sends real HTTP requests and WebSocket frames to a running server, such as ``daphne core.asgi:application``.
+    """
+
+    name = 'server'
+
+    def __init__(self, url, concurrency):
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise CommandError("--url must look like http://127.0.0.1:8000")
+        self.host, self.port = parts.hostname, parts.port or 80
+        # Blocking requests run in threads, as many as requests in flight.
+        self.executor = ThreadPoolExecutor(max_workers=concurrency + 8)
+
+    async def request(self, method, path, token, data=None):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._request, method, path, token, data
+        )
+
+    def _request(self, method, path, token, data):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method.upper(), path, body=json.dumps(data) if data is not None else None, headers={
+                'Authorization': f"Bearer {token}", 'Content-Type': 'application/json'
+            })
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    async def websocket(self, token):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            f"GET /ws/notifications/?{urlencode({'token': token})} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        await writer.drain()
+        handshake = await reader.readuntil(b'\r\n\r\n')
+        if b' 101 ' not in handshake.split(b'\r\n', 1)[0]:
+            writer.close()
+            raise ConnectionError("WebSocket connection refused.")
+        return ServerSocket(reader, writer)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ServerSocket:
+    """
+    The client side of RFC 6455, as much as receiving text messages takes.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+
+    async def receive(self):
+        while True:
+            head = await self.reader.readexactly(2)
+            opcode, length = head[0] & 0x0f, head[1] & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            # Frames from the server are never masked.
+            payload = await self.reader.readexactly(length)
+            if opcode == 0x1:
+                return payload.decode()
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self.send_frame(0xA, payload)
+
+    def send_frame(self, opcode, payload=b''):
+        mask = os.urandom(4)
+        self.writer.write(
+            bytes([0x80 | opcode, 0x80 | len(payload)]) + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        )
+
+    async def close(self):
+        self.send_frame(0x8)
+        self.writer.close()
+
+
+class Recorder:
+    """
+    Request latencies per endpoint, and notification arrivals matched to the requests that caused them.
+    """
+
+    def __init__(self):
+        self.requests = defaultdict(list)
+        # (label, user_id) -> when the request behind the notification was sent, and copies expected.
+        self.expected = {}
+        self.expected_counts = Tally()
+        self.arrivals = []
+
+    def request(self, endpoint, started, finished, ok):
+        self.requests[endpoint].append((started, finished, ok))
+
+    def expect(self, label, user_id, started, copies=1):
+        if copies:
+            self.expected[(label, user_id)] = started
+            self.expected_counts[label] += copies
+
+    def arrived(self, label, user_id, at):
+        self.arrivals.append((label, user_id, at))
+
+    def endpoints(self):
+        report = {}
+        for endpoint, samples in sorted(self.requests.items()):
+            elapsed = max(finished for _, finished, _ in samples) - min(started for started, _, _ in samples)
+            report[endpoint] = {
+                'requests': len(samples),
+                'errors': sum(1 for *_, ok in samples if not ok),
+                'per_second': round(len(samples) / elapsed, 1) if elapsed > 0 else None,
+                **summarize([(finished - started) * 1000 for started, finished, _ in samples]),
+            }
+        return report
+
+    def notifications(self):
+        latencies, received = defaultdict(list), Tally()
+        for label, user_id, at in self.arrivals:
+            received[label] += 1
+            started = self.expected.get((label, user_id))
+            if started is not None and at >= started:
+                latencies[label].append((at - started) * 1000)
+        return {
+            label: {
+                'received': received[label],
+                'expected': self.expected_counts.get(label),
+                'matched': len(latencies[label]),
+                **summarize(latencies[label]),
+            }
+            for label in sorted(received.keys() | self.expected_counts.keys())
+        }
+
+
+def summarize(latencies):
+    if not latencies:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    if len(latencies) == 1:
+        percentiles = latencies * 99
+    else:
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentiles[94], 2),
+        'p99_ms': round(percentiles[98], 2),
+        'max_ms': round(max(latencies), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives the whole queue lifecycle through the ASGI application: students joining and polling, counters '
+        'calling, completing and skipping, and WebSocket clients, and writes throughput and latency percentiles '
+        'per endpoint and notification type as JSON. In process it runs against a throwaway test database; '
+        'against a running server (--url) it writes to the configured database and asks for --confirm-database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=2000, help='Students joining a queue, once each.')
+        parser.add_argument('--services', type=int, default=2, help='Services the students are spread over.')
+        parser.add_argument('--counters', type=int, default=3, help='Counters serving each service.')
+        parser.add_argument('--ws-clients', type=int, default=200, help='Students with a WebSocket open.')
+        parser.add_argument('--staff-clients', type=int, default=2, help='Staff WebSocket clients, on every service.')
+        parser.add_argument('--pollers', type=int, default=20, help='Students polling their status while being served.')
+        parser.add_argument('--poll-interval-ms', type=float, default=500.0)
+        parser.add_argument('--concurrency', type=int, default=50, help='Joins in flight at once.')
+        parser.add_argument('--service-ms', type=float, default=0.0, help='Mean time a counter spends with each entry.')
+        parser.add_argument('--skip-ratio', type=float, default=0.1, help='Share of called entries that are skipped.')
+        parser.add_argument('--drain-ms', type=float, default=2000.0, help='Wait for notifications still in flight.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--url', help='Base URL of a running local server, e.g. http://127.0.0.1:8000; in-process by default.'
+        )
+        parser.add_argument(
+            '--confirm-database', metavar='NAME',
+            help='With --url, the name of the configured database, which the test writes its users and services to.'
+        )
+        parser.add_argument('--output', help='Where to write the JSON results, load_test-<time>.json by default.')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            # The server reads its own database, so the test data has to go there.
+            database = str(connection.settings_dict['NAME'])
+            if options['confirm_database'] != database:
+                raise CommandError(
+                    f"With --url the load test writes users, services and queue entries to the {database} "
+                    f"database; pass --confirm-database {database} if that is what you want."
+                )
+            self.load(options)
+            return
+
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+            # A file rather than the shared in-memory database, whose table locks fail concurrent requests.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                tempfile.gettempdir(), f"load_test-{uuid.uuid4().hex[:8]}.sqlite3"
+            )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.load(options)
+        finally:
+            # Connections of the request threads live until collected, and would keep the database from being dropped.
+            gc.collect()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def load(self, options):
+        started_at = timezone.now()
+        output = options['output'] or f"load_test-{started_at:%Y%m%d-%H%M%S}.json"
+        prefix = f"loadtest-{uuid.uuid4().hex[:8]}"
+
+        overrides = {}
+        if not options['url']:
+            # In-memory stand-ins for Redis: channel layer, cache and queue index,
+            # with Celery tasks run eagerly in the process.
+            celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+            overrides = {
+                'CELERY_TASK_ALWAYS_EAGER': True,
+                'CHANNEL_LAYERS': {'default': {
+                    'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000, 'expiry': 600},
+                }},
+                'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                'QUEUE_INDEX': {'BACKEND': 'smart_queue_app.queue_index.LocalQueueIndex', 'CONFIG': {}},
+                'NOTIFICATION_OUTBOX': dict(settings.NOTIFICATION_OUTBOX, DISPATCH='celery'),
+            }
+
+        staff = User.objects.create(username=f"{prefix}-staff", role='staff')
+        services = [Service.objects.create(name=f"{prefix}-{i}") for i in range(options['services'])]
+        counters = {}
+        for service in services:
+            service.staff.add(staff)
+            counters[service.id] = [
+                Counter.objects.create(name=f"Counter {i + 1}", service=service) for i in range(options['counters'])
+            ]
+        User.objects.bulk_create(
+            [User(username=f"{prefix}-{i}") for i in range(options['students'])], batch_size=1000
+        )
+        students = list(User.objects.filter(username__startswith=f"{prefix}-").exclude(pk=staff.pk).order_by('pk'))
+        tokens = {user.pk: str(AccessToken.for_user(user)) for user in students + [staff]}
+
+        try:
+            with override_settings(**overrides):
+                queue_index.get_queue_index.cache_clear()
+                target = InProcessTarget() if not options['url'] else ServerTarget(options['url'], options['concurrency'])
+                recorder = Recorder()
+                try:
+                    started = time.perf_counter()
+                    asyncio.run(self.run_load(target, recorder, staff, services, counters, students, tokens, options))
+                    duration = time.perf_counter() - started
+                finally:
+                    target.close()
+                    queue_index.get_queue_index.cache_clear()
+        finally:
+            ArchivedQueueEntry.objects.filter(service__in=services).delete()
+            for service in services:
+                service.delete()
+            User.objects.filter(username__startswith=f"{prefix}-").delete()
+
+        results = {
+            'started_at': started_at.isoformat(),
+            'target': options['url'] or target.name,
+            'duration_seconds': round(duration, 2),
+            'config': {
+                name: options[name] for name in (
+                    'students', 'services', 'counters', 'ws_clients', 'staff_clients', 'pollers', 'poll_interval_ms',
+                    'concurrency', 'service_ms', 'skip_ratio', 'seed',
+                )
+            },
+            'environment': {
+                'database': connection.vendor,
+                'async_views': settings.QUEUE_ASYNC_VIEWS,
+                'publish': settings.NOTIFICATION_PUBLISH,
+            },
+            'endpoints': recorder.endpoints(),
+            'notifications': recorder.notifications(),
+        }
+        with open(output, 'w') as artifact:
+            json.dump(results, artifact, indent=2)
+        self.report(results)
+        self.stdout.write(f"Wrote {output}.")
+
+    async def run_load(self, target, recorder, staff, services, counters, students, tokens, options):
+        rng = random.Random(options['seed'])
+        staff_token = tokens[staff.pk]
+        assigned = {student.pk: rng.choice(services).id for student in students}
+        listening = {student.pk for student in students[:options['ws_clients']]}
+        staff_copies = options['staff_clients']
+
+        async def timed(endpoint, method, path, token, data=None):
+            started = time.perf_counter()
+            try:
+                status, body = await target.request(method, path, token, data)
+            except OSError:
+                status, body = None, b''
+            finished = time.perf_counter()
+            if endpoint == 'call_next' and status == 404:
+                endpoint = 'call_next (empty)'
+            recorder.request(endpoint, started, finished, status is not None and (status < 400 or endpoint.endswith('(empty)')))
+            return started, status, body
+
+        # WebSocket clients connect first and listen until the end.
+        sockets, readers = [], []
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def listen(socket, user_id, is_staff):
+            while (text := await socket.receive()) is not None:
+                at = time.perf_counter()
+                message = json.loads(text)
+                if message.get('type') == 'queue_deltas':
+                    for delta in message['deltas']:
+                        recorder.arrived(f"queue_deltas:{delta['op']}", delta['entry']['user']['id'], at)
+                elif message.get('type') == 'queue_update':
+                    recorder.arrived(f"queue_update:{message['status']}", user_id, at)
+                else:
+                    recorder.arrived(message.get('type', 'unknown'), user_id, at)
+
+        async def connect(user_id, is_staff=False):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    socket = await target.websocket(tokens[user_id])
+                except (OSError, ConnectionError, asyncio.TimeoutError):
+                    recorder.request('ws_connect', started, time.perf_counter(), False)
+                    return
+                recorder.request('ws_connect', started, time.perf_counter(), True)
+            sockets.append(socket)
+            readers.append(asyncio.ensure_future(listen(socket, user_id, is_staff)))
+
+        await asyncio.gather(
+            *(connect(staff.pk, True) for _ in range(staff_copies)),
+            *(connect(user_id) for user_id in listening),
+        )
+
+        joins_done = asyncio.Event()
+        serving_done = asyncio.Event()
+
+        async def join(student):
+            async with semaphore:
+                started, status, body = await timed(
+                    'join', 'post', '/api/queue/join/', tokens[student.pk], {'service': assigned[student.pk]}
+                )
+            recorder.expect('queue_deltas:added', student.pk, started, staff_copies)
+
+        async def joins():
+            await asyncio.gather(*(join(student) for student in students))
+            joins_done.set()
+
+        async def serve(service_id, counter):
+            while True:
+                started, status, body = await timed(
+                    'call_next', 'post', f"/api/queue/manage/{service_id}/call_next/", staff_token, {'counter_id': counter.id}
+                )
+                if status != 200:
+                    if joins_done.is_set() and status == 404:
+                        return
+                    await asyncio.sleep(0.02)
+                    continue
+                entry = json.loads(body)
+                user_id = entry['user']['id']
+                recorder.expect('queue_update:in_progress', user_id, started, int(user_id in listening))
+                recorder.expect('queue_deltas:status_changed', user_id, started, staff_copies)
+                if options['service_ms'] > 0:
+                    await asyncio.sleep(rng.expovariate(1000 / options['service_ms']))
+
+                if rng.random() < options['skip_ratio']:
+                    endpoint, outcome = 'skip_user', 'skipped'
+                else:
+                    endpoint, outcome = 'complete_service', 'completed'
+                started, status, body = await timed(
+                    endpoint, 'post', f"/api/queue/manage/{entry['id']}/{endpoint}/", staff_token
+                )
+                recorder.expect(f"queue_update:{outcome}", user_id, started, int(user_id in listening))
+                recorder.expect('queue_deltas:removed', user_id, started, staff_copies)
+
+        async def poll(student):
+            while not serving_done.is_set():
+                if rng.random() < 0.5:
+                    await timed('status', 'get', f"/api/queue/status/{assigned[student.pk]}/", tokens[student.pk])
+                else:
+                    await timed('my-queues', 'get', '/api/queue/my-queues/', tokens[student.pk])
+                await asyncio.sleep(options['poll_interval_ms'] / 1000)
+
+        async def counters_serving():
+            await asyncio.gather(*(
+                serve(service_id, counter) for service_id, service_counters in counters.items() for counter in service_counters
+            ))
+            serving_done.set()
+
+        pollers = [poll(student) for student in rng.sample(students, min(options['pollers'], len(students)))]
+        await asyncio.gather(joins(), counters_serving(), *pollers)
+
+        await asyncio.sleep(options['drain_ms'] / 1000)
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        await asyncio.gather(*(socket.close() for socket in sockets), return_exceptions=True)
+
+    def report(self, results):
+        def cell(value, width, digits=2):
+            return f"{'-':>{width}}" if value is None else f"{value:>{width}.{digits}f}"
+
+        self.stdout.write(
+            f"{'endpoint':<22} {'requests':>8} {'errors':>7} {'req/sec':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for endpoint, data in results['endpoints'].items():
+            self.stdout.write(
+                f"{endpoint:<22} {data['requests']:>8} {data['errors']:>7} {cell(data['per_second'], 9, 1)} "
+                f"{cell(data['p50_ms'], 8)} {cell(data['p95_ms'], 8)} {cell(data['p99_ms'], 8)}"
+            )
+        self.stdout.write(
+            f"\n{'notification':<28} {'received':>8} {'expected':>8} {'matched':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for label, data in results['notifications'].items():
+            expected = '-' if data['expected'] is None else data['expected']
+            self.stdout.write(
+                f"{label:<28} {data['received']:>8} {expected:>8} {data['matched']:>8} "
+                f"{cell(data['p50_ms'], 8)} {cell(data['p95_ms'], 8)} {cell(data['p99_ms'], 8)}"
+            )
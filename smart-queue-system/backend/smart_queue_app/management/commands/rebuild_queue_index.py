@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from services.models import Service
+from smart_queue_app import queue_index
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-service queue index from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('service_ids', nargs='*', type=int, help='Services to rebuild (defaults to all).')
+        parser.add_argument('--drifted-only', action='store_true', help='Only rebuild services whose index disagrees with the database.')
+
+    def handle(self, *args, **options):
+        service_ids = options['service_ids'] or list(Service.objects.values_list('id', flat=True))
+
+        if options['drifted_only']:
+            rebuilt = queue_index.reconcile(service_ids)
+        else:
+            for service_id in service_ids:
+                queue_index.load_service(service_id)
+            rebuilt = service_ids
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt queue index for {len(rebuilt)} service(s)."))
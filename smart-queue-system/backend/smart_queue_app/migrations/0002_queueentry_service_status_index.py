@@ -0,0 +1,20 @@
+# Generated by Django 5.0 on 2026-10-17 23:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0002_service_staff'),
+        ('smart_queue_app', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='queueentry',
+            index=models.Index(fields=['service', 'status', 'created_at'], name='queue_service_status_idx'),
+        ),
+    ]
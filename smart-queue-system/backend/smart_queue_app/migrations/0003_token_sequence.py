@@ -0,0 +1,101 @@
+# Generated by Django 5.0 on 2026-10-17 23:19
+
+import logging
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_token_day(apps, schema_editor):
+    QueueEntry = apps.get_model('smart_queue_app', 'QueueEntry')
+
+    # Which of a user's active entries to keep is for an admin to decide, not this migration.
+    active = QueueEntry.objects.filter(status__in=['waiting', 'in_progress'])
+    duplicates = active.values('user_id', 'service_id').annotate(total=Count('id')).filter(total__gt=1)
+    conflicts = [
+        f"entry {entry.pk} (user {entry.user_id}, service {entry.service_id}, {entry.status}, token {entry.token_number})"
+        for duplicate in duplicates
+        for entry in active.filter(user_id=duplicate['user_id'], service_id=duplicate['service_id']).order_by('created_at', 'id')
+    ]
+    if conflicts:
+        raise RuntimeError(
+            "Users are in the same queue more than once; finish, skip or delete all but one active entry of each "
+            "before migrating:\n" + "\n".join(conflicts)
+        )
+
+    QueueEntry.objects.update(token_day=TruncDate('created_at'))
+
+    # Renumber tokens that were handed out twice by concurrent joins.
+    duplicates = (
+        QueueEntry.objects.values('service_id', 'token_number', 'token_day')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        entries = QueueEntry.objects.filter(
+            service_id=duplicate['service_id'],
+            token_number=duplicate['token_number'],
+            token_day=duplicate['token_day']
+        ).order_by('created_at', 'id')
+        for entry in entries[1:]:
+            last = QueueEntry.objects.filter(service_id=entry.service_id).aggregate(last=Max('token_number'))['last']
+            QueueEntry.objects.filter(pk=entry.pk).update(token_number=last + 1)
+            logger.warning(
+                "Renumbered queue entry %s of service %s from token %s to %s.",
+                entry.pk, entry.service_id, entry.token_number, last + 1
+            )
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # PostgreSQL refuses to alter a table with deferred trigger events
+        # pending, as the updates above leave them; run those checks now.
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0003_service_token_reset'),
+        ('smart_queue_app', '0002_queueentry_service_status_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_value', models.PositiveIntegerField(default=0)),
+                ('day', models.DateField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='queueentry',
+            name='token_day',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AlterField(
+            model_name='queueentry',
+            name='status',
+            field=models.CharField(choices=[('waiting', 'Waiting'), ('in_progress', 'In Progress'), ('completed', 'Completed'), ('skipped', 'Skipped'), ('rejected', 'Rejected')], default='waiting', max_length=20),
+        ),
+        migrations.RunPython(backfill_token_day, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='queueentry',
+            constraint=models.UniqueConstraint(fields=('service', 'token_number', 'token_day'), name='unique_service_token_per_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='queueentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('waiting', 'in_progress'))), fields=('user', 'service'), name='unique_active_entry_per_user'),
+        ),
+        migrations.AddField(
+            model_name='tokensequence',
+            name='service',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='token_sequence', to='services.service'),
+        ),
+    ]
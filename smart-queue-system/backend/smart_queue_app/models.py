@@ -1,25 +1,172 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, F, Max, Value, When
+from django.db.models.functions import Greatest
 from django.conf import settings
+from django.utils import timezone
 from services.models import Service, Counter
 
+ACTIVE_STATUSES = ('waiting', 'in_progress')
+FINISHED_STATUSES = ('completed', 'skipped', 'rejected')
+
 class QueueEntry(models.Model):
     STATUS_CHOICES = (
         ('waiting', 'Waiting'),
         ('in_progress', 'In Progress'),
         ('completed', 'Completed'),
         ('skipped', 'Skipped'),
+        ('rejected', 'Rejected'),
     )
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
     counter = models.ForeignKey(Counter, on_delete=models.SET_NULL, null=True, blank=True)
     token_number = models.PositiveIntegerField()
+    token_day = models.DateField(default=timezone.localdate)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='waiting')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['service', 'status', 'created_at'], name='queue_service_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['service', 'token_number', 'token_day'],
+                name='unique_service_token_per_day'
+            ),
+            # A user can only hold one active entry per service.
+            models.UniqueConstraint(
+                fields=['user', 'service'],
+                condition=models.Q(status__in=ACTIVE_STATUSES),
+                name='unique_active_entry_per_user'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.service.name} - Token {self.token_number} ({self.user.username})"
+
+class ArchivedQueueEntry(models.Model):
+    """
+    A finished queue entry moved out of the hot ``QueueEntry`` table, see ``archive``.
+
+    Entries keep their id, so clients see the same entry before and after archival.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE)
+    counter = models.ForeignKey(Counter, on_delete=models.SET_NULL, null=True, blank=True)
+    token_number = models.PositiveIntegerField()
+    token_day = models.DateField()
+    status = models.CharField(max_length=20, choices=QueueEntry.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archive_user_created_idx'),
+            models.Index(fields=['service', 'created_at'], name='archive_service_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.service.name} - Token {self.token_number} ({self.user.username})"
+
+class TokenSequence(models.Model):
+    """
+    Per-service token counter, bumped with a single atomic UPDATE on every join.
+
+    ``day`` is the day of the most recent allocation; services with a daily
+    reset policy restart at 1 on the first join of a new day.
+    """
+    service = models.OneToOneField(Service, on_delete=models.CASCADE, related_name='token_sequence')
+    last_value = models.PositiveIntegerField(default=0)
+    day = models.DateField()
+
+    def __str__(self):
+        return f"{self.service.name} - Last token {self.last_value}"
+
+    @classmethod
+    def next_token(cls, service):
+        """
+        Allocates the next token for a service and returns ``(token_number, token_day)``.
+        """
+        today = timezone.localdate()
+        sequence = cls.objects.filter(service=service)
+
+        if service.token_reset == 'daily':
+            bumped = sequence.update(
+                last_value=Case(When(day=today, then=F('last_value') + 1), default=Value(1)),
+                day=today
+            )
+        else:
+            bumped = sequence.update(last_value=F('last_value') + 1, day=today)
+
+        if not bumped:
+            cls._create_for(service, today)
+            return cls.next_token(service)
+
+        return sequence.values_list('last_value', flat=True).get(), today
+
+    @classmethod
+    def catch_up(cls, service):
+        """
+        Moves the sequence of a service past the tokens its entries already hold.
+        """
+        today = timezone.localdate()
+        last_value = F('last_value')
+        if service.token_reset == 'daily':
+            last_value = Case(When(day=today, then=F('last_value')), default=Value(0))
+        cls.objects.filter(service=service).update(
+            last_value=Greatest(last_value, Value(cls._last_issued(service, today))),
+            day=today
+        )
+
+    @classmethod
+    def _last_issued(cls, service, today):
+        history = QueueEntry.objects.filter(service=service)
+        archived = ArchivedQueueEntry.objects.filter(service=service)
+        if service.token_reset == 'daily':
+            history = history.filter(token_day=today)
+            archived = archived.filter(token_day=today)
+        return max(
+            history.aggregate(last=Max('token_number'))['last'] or 0,
+            archived.aggregate(last=Max('token_number'))['last'] or 0
+        )
+
+    @classmethod
+    def _create_for(cls, service, today):
+        # Continue numbering from existing entries the first time a service is used.
+        last_value = cls._last_issued(service, today)
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(service=service, last_value=last_value, day=today)
+        except IntegrityError:
+            # Another request created the sequence concurrently.
+            pass
+
+
+def create_waiting_entry(service, user):
+    """
+    Adds a user to the queue of a service with its next token and returns the entry.
+
+    Returns None if the user already holds an active entry in that queue. A
+    token that is already taken, such as one handed out before the sequence
+    existed, catches the sequence up and is retried once; any other
+    integrity error is raised.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                token_number, token_day = TokenSequence.next_token(service)
+                return QueueEntry.objects.create(user=user, service=service, token_number=token_number, token_day=token_day)
+        except IntegrityError:
+            # The partial unique constraint allows one active entry per user and service.
+            if QueueEntry.objects.filter(user=user, service=service, status__in=ACTIVE_STATUSES).exists():
+                return None
+            if attempt:
+                raise
+            TokenSequence.catch_up(service)
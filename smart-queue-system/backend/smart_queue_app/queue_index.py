@@ -0,0 +1,273 @@
+"""
+Ordered per-service index of waiting queue entries.
+
+The database remains the source of truth for queue state. The index mirrors
+the ``waiting`` entries of every service as a sorted set keyed by join time so
+that ``call_next`` finds the head of a queue in O(log n) without scanning the
+``QueueEntry`` table. Whenever the index is found to disagree with the
+database it is rebuilt from it.
+"""
+import heapq
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# Head entries locked at once by claim_next, enough for the counters of a service claiming concurrently.
+CLAIM_WINDOW = 16
+
+
+class BaseQueueIndex:
+    """
+    Interface shared by the queue index backends.
+    """
+
+    def add(self, service_id, entry_id, score):
+        raise NotImplementedError
+
+    def remove(self, service_id, entry_id):
+        raise NotImplementedError
+
+    def peek(self, service_id, start, count):
+        """
+        Returns the ids of up to ``count`` entries from position ``start``, oldest first.
+        """
+        raise NotImplementedError
+
+    def members(self, service_id):
+        """
+        Returns the set of entry ids in the index of a service.
+        """
+        raise NotImplementedError
+
+    def is_loaded(self, service_id):
+        raise NotImplementedError
+
+    def replace(self, service_id, items):
+        """
+        Atomically replaces the index of a service with ``(entry_id, score)`` items.
+        """
+        raise NotImplementedError
+
+
+class RedisQueueIndex(BaseQueueIndex):
+    """
+    Keeps one Redis sorted set per service.
+    """
+
+    def __init__(self, url, key_prefix='queue_index'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+
+    def _key(self, service_id):
+        return f"{self.key_prefix}:{service_id}:waiting"
+
+    def _loaded_key(self, service_id):
+        return f"{self.key_prefix}:{service_id}:loaded"
+
+    def add(self, service_id, entry_id, score):
+        self.client.zadd(self._key(service_id), {entry_id: score})
+
+    def remove(self, service_id, entry_id):
+        self.client.zrem(self._key(service_id), entry_id)
+
+    def peek(self, service_id, start, count):
+        return [int(member) for member in self.client.zrange(self._key(service_id), start, start + count - 1)]
+
+    def members(self, service_id):
+        return {int(member) for member in self.client.zrange(self._key(service_id), 0, -1)}
+
+    def is_loaded(self, service_id):
+        return bool(self.client.exists(self._loaded_key(service_id)))
+
+    def replace(self, service_id, items):
+        mapping = {entry_id: score for entry_id, score in items}
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self._key(service_id))
+        if mapping:
+            pipe.zadd(self._key(service_id), mapping)
+        pipe.set(self._loaded_key(service_id), 1)
+        pipe.execute()
+
+
+class LocalQueueIndex(BaseQueueIndex):
+    """
+    In-process stand-in for the Redis index, used in tests and single-process setups.
+
+    Each service keeps a map of member scores; peeking takes the smallest
+    ones with ``heapq.nsmallest``, which is plenty for a single process.
+    """
+
+    def __init__(self, **kwargs):
+        self._lock = threading.Lock()
+        self._members = {}
+        self._loaded = set()
+
+    def add(self, service_id, entry_id, score):
+        with self._lock:
+            self._members.setdefault(service_id, {})[entry_id] = score
+
+    def remove(self, service_id, entry_id):
+        with self._lock:
+            self._members.get(service_id, {}).pop(entry_id, None)
+
+    def peek(self, service_id, start, count):
+        with self._lock:
+            members = self._members.get(service_id, {})
+            head = heapq.nsmallest(start + count, ((score, entry_id) for entry_id, score in members.items()))
+            return [entry_id for _, entry_id in head[start:]]
+
+    def members(self, service_id):
+        with self._lock:
+            return set(self._members.get(service_id, {}))
+
+    def is_loaded(self, service_id):
+        with self._lock:
+            return service_id in self._loaded
+
+    def replace(self, service_id, items):
+        with self._lock:
+            self._members[service_id] = {entry_id: score for entry_id, score in items}
+            self._loaded.add(service_id)
+
+
+@lru_cache(maxsize=None)
+def get_queue_index():
+    """
+    Returns the configured queue index backend.
+    """
+    config = settings.QUEUE_INDEX
+    backend = import_string(config['BACKEND'])
+    return backend(**config.get('CONFIG', {}))
+
+
+def entry_score(entry):
+    return entry.created_at.timestamp()
+
+
+def load_service(service_id):
+    """
+    Rebuilds the index of a service from the database.
+    """
+    from .models import QueueEntry
+
+    waiting = QueueEntry.objects.filter(
+        service_id=service_id,
+        status='waiting'
+    ).values_list('id', 'created_at')
+    get_queue_index().replace(
+        service_id,
+        [(entry_id, created_at.timestamp()) for entry_id, created_at in waiting]
+    )
+
+
+def ensure_loaded(service_id):
+    if not get_queue_index().is_loaded(service_id):
+        load_service(service_id)
+
+
+def reconcile(service_ids=None):
+    """
+    Compares the members of the index against the waiting entries in the database and rebuilds drifted services.
+
+    Returns the ids of the services that were rebuilt.
+    """
+    from collections import defaultdict
+    from services.models import Service
+    from .models import QueueEntry
+
+    if service_ids is None:
+        service_ids = list(Service.objects.values_list('id', flat=True))
+
+    # Ids rather than counts: a lost add and a stale member would cancel out in a count.
+    waiting = defaultdict(set)
+    for service_id, entry_id in QueueEntry.objects.filter(
+        service_id__in=service_ids, status='waiting'
+    ).values_list('service_id', 'id').iterator():
+        waiting[service_id].add(entry_id)
+
+    index = get_queue_index()
+    rebuilt = []
+    for service_id in service_ids:
+        if not index.is_loaded(service_id) or index.members(service_id) != waiting[service_id]:
+            load_service(service_id)
+            rebuilt.append(service_id)
+    return rebuilt
+
+
+def add_on_commit(entry):
+    """
+    Adds a waiting entry to the index once the surrounding transaction commits.
+    """
+    service_id, entry_id, score = entry.service_id, entry.id, entry_score(entry)
+    transaction.on_commit(lambda: get_queue_index().add(service_id, entry_id, score))
+
+
+def remove_on_commit(entry):
+    """
+    Drops an entry from the index once the surrounding transaction commits.
+    """
+    service_id, entry_id = entry.service_id, entry.id
+    transaction.on_commit(lambda: get_queue_index().remove(service_id, entry_id))
+
+
+def claim_next(service_id, counter_id=None):
+    """
+    Claims the oldest waiting entry of a service and marks it as in progress.
+
+    The index only points at the head of the queue: the first
+    ``CLAIM_WINDOW`` entries are locked in the database with ``SKIP LOCKED``
+    and the oldest one still waiting is updated there. It leaves the index
+    once the transaction commits, so a claim that is rolled back, even after
+    this function returned, leaves the entry waiting and indexed. Concurrent
+    counters skip each other's locked heads instead of queueing behind them.
+    Members that are no longer waiting are dropped from the index on the way,
+    and if the index is empty while the database still has waiting entries
+    it is rebuilt once. Returns the claimed ``QueueEntry`` or None if the
+    queue is empty. ``counter_id`` must already be cleaned, see
+    ``dispatch.clean_counter_id``.
+    """
+    from .models import QueueEntry
+
+    index = get_queue_index()
+    ensure_loaded(service_id)
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    rebuilt = False
+    start = 0
+
+    while True:
+        entry_ids = index.peek(service_id, start, CLAIM_WINDOW)
+        if not entry_ids:
+            if start or rebuilt or not QueueEntry.objects.filter(service_id=service_id, status='waiting').exists():
+                return None
+            # The index drifted from the database; rebuild it and try again.
+            load_service(service_id)
+            rebuilt = True
+            continue
+
+        waiting = QueueEntry.objects.filter(pk__in=entry_ids, service_id=service_id, status='waiting')
+        with transaction.atomic():
+            entry = waiting.select_for_update(skip_locked=skip_locked, of=('self',)).select_related(
+                'user', 'service', 'counter'
+            ).order_by('created_at', 'id').first()
+            if entry is not None:
+                entry.status = 'in_progress'
+                if counter_id:
+                    entry.counter_id = counter_id
+                entry.save(update_fields=['status', 'counter', 'updated_at'])
+
+        if entry is not None:
+            remove_on_commit(entry)
+            return entry
+
+        # Nothing to claim in this window: drop the members that are no longer
+        # waiting and look past the ones other transactions are claiming.
+        stale = set(entry_ids) - set(waiting.values_list('pk', flat=True))
+        for entry_id in stale:
+            index.remove(service_id, entry_id)
+        start += len(entry_ids) - len(stale)
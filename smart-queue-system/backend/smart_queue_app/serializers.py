@@ -1,18 +1,116 @@
 from rest_framework import serializers
 from .models import QueueEntry
+from . import eta
 from users.serializers import UserSerializer
 from services.serializers import ServiceSerializer, CounterSerializer
 
-class QueueEntrySerializer(serializers.ModelSerializer):
+
+def requested_fields(request):
+    """
+    Returns the field names asked for with ``?fields=a,b``, or None for all fields.
+    """
+    if request is None or not request.GET.get('fields'):
+        return None
+    return {name.strip() for name in request.GET['fields'].split(',') if name.strip()}
+
+
+def wants_compact(request):
+    return request is not None and request.GET.get('compact', '').lower() in ('1', 'true', 'yes')
+
+
+class SparseFieldsetsMixin:
+    """
+    Drops the fields that were not asked for with ``?fields=``.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class EstimateFieldsMixin(serializers.Serializer):
+    """
+    Position and expected wait of waiting entries, from the estimates passed as ``context['eta']``.
+    """
+    position = serializers.SerializerMethodField()
+    eta_seconds = serializers.SerializerMethodField()
+
+    def get_position(self, entry):
+        return self.context.get('eta', {}).get(entry.id, {}).get('position')
+
+    def get_eta_seconds(self, entry):
+        return self.context.get('eta', {}).get(entry.id, {}).get('eta_seconds')
+
+
+class QueueEntrySerializer(SparseFieldsetsMixin, EstimateFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     service = ServiceSerializer(read_only=True)
     counter = CounterSerializer(read_only=True)
 
     class Meta:
         model = QueueEntry
-        fields = ('id', 'user', 'service', 'counter', 'token_number', 'status', 'created_at')
+        fields = ('id', 'user', 'service', 'counter', 'token_number', 'status', 'created_at', 'position', 'eta_seconds')
+
+
+class CompactQueueEntrySerializer(SparseFieldsetsMixin, EstimateFieldsMixin, serializers.ModelSerializer):
+    """
+    Queue entry that refers to its service and counter by id.
+
+    The entry itself matches the one used by the staff WebSocket protocol.
+    """
+    user = serializers.SerializerMethodField()
+
+    class Meta:
+        model = QueueEntry
+        fields = ('id', 'user', 'service', 'counter', 'token_number', 'status', 'created_at', 'position', 'eta_seconds')
+
+    def get_user(self, entry):
+        return {'id': entry.user_id, 'username': entry.user.username}
+
 
 class CreateQueueEntrySerializer(serializers.ModelSerializer):
     class Meta:
         model = QueueEntry
         fields = ('service',)
+
+
+def prepare_entries(queryset, request):
+    """
+    Loads what the requested representation needs in a fixed number of queries.
+    """
+    queryset = queryset.select_related('user', 'service', 'counter')
+    fields = requested_fields(request)
+    if not wants_compact(request) and (fields is None or 'service' in fields):
+        # The nested service lists all of its counters and staff.
+        queryset = queryset.prefetch_related('service__counters', 'service__staff')
+    return queryset
+
+
+def serialize_entries(entries, request):
+    """
+    Serializes a list of entries, nested by default or compact with ``?compact=true``.
+
+    The compact form ships every service and counter once, keyed by id, next
+    to the entries instead of repeating them in each one. Waiting entries
+    carry their position and expected wait, see ``eta.estimate``.
+    """
+    context = {'request': request}
+    fields = requested_fields(request)
+    if fields is None or fields & {'position', 'eta_seconds'}:
+        context['eta'] = eta.estimate(entries)
+    if not wants_compact(request):
+        return QueueEntrySerializer(entries, many=True, context=context).data
+
+    return {
+        'entries': CompactQueueEntrySerializer(entries, many=True, context=context).data,
+        'services': {
+            entry.service_id: {'id': entry.service_id, 'name': entry.service.name}
+            for entry in entries
+        },
+        'counters': {
+            entry.counter_id: {'id': entry.counter_id, 'name': entry.counter.name}
+            for entry in entries if entry.counter_id
+        },
+    }
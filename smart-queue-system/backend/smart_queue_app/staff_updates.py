@@ -0,0 +1,135 @@
+"""
+Versioned delta protocol for the ``service_{id}_staff`` WebSocket groups.
+
+Queue mutations publish one small delta instead of the whole queue:
+
+``added``
+    An entry joined the queue.
+``status_changed``
+    An active entry changed status, e.g. it was called to a counter.
+``removed``
+    An entry left the active queue (completed, skipped or rejected).
+
+Every delta carries a per-service sequence number that increases by one per
+mutation. Deltas go through the coalescing stage in ``notifications`` and
+reach clients as ``queue_deltas`` batches covering ``from_seq`` to ``seq``,
+with only the latest delta kept per entry. Clients apply batches on top of a
+``queue_snapshot``, which is sent on connect and whenever a client reports a
+gap in the sequence with a ``{"type": "resync", "service_id": ...}`` message.
+Applying a delta is idempotent, so batches overlapping a snapshot are harmless.
+"""
+from django.core.cache import cache
+
+from .models import ACTIVE_STATUSES, QueueEntry
+
+DELTA_OPS = ('added', 'status_changed', 'removed')
+
+# Deltas are only kept until the coalescing stage has flushed them.
+DELTA_TIMEOUT = 60 * 60
+
+
+def _sequence_key(service_id):
+    return f"queue:{service_id}:staff_seq"
+
+
+def _flushed_key(service_id):
+    return f"queue:{service_id}:staff_flushed_seq"
+
+
+def _delta_key(service_id, seq):
+    return f"queue:{service_id}:staff_delta:{seq}"
+
+
+def next_sequence(service_id):
+    key = _sequence_key(service_id)
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key)
+
+
+def current_sequence(service_id):
+    return cache.get(_sequence_key(service_id), 0)
+
+
+def entry_data(entry):
+    """
+    Compact representation of a queue entry used in deltas and snapshots.
+    """
+    return {
+        'id': entry.id,
+        'token_number': entry.token_number,
+        'status': entry.status,
+        'user': {'id': entry.user_id, 'username': entry.user.username},
+        'counter': entry.counter_id,
+        'created_at': entry.created_at.isoformat(),
+    }
+
+
+def record_delta(service_id, op, data):
+    """
+    Stores a delta under the next sequence number and hands it to the coalescing stage.
+
+    ``data`` is the ``entry_data`` of the affected entry.
+    """
+    from notifications import coalescing
+
+    if op not in DELTA_OPS:
+        raise ValueError(f"Unknown queue delta: {op}")
+
+    seq = next_sequence(service_id)
+    cache.set(_delta_key(service_id, seq), {'seq': seq, 'op': op, 'entry': data}, timeout=DELTA_TIMEOUT)
+    coalescing.submit('staff', service_id)
+
+
+def build_pending_message(service_id):
+    """
+    Collects the deltas published since the last flush into one ``queue_deltas`` message.
+
+    Falls back to a full snapshot if a delta in the range is missing, and
+    returns None when there is nothing new.
+    """
+    flushed = cache.get(_flushed_key(service_id), 0)
+    seq = current_sequence(service_id)
+    if seq <= flushed:
+        return None
+    cache.set(_flushed_key(service_id), seq, timeout=None)
+
+    keys = [_delta_key(service_id, n) for n in range(flushed + 1, seq + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return build_snapshot(service_id)
+    cache.delete_many(keys)
+
+    # Only the latest delta of each entry matters to the client.
+    latest = {}
+    for key in keys:
+        delta = found[key]
+        latest.pop(delta['entry']['id'], None)
+        latest[delta['entry']['id']] = delta
+
+    return {
+        'type': 'queue_deltas',
+        'service_id': service_id,
+        'from_seq': flushed + 1,
+        'seq': seq,
+        'deltas': list(latest.values()),
+    }
+
+
+def build_snapshot(service_id):
+    """
+    Returns the full active queue of a service along with the current sequence number.
+
+    The sequence is read before the queue so that any delta newer than the
+    snapshot is replayed by the client rather than lost.
+    """
+    seq = current_sequence(service_id)
+    queue_entries = QueueEntry.objects.filter(
+        service_id=service_id,
+        status__in=ACTIVE_STATUSES
+    ).select_related('user').order_by('created_at')
+    return {
+        'type': 'queue_snapshot',
+        'service_id': service_id,
+        'seq': seq,
+        'queue': [entry_data(entry) for entry in queue_entries],
+    }
@@ -0,0 +1,97 @@
+"""
+Cached snapshots of the public queue status.
+
+Every service has a version number in the cache that ``StatusCacheSink``
+bumps whenever one of its entries joins, is called or leaves the queue. The
+rendered status of a service is cached once per representation (nested or
+compact, and the ``?fields=`` asked for) together with the version it was
+built from and a strong ETag over its bytes, so polls of an unchanged queue
+are answered from the cache, and with ``304 Not Modified`` if the client
+already has them.
+
+After a bump only one request rebuilds a representation (see
+``core.caching.versioned``). Snapshots also expire after ``TIMEOUT`` seconds to pick up changes that do
+not go through queue events, such as a renamed service.
+"""
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.renderers import JSONRenderer
+
+from core import caching
+from notifications.sinks import QueueEventSink
+from .models import QueueEntry
+from .serializers import QueueEntrySerializer, prepare_entries, requested_fields, serialize_entries, wants_compact
+
+
+def _version_key(service_id):
+    return f"queue:{service_id}:status_version"
+
+
+def _snapshot_key(service_id, variant):
+    return f"queue:{service_id}:status:{variant}"
+
+
+def version(service_id):
+    return caching.version(_version_key(service_id))
+
+
+def bump(service_id):
+    return caching.bump(_version_key(service_id))
+
+
+def variant(request):
+    """
+    Names the representation asked for, ignoring unknown fields so they cannot multiply cache entries.
+    """
+    fields = requested_fields(request)
+    names = ','.join(sorted(fields & set(QueueEntrySerializer.Meta.fields))) if fields is not None else '*'
+    return f"{'compact' if wants_compact(request) else 'nested'}:{names}"
+
+
+def build(service_id, request):
+    entries = list(prepare_entries(
+        QueueEntry.objects.filter(service_id=service_id, status__in=['waiting', 'in_progress']).order_by('created_at'),
+        request
+    ))
+    body = JSONRenderer().render(serialize_entries(entries, request))
+    return {'etag': f'"{hashlib.sha1(body).hexdigest()}"', 'body': body}
+
+
+def get_snapshot(service_id, request):
+    """
+    Returns the current ``{'etag', 'body'}`` snapshot, rebuilding it if needed.
+    """
+    config = settings.QUEUE_STATUS_CACHE
+    snapshot, _ = caching.versioned(
+        _snapshot_key(service_id, variant(request)), version(service_id), lambda: build(service_id, request),
+        config['TIMEOUT'], config['REBUILD_TIMEOUT'], config['REBUILD_WAIT_MS']
+    )
+    return snapshot
+
+
+def status_response(service_id, request):
+    """
+    Serves the cached status of a service, or ``304 Not Modified`` if the client's ETag matches.
+    """
+    snapshot = get_snapshot(service_id, request)
+    response = HttpResponse(snapshot['body'], content_type='application/json')
+    response['ETag'] = snapshot['etag']
+    # Clients may keep the body but must revalidate it on every poll.
+    response['Cache-Control'] = 'no-cache'
+    return get_conditional_response(request, etag=snapshot['etag'], response=response)
+
+
+class StatusCacheSink(QueueEventSink):
+    """
+    Bumps the status version of every service whose queue changed.
+    """
+
+    message_class = 'status'
+
+    def handle(self, events):
+        changed = {event['service']['id'] for event_id, event in events if event['event'] != 'custom_notification'}
+        for service_id in changed:
+            bump(service_id)
@@ -0,0 +1,23 @@
+from celery import shared_task
+from . import archive, eta, queue_index
+
+@shared_task
+def reconcile_queue_index():
+    """
+    Rebuilds the queue index of every service that drifted from the database.
+    """
+    return queue_index.reconcile()
+
+@shared_task
+def archive_queue_entries():
+    """
+    Moves finished queue entries past the archival cutoff out of the hot table.
+    """
+    return archive.archive()
+
+@shared_task
+def reload_eta(service_id):
+    """
+    Replays the recent activity log of a service into its ETA state.
+    """
+    eta.store.reload(service_id)
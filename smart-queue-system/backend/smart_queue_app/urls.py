@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     QueueViewSet,
     JoinQueueView,
@@ -10,9 +12,25 @@ from .views import (
 router = DefaultRouter()
 router.register(r'manage', QueueViewSet, basename='queue-management')
 
-urlpatterns = [
-    path('', include(router.urls)),
-    path('join/', JoinQueueView.as_view(), name='join-queue'),
-    path('my-queues/', MyQueuesView.as_view(), name='my-queues'),
-    path('status/<int:service_id>/', ServiceQueueStatusView.as_view(), name='service-queue-status'),
-]
+
+def queue_urlpatterns(use_async):
+    """
+    Returns the queue URLs, with the hot endpoints served by the async views if ``use_async``.
+    """
+    if use_async:
+        return [
+            path('manage/<int:pk>/call_next/', async_views.call_next, name='queue-management-call-next'),
+            path('', include(router.urls)),
+            path('join/', async_views.join_queue, name='join-queue'),
+            path('my-queues/', async_views.my_queues, name='my-queues'),
+            path('status/<int:service_id>/', async_views.service_queue_status, name='service-queue-status'),
+        ]
+    return [
+        path('', include(router.urls)),
+        path('join/', JoinQueueView.as_view(), name='join-queue'),
+        path('my-queues/', MyQueuesView.as_view(), name='my-queues'),
+        path('status/<int:service_id>/', ServiceQueueStatusView.as_view(), name='service-queue-status'),
+    ]
+
+
+urlpatterns = queue_urlpatterns(settings.QUEUE_ASYNC_VIEWS)
@@ -1,12 +1,16 @@
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, status, generics
+from django.utils.decorators import method_decorator
+from rest_framework import viewsets, status, generics, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from .models import QueueEntry, Service
-from .serializers import QueueEntrySerializer, CreateQueueEntrySerializer
+from .models import ArchivedQueueEntry, QueueEntry, Service, create_waiting_entry
+from .serializers import QueueEntrySerializer, CreateQueueEntrySerializer, prepare_entries, serialize_entries
+from . import archive, dispatch, eta, queue_index, status_cache
+from notifications import queue_events
 from core.permissions import IsStaffOrAdmin, IsAdminUser
 
 class QueueViewSet(viewsets.ViewSet):
@@ -27,67 +31,25 @@ class QueueViewSet(viewsets.ViewSet):
         user = request.user
 
         # Check if the user is authorized to manage this service
-        if user.role != 'admin' and user not in service.staff.all():
+        if user.role != 'admin' and not service.staff.filter(pk=user.pk).exists():
             return Response({'detail': 'You are not authorized to manage this service.'}, status=status.HTTP_403_FORBIDDEN)
 
+        if not isinstance(request.data, dict):
+            return Response({'detail': 'Expected a JSON object.'}, status=status.HTTP_400_BAD_REQUEST)
         counter = request.data.get('counter_id')
         
         with transaction.atomic():
-            # Find the next waiting user
-            next_user_entry = QueueEntry.objects.select_for_update().filter(
-                service=service, 
-                status='waiting'
-            ).order_by('created_at').first()
+            # Claim the next waiting user using the configured dispatch mode
+            try:
+                next_user_entry = dispatch.claim_next(service.id, counter)
+            except ValidationError as error:
+                return Response({'counter_id': error.messages}, status=status.HTTP_400_BAD_REQUEST)
 
             if not next_user_entry:
                 return Response({'detail': 'No users in the queue.'}, status=status.HTTP_404_NOT_FOUND)
 
-            # Update the status to 'in_progress'
-            next_user_entry.status = 'in_progress'
-            if counter:
-                next_user_entry.counter_id = counter
-            next_user_entry.save()
-            
-            # Send notification via WebSocket to the user and to the public dashboard
-            from notifications.tasks import send_notification_to_user, broadcast_public_update
-            
-            # Notify the user
-            user_message = {
-                'type': 'queue_update',
-                'status': 'in_progress',
-                'service': service.name,
-                'token': next_user_entry.token_number,
-                'message': f"It's your turn for {service.name}. Please proceed to counter {next_user_entry.counter.name if next_user_entry.counter else ''}."
-            }
-            send_notification_to_user.delay(next_user_entry.user.id, user_message)
-            
-            # Broadcast to public dashboard
-            public_message = {
-                'type': 'public_update',
-                'service_id': service.id,
-                'now_serving': next_user_entry.token_number
-            }
-            broadcast_public_update.delay(public_message)
-
-            # Notify staff of the update
-            from notifications.tasks import notify_staff_of_queue_update
-            queue_entries = QueueEntry.objects.filter(service=service, status__in=['waiting', 'in_progress']).order_by('created_at')
-            queue_serializer = QueueEntrySerializer(queue_entries, many=True)
-            staff_message = {
-                'type': 'queue_update',
-                'service_id': service.id,
-                'queue': queue_serializer.data
-            }
-            notify_staff_of_queue_update.delay(service.id, staff_message)
-
-            from analytics.tasks import log_activity
-            log_activity.delay(
-                next_user_entry.user.id, 
-                service.id, 
-                'user_called', 
-                counter_id=next_user_entry.counter_id, 
-                details={'token': next_user_entry.token_number}
-            )
+            # Notify the user, staff and public dashboard, and log the call
+            queue_events.emit('called', next_user_entry, previous_status='waiting')
 
             serializer = QueueEntrySerializer(next_user_entry)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -97,46 +59,22 @@ class QueueViewSet(viewsets.ViewSet):
         """
         Marks a queue entry as completed.
         """
-        entry = get_object_or_404(QueueEntry, pk=pk)
+        entry = get_object_or_404(QueueEntry.objects.select_related('user', 'service', 'counter'), pk=pk)
         user = request.user
         service = entry.service
 
         # Check if the user is authorized to manage this service
-        if user.role != 'admin' and user not in service.staff.all():
+        if user.role != 'admin' and not service.staff.filter(pk=user.pk).exists():
             return Response({'detail': 'You are not authorized to manage this service.'}, status=status.HTTP_403_FORBIDDEN)
 
+        previous_status = entry.status
         entry.status = 'completed'
         entry.save()
-        
-        # Notify staff of the update
-        from notifications.tasks import notify_staff_of_queue_update
-        queue_entries = QueueEntry.objects.filter(service=service, status__in=['waiting', 'in_progress']).order_by('created_at')
-        queue_serializer = QueueEntrySerializer(queue_entries, many=True)
-        staff_message = {
-            'type': 'queue_update',
-            'service_id': service.id,
-            'queue': queue_serializer.data
-        }
-        notify_staff_of_queue_update.delay(service.id, staff_message)
-
-        from notifications.tasks import send_notification_to_user
-        message = {
-            'type': 'queue_update',
-            'status': 'completed',
-            'service': entry.service.name,
-            'message': f"Your service for {entry.service.name} is complete. Thank you!"
-        }
-        send_notification_to_user.delay(entry.user.id, message)
-        
-        from analytics.tasks import log_activity
-        log_activity.delay(
-            entry.user.id,
-            entry.service.id,
-            'service_completed',
-            counter_id=entry.counter_id,
-            details={'token': entry.token_number}
-        )
-        
+        queue_index.remove_on_commit(entry)
+
+        # Notify the user and staff, and log the change
+        queue_events.emit('completed', entry, previous_status=previous_status)
+
         return Response({'detail': 'Service completed.'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], permission_classes=[IsStaffOrAdmin])
@@ -144,46 +82,22 @@ class QueueViewSet(viewsets.ViewSet):
         """
         Skips a user in the queue.
         """
-        entry = get_object_or_404(QueueEntry, pk=pk)
+        entry = get_object_or_404(QueueEntry.objects.select_related('user', 'service', 'counter'), pk=pk)
         user = request.user
         service = entry.service
 
         # Check if the user is authorized to manage this service
-        if user.role != 'admin' and user not in service.staff.all():
+        if user.role != 'admin' and not service.staff.filter(pk=user.pk).exists():
             return Response({'detail': 'You are not authorized to manage this service.'}, status=status.HTTP_403_FORBIDDEN)
 
+        previous_status = entry.status
         entry.status = 'skipped'
         entry.save()
+        queue_index.remove_on_commit(entry)
+
+        # Notify the user and staff, and log the change
+        queue_events.emit('skipped', entry, previous_status=previous_status)
 
-        # Notify staff of the update
-        from notifications.tasks import notify_staff_of_queue_update
-        queue_entries = QueueEntry.objects.filter(service=service, status__in=['waiting', 'in_progress']).order_by('created_at')
-        queue_serializer = QueueEntrySerializer(queue_entries, many=True)
-        staff_message = {
-            'type': 'queue_update',
-            'service_id': service.id,
-            'queue': queue_serializer.data
-        }
-        notify_staff_of_queue_update.delay(service.id, staff_message)
-        
-        from notifications.tasks import send_notification_to_user
-        message = {
-            'type': 'queue_update',
-            'status': 'skipped',
-            'service': entry.service.name,
-            'message': f"You have been skipped in the queue for {entry.service.name}. Please contact staff for assistance."
-        }
-        send_notification_to_user.delay(entry.user.id, message)
-        
-        from analytics.tasks import log_activity
-        log_activity.delay(
-            entry.user.id,
-            entry.service.id,
-            'user_skipped',
-            counter_id=entry.counter_id,
-            details={'token': entry.token_number}
-        )
-        
         return Response({'detail': 'User skipped.'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], permission_classes=[IsStaffOrAdmin])
@@ -191,46 +105,22 @@ class QueueViewSet(viewsets.ViewSet):
         """
         Rejects a user from the queue.
         """
-        entry = get_object_or_404(QueueEntry, pk=pk)
+        entry = get_object_or_404(QueueEntry.objects.select_related('user', 'service', 'counter'), pk=pk)
         user = request.user
         service = entry.service
 
         # Check if the user is authorized to manage this service
-        if user.role != 'admin' and user not in service.staff.all():
+        if user.role != 'admin' and not service.staff.filter(pk=user.pk).exists():
             return Response({'detail': 'You are not authorized to manage this service.'}, status=status.HTTP_403_FORBIDDEN)
 
+        previous_status = entry.status
         entry.status = 'rejected'
         entry.save()
+        queue_index.remove_on_commit(entry)
+
+        # Notify the user and staff, and log the change
+        queue_events.emit('rejected', entry, previous_status=previous_status)
 
-        # Notify staff of the update
-        from notifications.tasks import notify_staff_of_queue_update
-        queue_entries = QueueEntry.objects.filter(service=service, status__in=['waiting', 'in_progress']).order_by('created_at')
-        queue_serializer = QueueEntrySerializer(queue_entries, many=True)
-        staff_message = {
-            'type': 'queue_update',
-            'service_id': service.id,
-            'queue': queue_serializer.data
-        }
-        notify_staff_of_queue_update.delay(service.id, staff_message)
-        
-        from notifications.tasks import send_notification_to_user
-        message = {
-            'type': 'queue_update',
-            'status': 'rejected',
-            'service': entry.service.name,
-            'message': f"Your request for {entry.service.name} has been rejected. Please contact staff for more information."
-        }
-        send_notification_to_user.delay(entry.user.id, message)
-        
-        from analytics.tasks import log_activity
-        log_activity.delay(
-            entry.user.id,
-            entry.service.id,
-            'user_rejected',
-            counter_id=entry.counter_id,
-            details={'token': entry.token_number}
-        )
-        
         return Response({'detail': 'User rejected.'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], permission_classes=[IsStaffOrAdmin])
@@ -238,34 +128,19 @@ class QueueViewSet(viewsets.ViewSet):
         """
         Sends a custom notification message to a specific user in the queue.
         """
-        entry = get_object_or_404(QueueEntry, pk=pk)
+        entry = get_object_or_404(QueueEntry.objects.select_related('user', 'service', 'counter'), pk=pk)
         user = request.user
         service = entry.service
 
         # Check if the user is authorized to manage this service
-        if user.role != 'admin' and user not in service.staff.all():
+        if user.role != 'admin' and not service.staff.filter(pk=user.pk).exists():
             return Response({'detail': 'You are not authorized to manage this service.'}, status=status.HTTP_403_FORBIDDEN)
 
         custom_message_text = request.data.get('message')
         if not custom_message_text:
             return Response({'detail': 'Message text is required.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        from notifications.tasks import send_notification_to_user
-        message = {
-            'type': 'custom_notification',
-            'service': entry.service.name,
-            'message': custom_message_text
-        }
-        send_notification_to_user.delay(entry.user.id, message)
-        
-        from analytics.tasks import log_activity
-        log_activity.delay(
-            entry.user.id,
-            entry.service.id,
-            'custom_notification_sent',
-            counter_id=entry.counter_id,
-            details={'token': entry.token_number, 'message': custom_message_text}
-        )
+        queue_events.emit('custom_notification', entry, message=custom_message_text)
 
         return Response({'detail': 'Custom notification sent.'}, status=status.HTTP_200_OK)
 
@@ -281,51 +156,36 @@ class JoinQueueView(generics.CreateAPIView):
         service = serializer.validated_data['service']
         user = self.request.user
 
-        if QueueEntry.objects.filter(user=user, service=service, status__in=['waiting', 'in_progress']).exists():
-            raise serializers.ValidationError("You are already in the queue for this service.")
-
         with transaction.atomic():
-            # Get the last token number for this service
-            last_token = QueueEntry.objects.filter(service=service).order_by('-token_number').first()
-            new_token_number = (last_token.token_number + 1) if last_token else 1
-            
-            entry = serializer.save(
-                user=user, 
-                token_number=new_token_number
-            )
+            # Allocate the next token from the service's sequence
+            entry = create_waiting_entry(service, user)
+            if entry is None:
+                raise serializers.ValidationError("You are already in the queue for this service.")
+            serializer.instance = entry
+            queue_index.add_on_commit(entry)
             
-            # Notify staff of the update
-            from notifications.tasks import notify_staff_of_queue_update
-            queue_entries = QueueEntry.objects.filter(service=service, status__in=['waiting', 'in_progress']).order_by('created_at')
-            queue_serializer = QueueEntrySerializer(queue_entries, many=True)
-            staff_message = {
-                'type': 'queue_update',
-                'service_id': service.id,
-                'queue': queue_serializer.data
-            }
-            notify_staff_of_queue_update.delay(service.id, staff_message)
-
-            from notifications.tasks import broadcast_public_update
-            public_message = {
-                'type': 'public_update',
-                'service_id': service.id,
-                'queue_length': queue_entries.count()
-            }
-            broadcast_public_update.delay(public_message)
-
-            from analytics.tasks import log_activity
-            log_activity.delay(user.id, service.id, 'user_join', details={'token': new_token_number})
+            # Notify staff and the public dashboard, and log the join
+            queue_events.emit('joined', entry)
 
 class MyQueuesView(generics.ListAPIView):
     """
-    Returns a list of all queue entries for the currently authenticated user.
+    Returns a list of all queue entries for the currently authenticated user,
+    including archived ones.
     """
     serializer_class = QueueEntrySerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return QueueEntry.objects.filter(user=self.request.user).order_by('-created_at')
+        return eta.with_positions(QueueEntry.objects.filter(user=self.request.user).order_by('-created_at'))
 
+    def list(self, request, *args, **kwargs):
+        entries = archive.history(
+            prepare_entries(self.get_queryset(), request),
+            prepare_entries(ArchivedQueueEntry.objects.filter(user=request.user).order_by('-created_at'), request)
+        )
+        return Response(serialize_entries(entries, request))
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class ServiceQueueStatusView(generics.ListAPIView):
     """
     Returns the current queue status for a given service.
@@ -337,3 +197,7 @@ class ServiceQueueStatusView(generics.ListAPIView):
         service_id = self.kwargs['service_id']
         return QueueEntry.objects.filter(service_id=service_id, status__in=['waiting', 'in_progress']).order_by('created_at')
 
+    def list(self, request, *args, **kwargs):
+        # Served from a snapshot that queue mutations invalidate, with ETag support
+        return status_cache.status_response(self.kwargs['service_id'], request)
+
@@ -14,5 +14,5 @@ class MyServicesView(generics.ListAPIView):
     def get_queryset(self):
         user = self.request.user
         if user.role == 'admin':
-            return Service.objects.all()
-        return user.services.all()
+            return Service.objects.prefetch_related('counters', 'staff')
+        return user.services.prefetch_related('counters', 'staff')
@@ -1,7 +1,7 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useQuery, useMutation, useQueryClient } from 'react-query';
 import api from '../../services/api';
-import { QueueEntry, Service } from '../../types';
+import { CompactQueueList, Service, StaffQueueEntry } from '../../types';
 import useWebSocket from '../../hooks/useWebSocket';
 
 // API functions
@@ -11,11 +11,11 @@ const fetchMyServices = async (): Promise<Service[]> => {
     return data;
 };
 
-const fetchQueueForService = async (serviceId: number): Promise<QueueEntry[]> => {
+const fetchQueueForService = async (serviceId: number): Promise<StaffQueueEntry[]> => {
     if (!serviceId) return [];
-    // Fetches the initial state of the queue
-    const { data } = await api.get(`/queue/status/${serviceId}/`);
-    return data;
+    // Fetches the initial state of the queue in the same compact shape as the WebSocket deltas
+    const { data } = await api.get<CompactQueueList>(`/queue/status/${serviceId}/`, { params: { compact: true } });
+    return data.entries;
 };
 
 const callNextUser = async (serviceId: number) => {
@@ -42,7 +42,9 @@ const sendCustomNotification = async ({ entryId, message }: { entryId: number; m
 
 const QueueControl: React.FC = () => {
     const [selectedService, setSelectedService] = useState<number | null>(null);
-    const [queue, setQueue] = useState<QueueEntry[]>([]);
+    const [queue, setQueue] = useState<StaffQueueEntry[]>([]);
+    // Last applied delta sequence number per service
+    const sequences = useRef<Record<number, number>>({});
     const [isNotificationModalOpen, setIsNotificationModalOpen] = useState(false);
     const [notificationMessage, setNotificationMessage] = useState('');
     const [targetEntryId, setTargetEntryId] = useState<number | null>(null);
@@ -52,7 +54,7 @@ const QueueControl: React.FC = () => {
     const { data: services, isLoading: servicesLoading } = useQuery<Service[]>('myServices', fetchMyServices);
     
     // Fetch initial queue state when a service is selected
-    const { isLoading: initialQueueLoading } = useQuery<QueueEntry[]>(
+    const { isLoading: initialQueueLoading } = useQuery<StaffQueueEntry[]>(
         ['queue', selectedService], 
         () => fetchQueueForService(selectedService!),
         { 
@@ -63,17 +65,44 @@ const QueueControl: React.FC = () => {
         }
     );
     
-    const lastJsonMessage = useWebSocket();
+    const { lastJsonMessage, sendJsonMessage } = useWebSocket();
 
-    // Listen for real-time updates from the WebSocket
+    // Apply queue snapshots and delta batches from the WebSocket
     useEffect(() => {
-        if (lastJsonMessage?.type === 'send_staff_notification') {
-            const message = lastJsonMessage.message;
-            if (message.type === 'queue_update' && message.service_id === selectedService) {
-                setQueue(message.queue); // Update queue from WebSocket message
+        const message = lastJsonMessage;
+        if (!message || (message.type !== 'queue_snapshot' && message.type !== 'queue_deltas')) return;
+
+        const serviceId: number = message.service_id;
+        if (message.type === 'queue_snapshot') {
+            sequences.current[serviceId] = message.seq;
+            if (serviceId === selectedService) {
+                setQueue(message.queue);
             }
+            return;
+        }
+
+        const lastSeq = sequences.current[serviceId];
+        if (lastSeq !== undefined && message.seq <= lastSeq) return; // Already applied or covered by the snapshot
+        if (lastSeq === undefined || message.from_seq > lastSeq + 1) {
+            // Missed deltas; ask for a fresh snapshot
+            sendJsonMessage({ type: 'resync', service_id: serviceId });
+            return;
         }
-    }, [lastJsonMessage, selectedService]);
+        sequences.current[serviceId] = message.seq;
+        if (serviceId !== selectedService) return;
+
+        setQueue(current => {
+            let next = current;
+            for (const delta of message.deltas) {
+                const entry: StaffQueueEntry = delta.entry;
+                next = next.filter(e => e.id !== entry.id);
+                if (delta.op !== 'removed') {
+                    next = [...next, entry];
+                }
+            }
+            return next.sort((a, b) => a.created_at.localeCompare(b.created_at));
+        });
+    }, [lastJsonMessage, selectedService, sendJsonMessage]);
 
 
     const callNextMutation = useMutation(() => callNextUser(selectedService!));
@@ -18,7 +18,7 @@ const MyQueueStatus: React.FC = () => {
   
   const [callMessage, setCallMessage] = useState<string | null>(null);
   const [customNotification, setCustomNotification] = useState<string | null>(null);
-  const lastJsonMessage = useWebSocket();
+  const { lastJsonMessage } = useWebSocket();
 
   useEffect(() => {
     if (lastJsonMessage?.type === 'send_notification') {
@@ -74,6 +74,11 @@ const MyQueueStatus: React.FC = () => {
                 <div>
                   <p className="font-semibold">{entry.service.name}</p>
                   <p className="text-sm text-gray-600">Token: <span className="font-bold">{entry.token_number}</span></p>
+                  {entry.position !== null && entry.eta_seconds !== null && (
+                    <p className="text-sm text-gray-600">
+                      Position: <span className="font-bold">{entry.position}</span> · about {Math.max(1, Math.round(entry.eta_seconds / 60))} min
+                    </p>
+                  )}
                 </div>
                 <span className={`px-2 py-1 text-xs font-semibold text-white rounded-full ${
                     entry.status === 'waiting' ? 'bg-yellow-500' :
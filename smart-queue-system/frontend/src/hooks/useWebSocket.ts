@@ -1,4 +1,4 @@
-import { useState, useEffect, useRef } from 'react';
+import { useState, useEffect, useRef, useCallback } from 'react';
 import { getAuthTokens } from '../utils/auth';
 
 const useWebSocket = () => {
@@ -27,7 +27,13 @@ const useWebSocket = () => {
     };
   }, [webSocketUrl]);
 
-  return lastJsonMessage;
+  const sendJsonMessage = useCallback((message: any) => {
+    if (ws.current?.readyState === WebSocket.OPEN) {
+      ws.current.send(JSON.stringify(message));
+    }
+  }, []);
+
+  return { lastJsonMessage, sendJsonMessage };
 };
 
 export default useWebSocket;
@@ -31,5 +31,24 @@ export interface Service {
     token_number: number;
     status: 'waiting' | 'in_progress' | 'completed' | 'skipped' | 'rejected';
     created_at: string;
+    // Set while waiting: place in line and expected seconds until called
+    position: number | null;
+    eta_seconds: number | null;
+  }
+  
+  // Compact entry used by the staff queue snapshot/delta protocol
+  export interface StaffQueueEntry {
+    id: number;
+    user: Pick<User, 'id' | 'username'>;
+    counter: number | null;
+    token_number: number;
+    status: QueueEntry['status'];
+    created_at: string;
+  }
+
+  // Queue list returned with ?compact=true: services and counters are side-loaded once by id
+  export interface CompactQueueList {
+    entries: (StaffQueueEntry & Pick<QueueEntry, 'position' | 'eta_seconds'> & { service: number })[];
+    services: Record<number, Pick<Service, 'id' | 'name'>>;
+    counters: Record<number, Pick<Counter, 'id' | 'name'>>;
   }
-  
\ No newline at end of file